@@ -2,7 +2,13 @@ import collections
 from decimal import Decimal
 
 from opnreco.models import perms
-from opnreco.models.db import FileMovement, Reco, TransferRecord, now_func
+from opnreco.models.db import (
+    FileMovement,
+    Reco,
+    RecoSummary,
+    TransferRecord,
+    now_func,
+)
 from opnreco.models.site import PeriodResource
 from opnreco.param import get_offset_limit
 from pyramid.view import view_config
@@ -28,55 +34,28 @@ def internal_recos_api(context, request):
     owner = request.owner
     owner_id = owner.id
 
-    ts_c = (
-        dbsession.query(func.min(FileMovement.ts))
-        .filter(FileMovement.reco_id == Reco.id)
-        .correlate(Reco)
-        .as_scalar()
-        .label("ts")
-    )
-
-    vault_delta_c = (
-        dbsession.query(func.sum(FileMovement.vault_delta))
-        .filter(FileMovement.reco_id == Reco.id)
-        .correlate(Reco)
-        .as_scalar()
-        .label("vault_delta")
-    )
-
-    wallet_delta_c = (
-        dbsession.query(func.sum(FileMovement.wallet_delta))
-        .filter(FileMovement.reco_id == Reco.id)
-        .correlate(Reco)
-        .as_scalar()
-        .label("wallet_delta")
-    )
-
-    movement_count_c = (
-        dbsession.query(func.count(FileMovement.movement_id))
-        .filter(FileMovement.reco_id == Reco.id)
-        .correlate(Reco)
-        .as_scalar()
-        .label("movement_count")
-    )
-
     # List the internal reconciliations in the period.
     # Since recos can contain any number of account entries and movements,
     # list just the reco IDs, delta totals, and dates. Get the reco-specific
     # account entries and movements after ordering and pagination.
-    query = dbsession.query(
-        Reco.id.label("reco_id"),
-        cast(None, BigInteger).label("movement_id"),
-        ts_c,
-        vault_delta_c,
-        wallet_delta_c,
-        cast(None, String).label("workflow_type"),
-        cast(None, String).label("transfer_id"),
-    ).filter(
-        Reco.owner_id == owner_id,
-        Reco.period_id == period_id,
-        Reco.internal,
-        movement_count_c > 0,
+    # The totals and dates come from reco_summary.
+    query = (
+        dbsession.query(
+            Reco.id.label("reco_id"),
+            cast(None, BigInteger).label("movement_id"),
+            RecoSummary.min_ts.label("ts"),
+            RecoSummary.vault_delta.label("vault_delta"),
+            RecoSummary.wallet_delta.label("wallet_delta"),
+            cast(None, String).label("workflow_type"),
+            cast(None, String).label("transfer_id"),
+        )
+        .join(RecoSummary, RecoSummary.reco_id == Reco.id)
+        .filter(
+            Reco.owner_id == owner_id,
+            Reco.period_id == period_id,
+            Reco.internal,
+            RecoSummary.movement_count > 0,
+        )
     )
 
     total_cte = query.cte("total_cte")
@@ -33,12 +33,17 @@ from opnreco.viewcommon import (
 )
 from pyramid.httpexceptions import HTTPBadRequest
 from pyramid.view import view_config
-from sqlalchemy import and_, case, func, literal, or_
+from sqlalchemy import Date, and_, case, func, literal
+from sqlalchemy.dialects.postgresql import DATERANGE
+from sqlalchemy.exc import IntegrityError
 
 log = logging.getLogger(__name__)
 zero = Decimal("0")
 null = None
 
+# The SQLSTATE of exclusion constraint violations
+exclusion_violation = "23P01"
+
 
 @view_config(
     name="period-list",
@@ -283,50 +288,12 @@ def period_state_api(context, request):
     return res
 
 
-def day_intersects(day, range_start, range_end, is_start):
-    """Make a SQL expr that checks whether a day intersects with a date range."""
-    if is_start:
-        no_bound_test = range_start == null
-    else:
-        no_bound_test = range_end == null
-
-    return or_(
-        and_(
-            # Yes if the range is unlimited, regardless of the day.
-            range_start == null,
-            range_end == null,
-        ),
-        and_(
-            # Yes if the day is not given and the range has no boundary
-            # at the specified endpoint (the start or the end).
-            day == null,
-            no_bound_test,
-        ),
-        and_(
-            # Yes if the day is given, the range has a start, and
-            # the day is at the start or later.
-            day != null,
-            range_start != null,
-            range_end == null,
-            day >= range_start,
-        ),
-        and_(
-            # Yes if the day is given, the range has an end, and
-            # the day is at the end or earlier.
-            day != null,
-            range_start == null,
-            range_end != null,
-            day <= range_end,
-        ),
-        and_(
-            # Yes if the day is given, the range is fully bounded, and
-            # the day is within the range.
-            day != null,
-            range_start != null,
-            range_end != null,
-            day >= range_start,
-            day <= range_end,
-        ),
+def date_overlap_error():
+    return HTTPBadRequest(
+        json_body={
+            "error": "date_overlap",
+            "error_description": "The date range specified overlaps another period.",
+        }
     )
 
 
@@ -335,44 +302,12 @@ def detect_date_overlap(dbsession, period, new_start_date, new_end_date):
 
     Return the first overlapping period.
     """
-
-    def has_overlap():
-        """Make a SQL expression that checks whether the new range intersects
-        with an existing range.
-        """
-        new_start_date1 = literal(None) if new_start_date is None else new_start_date
-        new_end_date1 = literal(None) if new_end_date is None else new_end_date
-
-        return or_(
-            day_intersects(
-                # Yes if the new start date intersects with the period.
-                new_start_date1,
-                Period.start_date,
-                Period.end_date,
-                True,
-            ),
-            day_intersects(
-                # Yes if the new end date intersects with the period.
-                new_end_date1,
-                Period.start_date,
-                Period.end_date,
-                False,
-            ),
-            day_intersects(
-                # Yes if the period start date intersects with the new range.
-                Period.start_date,
-                new_start_date1,
-                new_end_date1,
-                True,
-            ),
-            day_intersects(
-                # Yes if the period end date intersects with the new range.
-                Period.end_date,
-                new_start_date1,
-                new_end_date1,
-                False,
-            ),
-        )
+    new_range = func.daterange(
+        literal(new_start_date, Date),
+        literal(new_end_date, Date),
+        "[]",
+        type_=DATERANGE,
+    )
 
     overlap_row = (
         dbsession.query(Period.id)
@@ -380,7 +315,7 @@ def detect_date_overlap(dbsession, period, new_start_date, new_end_date):
             Period.owner_id == period.owner_id,
             Period.file_id == period.file_id,
             Period.id != period.id,
-            has_overlap(),
+            Period.date_range.overlaps(new_range),
         )
         .order_by(Period.start_date)
         .first()
@@ -502,14 +437,7 @@ def edit_period(request, period, appstruct, event_type, adding_period=False):
         new_end_date=end_date,
     )
     if overlap_row is not None:
-        raise HTTPBadRequest(
-            json_body={
-                "error": "date_overlap",
-                "error_description": (
-                    "The date range specified overlaps another period."
-                ),
-            }
-        )
+        raise date_overlap_error()
 
     if close and (start_date is None or end_date is None):
         raise HTTPBadRequest(
@@ -528,11 +456,19 @@ def edit_period(request, period, appstruct, event_type, adding_period=False):
 
     if adding_period:
         dbsession.add(period)
-        dbsession.flush()  # Assign period.id
+
+    # Flush now (assigning period.id if adding the period) so the
+    # database rejects an overlap created by a concurrent edit.
+    try:
+        dbsession.flush()
+    except IntegrityError as e:
+        if getattr(e.orig, "pgcode", None) == exclusion_violation:
+            raise date_overlap_error()
+        raise
 
     move_counts = {}
 
-    movement_op = MovementReassignOp(owner=owner)
+    movement_op = MovementReassignOp()
     account_entry_op = AccountEntryReassignOp()
 
     if close:
@@ -771,7 +707,7 @@ def period_delete(context, request):
 
     move_counts = {}
 
-    movement_op = MovementReassignOp(owner=owner)
+    movement_op = MovementReassignOp()
     account_entry_op = AccountEntryReassignOp()
 
     # Push all the unreconciled movements and account entries in this period
@@ -17,6 +17,7 @@ from opnreco.models.db import (
 )
 from opnreco.models.site import PeriodResource
 from opnreco.param import parse_amount
+from opnreco.textsearch import contains, similarity_order
 from opnreco.viewcommon import (
     bad_request,
     configure_dblog,
@@ -25,7 +26,7 @@ from opnreco.viewcommon import (
 )
 from pyramid.httpexceptions import HTTPBadRequest
 from pyramid.view import view_config
-from sqlalchemy import String, and_, cast, func, or_
+from sqlalchemy import and_, or_
 
 zero = Decimal()
 null = None
@@ -53,6 +54,32 @@ def start_movement_query(dbsession, owner_id, file_id):
     )
 
 
+def amount_filter(amount_parsed, abs_delta, delta):
+    """Make a filter that matches a parsed amount search.
+
+    The filter compares the stored absolute delta column, abs_delta, so
+    the search can use an index range scan. The sign of the signed
+    delta column is checked only when the search specified a sign.
+    """
+    amount_abs = abs(amount_parsed)
+    sign_filters = ()
+    if amount_parsed.sign < 0:
+        sign_filters = ((delta < 0),)
+    elif amount_parsed.sign > 0:
+        sign_filters = ((delta > 0),)
+
+    if "." in amount_parsed.amount_input:
+        # Exact amount.
+        return and_(abs_delta == amount_abs, *sign_filters)
+    else:
+        # The search omitted the subunit value.
+        return and_(
+            abs_delta >= amount_abs,
+            abs_delta < amount_abs + 1,
+            *sign_filters,
+        )
+
+
 def serialize_movement_rows(movement_rows):
     return [
         {
@@ -261,51 +288,25 @@ def reco_search_movement(context, request, final=False):
 
     amount_parsed = parse_amount(amount_input, currency=period.file.currency)
     if amount_parsed is not None:
-        amount_abs = abs(amount_parsed)
-        vault_sign_filters = ()
-        wallet_sign_filters = ()
-        if amount_parsed.sign < 0:
-            vault_sign_filters = ((FileMovement.vault_delta < 0),)
-            wallet_sign_filters = ((FileMovement.wallet_delta < 0),)
-        elif amount_parsed.sign > 0:
-            vault_sign_filters = ((FileMovement.vault_delta > 0),)
-            wallet_sign_filters = ((FileMovement.wallet_delta > 0),)
-
-        if "." in amount_parsed.amount_input:
-            # Exact amount.
-            filters.append(
-                or_(
-                    and_(
-                        func.abs(FileMovement.vault_delta) == amount_abs,
-                        *vault_sign_filters
-                    ),
-                    and_(
-                        func.abs(FileMovement.wallet_delta) == amount_abs,
-                        *wallet_sign_filters
-                    ),
-                )
-            )
-        else:
-            # The search omitted the subunit value.
-            filters.append(
-                or_(
-                    and_(
-                        func.abs(FileMovement.vault_delta) >= amount_abs,
-                        func.abs(FileMovement.vault_delta) < amount_abs + 1,
-                        *vault_sign_filters
-                    ),
-                    and_(
-                        func.abs(FileMovement.wallet_delta) >= amount_abs,
-                        func.abs(FileMovement.wallet_delta) < amount_abs + 1,
-                        *wallet_sign_filters
-                    ),
-                )
+        filters.append(
+            or_(
+                amount_filter(
+                    amount_parsed,
+                    FileMovement.abs_vault_delta,
+                    FileMovement.vault_delta,
+                ),
+                amount_filter(
+                    amount_parsed,
+                    FileMovement.abs_wallet_delta,
+                    FileMovement.wallet_delta,
+                ),
             )
+        )
 
     match = re.search(r"[A-Z]+", amount_input, re.I)
     if match is not None:
         currency = match.group(0).upper()
-        filters.append(FileMovement.currency.like(func.concat("%", currency, "%")))
+        filters.append(contains(FileMovement.currency, currency))
 
     if date_input and tzoffset_input:
         try:
@@ -339,11 +340,7 @@ def reco_search_movement(context, request, final=False):
     if match is not None:
         transfer_str = match.group(0).replace("-", "")
         if transfer_str:
-            filters.append(
-                cast(TransferRecord.transfer_id, String).like(
-                    func.concat("%", transfer_str, "%")
-                )
-            )
+            filters.append(contains(TransferRecord.transfer_id, transfer_str))
 
     if not filters:
         return []
@@ -412,33 +409,14 @@ def reco_search_account_entries(context, request, final=False):
 
     delta_parsed = parse_amount(delta_input, currency=period.file.currency)
     if delta_parsed is not None:
-        delta_abs = abs(delta_parsed)
-
-        sign_filters = ()
-        if delta_parsed.sign < 0:
-            sign_filters = ((AccountEntry.delta < 0),)
-        elif delta_parsed.sign > 0:
-            sign_filters = ((AccountEntry.delta > 0),)
-
-        if "." in delta_parsed.amount_input:
-            # Exact amount.
-            filters.append(
-                and_(func.abs(AccountEntry.delta) == delta_abs, *sign_filters)
-            )
-        else:
-            # The search omitted the subunit value.
-            filters.append(
-                and_(
-                    func.abs(AccountEntry.delta) >= delta_abs,
-                    func.abs(AccountEntry.delta) < delta_abs + 1,
-                    *sign_filters
-                )
-            )
+        filters.append(
+            amount_filter(delta_parsed, AccountEntry.abs_delta, AccountEntry.delta)
+        )
 
     match = re.search(r"[A-Z]+", delta_input, re.I)
     if match is not None:
         currency = match.group(0).upper()
-        filters.append(AccountEntry.currency.like(func.concat("%", currency, "%")))
+        filters.append(contains(AccountEntry.currency, currency))
 
     if entry_date_input:
         try:
@@ -451,7 +429,7 @@ def reco_search_account_entries(context, request, final=False):
 
     if description_input:
         filters.append(
-            AccountEntry.description.ilike(func.concat("%", description_input, "%"))
+            contains(AccountEntry.description, description_input, case_sensitive=False)
         )
 
     if not filters:
@@ -477,6 +455,8 @@ def reco_search_account_entries(context, request, final=False):
             *filters
         )
         .order_by(
+            # Rank the closest descriptions first if pg_trgm is available.
+            *similarity_order(dbsession, AccountEntry.description, description_input),
             AccountEntry.entry_date,
             AccountEntry.description,
             AccountEntry.id,
@@ -821,23 +801,27 @@ class RecoSave:
         filters = []
         if new_movements:
             filters.append(
-                ~FileMovement.movement_id.in_(m.movement_id for m in new_movements)
+                ~FileMovement.movement_id.in_([m.movement_id for m in new_movements])
             )
 
-        old_movements = (
+        # Update the movements in one statement so the statement-level
+        # triggers run once rather than once per movement.
+        (
             dbsession.query(FileMovement)
             .filter(
                 FileMovement.owner_id == owner_id,
                 FileMovement.reco_id == self.reco_id,
                 *filters
             )
-            .all()
+            .update(
+                {
+                    "reco_id": None,
+                    "surplus_delta": -FileMovement.wallet_delta,
+                },
+                synchronize_session="fetch",
+            )
         )
 
-        for m in old_movements:
-            m.reco_id = None
-            m.surplus_delta = -m.wallet_delta
-
     def remove_old_account_entries(self, new_account_entries):
         """Remove old account entries from the reco."""
         request = self.request
@@ -849,19 +833,16 @@ class RecoSave:
         if new_account_entry_ids:
             filters.append(~AccountEntry.id.in_(new_account_entry_ids))
 
-        old_account_entries = (
+        (
             dbsession.query(AccountEntry)
             .filter(
                 AccountEntry.owner_id == owner_id,
                 AccountEntry.reco_id == self.reco_id,
                 *filters
             )
-            .all()
+            .update({"reco_id": None}, synchronize_session="fetch")
         )
 
-        for e in old_account_entries:
-            e.reco_id = None
-
     def save(self, reco, new_movements, new_account_entries):
         request = self.request
         dbsession = request.dbsession
@@ -906,28 +887,58 @@ class RecoSave:
             reco.comment = comment
             added = False
 
-        for m in new_movements:
-            m.reco_id = reco_id
-            # Reassign the movement to the reco's period.
-            m.period_id = period_id
+        # Update the movements and account entries with one statement each
+        # so the statement-level triggers run once per table.
+        if new_movements:
             if reco_type == "wallet_only":
                 # Wallet-only reconciliations should have no effect on
                 # the surplus amount.
-                m.surplus_delta = zero
+                surplus_delta = zero
             elif reco_type == "vault_only":
                 # Vault-only reconciliations expect the surplus to change
                 # with the vault.
-                m.surplus_delta = m.vault_delta
+                surplus_delta = FileMovement.vault_delta
             else:
                 # Other reconciliations expect the surplus to change
                 # inversely to the wallet.
-                m.surplus_delta = -m.wallet_delta
+                surplus_delta = -FileMovement.wallet_delta
+            (
+                dbsession.query(FileMovement)
+                .filter(
+                    FileMovement.owner_id == owner_id,
+                    FileMovement.file_id == self.period.file_id,
+                    FileMovement.movement_id.in_(
+                        [m.movement_id for m in new_movements]
+                    ),
+                )
+                .update(
+                    {
+                        "reco_id": reco_id,
+                        # Reassign the movements to the reco's period.
+                        "period_id": period_id,
+                        "surplus_delta": surplus_delta,
+                    },
+                    synchronize_session="fetch",
+                )
+            )
 
-        for entry in new_account_entries:
-            assert entry.id is not None
-            entry.reco_id = reco_id
-            # Reassign the entry to the reco's period
-            entry.period_id = period_id
+        if new_account_entries:
+            assert all(entry.id is not None for entry in new_account_entries)
+            (
+                dbsession.query(AccountEntry)
+                .filter(
+                    AccountEntry.owner_id == owner_id,
+                    AccountEntry.id.in_([e.id for e in new_account_entries]),
+                )
+                .update(
+                    {
+                        "reco_id": reco_id,
+                        # Reassign the entries to the reco's period.
+                        "period_id": period_id,
+                    },
+                    synchronize_session="fetch",
+                )
+            )
 
         dbsession.add(
             OwnerLog(
@@ -2,6 +2,7 @@ import pytz
 from opnreco.models import perms
 from opnreco.models.db import OwnerLog
 from opnreco.models.site import API
+from opnreco.viewcommon import get_tzname, update_local_dates
 from pyramid.httpexceptions import HTTPBadRequest
 from pyramid.view import view_config
 
@@ -39,6 +40,7 @@ def set_tzname(request):
         )
 
     owner = request.owner
+    changed = tzname != get_tzname(owner)
     owner.tzname = tzname
     request.dbsession.add(
         OwnerLog(
@@ -53,4 +55,7 @@ def set_tzname(request):
         )
     )
 
+    if changed:
+        update_local_dates(request, owner, event_type="tzname_change")
+
     return settings_api(request)
@@ -27,7 +27,7 @@ from pyramid.decorator import reify
 from pyramid.httpexceptions import HTTPBadRequest
 from pyramid.response import Response
 from pyramid.view import view_config
-from sqlalchemy import case, func
+from sqlalchemy import case, func, insert
 from xlrd.formula import cellname
 from xlrd.xldate import xldate_as_tuple
 
@@ -846,12 +846,15 @@ class StatementUploadAPI:
         "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
     )
     open_excel_extensions = (".xlsx",)
+    # The number of AccountEntry rows to write in each flush.
+    entry_batch_size = 1000
 
     def __init__(self, context, request):
         self.context = context
         self.request = request
         self.currency = context.period.file.currency
         self.statement = None
+        self.pending_entries = []
 
     def __call__(self):
         request = self.request
@@ -960,12 +963,6 @@ class StatementUploadAPI:
         return statement
 
     def handle_old_excel(self):
-        period = self.context.period
-        file = period.file
-        dbsession = self.request.dbsession
-        owner = self.request.owner
-        owner_id = owner.id
-
         content = self.content
         try:
             book = xlrd.open_workbook(file_contents=content)
@@ -979,7 +976,7 @@ class StatementUploadAPI:
                 }
             )
 
-        statement = self.add_statement("Spreadsheet")
+        self.add_statement("Spreadsheet")
 
         for sheetx, sheet in enumerate(book.sheets()):
             # Look for a heading row.
@@ -1009,70 +1006,11 @@ class StatementUploadAPI:
             for rowx, row in enumerate(sheet.get_rows()):
                 if rowx <= heading_rowx:
                     continue
+                attrs = self.parse_excel_row(book, row, rowx, column_names, sheet_name)
+                if attrs is not None:
+                    self.add_entry(attrs)
 
-                attrs = {
-                    "sheet": sheet_name,
-                    "row": rowx + 1,
-                }
-                for colx, cell in enumerate(row):
-                    if not cell.value:
-                        continue
-                    column_name = column_names[colx]
-                    try:
-                        info = self.parse_excel_cell(book, cell, column_name)
-                    except Exception as e:
-                        error_description = (
-                            "Unable to parse %s cell %s on sheet %s. "
-                            "Cell contents: '%s', error: %s, %s"
-                            % (
-                                column_name,
-                                cellname(rowx, colx),
-                                sheet_name,
-                                cell.value,
-                                type(e),
-                                e,
-                            )
-                        )
-                        log.exception(error_description)
-                        raise HTTPBadRequest(
-                            json_body={
-                                "error": "parse_error",
-                                "error_description": error_description,
-                            }
-                        )
-                    else:
-                        if info:
-                            k, v = info
-                            attrs[k] = v
-
-                if "delta" not in attrs or "entry_date" not in attrs:
-                    # Empty or incomplete row.
-                    continue
-
-                if not attrs["delta"]:
-                    # Ignore zero amount rows.
-                    continue
-
-                sign = attrs.pop("sign", None)
-                if sign:
-                    # Force the sign of the amount.
-                    attrs["delta"] = abs(attrs["delta"]) * sign
-
-                if not attrs.get("description"):
-                    attrs["description"] = ""
-
-                dbsession.add(
-                    AccountEntry(
-                        owner_id=owner_id,
-                        file_id=period.file_id,
-                        period_id=period.id,
-                        statement_id=statement.id,
-                        loop_id="0",
-                        currency=file.currency,
-                        reco_id=None,
-                        **attrs,
-                    )
-                )
+        self.flush_entries()
 
     def parse_excel_cell(self, book, cell, column_name):
         """Return (AccountEntry attr, value) or None.
@@ -1104,17 +1042,104 @@ class StatementUploadAPI:
 
         return None
 
-    def handle_open_excel(self):
-        """Handle a .xlsx (Excel open format) upload"""
+    def parse_excel_row(self, book, row, rowx, column_names, sheet_name):
+        """Return the AccountEntry attrs for a spreadsheet row or None.
+
+        Return None for empty, incomplete, and zero amount rows.
+        """
+        attrs = {
+            "sheet": sheet_name,
+            "row": rowx + 1,
+        }
+        for colx, cell in enumerate(row):
+            if not cell.value or colx >= len(column_names):
+                continue
+            column_name = column_names[colx]
+            try:
+                info = self.parse_excel_cell(book, cell, column_name)
+            except Exception as e:
+                error_description = (
+                    "Unable to parse %s cell %s on sheet %s. "
+                    "Cell contents: '%s', error: %s, %s"
+                    % (
+                        column_name,
+                        cellname(rowx, colx),
+                        sheet_name,
+                        cell.value,
+                        type(e),
+                        e,
+                    )
+                )
+                log.exception(error_description)
+                raise HTTPBadRequest(
+                    json_body={
+                        "error": "parse_error",
+                        "error_description": error_description,
+                    }
+                )
+            else:
+                if info:
+                    k, v = info
+                    attrs[k] = v
+
+        if "delta" not in attrs or "entry_date" not in attrs:
+            # Empty or incomplete row.
+            return None
+
+        if not attrs["delta"]:
+            # Ignore zero amount rows.
+            return None
+
+        sign = attrs.pop("sign", None)
+        if sign:
+            # Force the sign of the amount.
+            attrs["delta"] = abs(attrs["delta"]) * sign
+
+        if not attrs.get("description"):
+            attrs["description"] = ""
+
+        return attrs
+
+    def add_entry(self, attrs):
+        """Add an AccountEntry to the statement, writing in batches."""
         period = self.context.period
-        file = period.file
-        dbsession = self.request.dbsession
-        owner = self.request.owner
-        owner_id = owner.id
+        self.pending_entries.append(
+            {
+                "owner_id": self.request.owner.id,
+                "file_id": period.file_id,
+                "period_id": period.id,
+                "statement_id": self.statement.id,
+                "loop_id": "0",
+                "currency": self.currency,
+                "reco_id": None,
+                **attrs,
+            }
+        )
+        if len(self.pending_entries) >= self.entry_batch_size:
+            self.flush_entries()
+
+    def flush_entries(self):
+        """Write the pending AccountEntry rows in one multi-row INSERT.
+
+        The statement-level triggers on account_entry write the
+        account_entry_log rows and period sums for the whole batch.
+        """
+        entries = self.pending_entries
+        if not entries:
+            return
+        self.request.dbsession.execute(insert(AccountEntry.__table__).values(entries))
+        self.pending_entries = []
+
+    def handle_open_excel(self):
+        """Handle a .xlsx (Excel open format) upload.
 
+        Read the workbook in openpyxl's read-only mode, which streams rows
+        from the XML rather than loading every cell, and read each sheet
+        once.
+        """
         content: bytes = self.content  # type: ignore
         try:
-            book = openpyxl.load_workbook(io.BytesIO(content))
+            book = openpyxl.load_workbook(io.BytesIO(content), read_only=True)
         except Exception as e:
             raise HTTPBadRequest(
                 json_body={
@@ -1125,97 +1150,56 @@ class StatementUploadAPI:
                 }
             )
 
-        statement = self.add_statement("Spreadsheet")
-
-        for sheetx, sheet in enumerate(book):
-            # Look for a heading row.
-            # The heading must contain at least "date" and "amount".
-            column_names = None
-            heading_rowx = -1
-            for rowx, row in enumerate(sheet.rows):
-                texts = [str(cell.value).strip().lower() for cell in row]
-                if "date" in texts and "amount" in texts:
-                    # Found the heading.
-                    column_names = tuple(texts)
-                    heading_rowx = rowx
-            if not column_names:
-                # No heading row found. Assume default columns.
-                column_names = ("date", "amount", "description")
+        self.add_statement("Spreadsheet")
 
-            if "date" not in column_names or "amount" not in column_names:
-                # Skip this sheet.
-                continue
+        try:
+            for sheetx, sheet in enumerate(book):
+                sheet_name = book.sheetnames[sheetx].strip() or str(sheetx + 1)
+                if sheet_name.lower().startswith("sheet"):
+                    # Remove the redundant word.
+                    sheet_name = sheet_name[5:].strip()
+                self.import_open_excel_sheet(book, sheet, sheet_name)
+        finally:
+            book.close()
 
-            sheet_name = book.sheetnames[sheetx].strip() or str(sheetx + 1)
-            if sheet_name.lower().startswith("sheet"):
-                # Remove the redundant word.
-                sheet_name = sheet_name[5:].strip()
+        self.flush_entries()
 
-            # Parse the sheet and add AccountEntry rows.
-            for rowx, row in enumerate(sheet.rows):
-                if rowx <= heading_rowx:
-                    continue
+    def get_heading(self, row) -> tuple[str, ...] | None:
+        """If the row is a heading row, return the column names.
 
-                attrs = {
-                    "sheet": sheet_name,
-                    "row": rowx + 1,
-                }
-                for colx, cell in enumerate(row):
-                    if not cell.value:
-                        continue
-                    column_name = column_names[colx]
-                    try:
-                        info = self.parse_excel_cell(book, cell, column_name)
-                    except Exception as e:
-                        error_description = (
-                            "Unable to parse %s cell %s on sheet %s. "
-                            "Cell contents: '%s', error: %s, %s"
-                            % (
-                                column_name,
-                                cellname(rowx, colx),
-                                sheet_name,
-                                cell.value,
-                                type(e),
-                                e,
-                            )
-                        )
-                        log.exception(error_description)
-                        raise HTTPBadRequest(
-                            json_body={
-                                "error": "parse_error",
-                                "error_description": error_description,
-                            }
-                        )
-                    else:
-                        if info:
-                            k, v = info
-                            attrs[k] = v
-
-                if "delta" not in attrs or "entry_date" not in attrs:
-                    # Empty or incomplete row.
-                    continue
+        The heading must contain at least "date" and "amount".
+        """
+        texts = tuple(str(cell.value).strip().lower() for cell in row)
+        if "date" in texts and "amount" in texts:
+            return texts
+        return None
 
-                if not attrs["delta"]:
-                    # Ignore zero amount rows.
-                    continue
+    def import_open_excel_sheet(self, book, sheet, sheet_name):
+        """Parse a read-only .xlsx sheet and add AccountEntry rows.
 
-                sign = attrs.pop("sign", None)
-                if sign:
-                    # Force the sign of the amount.
-                    attrs["delta"] = abs(attrs["delta"]) * sign
-
-                if not attrs.get("description"):
-                    attrs["description"] = ""
-
-                dbsession.add(
-                    AccountEntry(
-                        owner_id=owner_id,
-                        file_id=period.file_id,
-                        period_id=period.id,
-                        statement_id=statement.id,
-                        loop_id="0",
-                        currency=file.currency,
-                        reco_id=None,
-                        **attrs,
-                    )
-                )
+        Read the sheet twice: once to find the first heading row and once
+        to parse the rows after it. Both passes stream rows, so memory
+        doesn't grow with the sheet. If the sheet has no heading, assume
+        default columns. Later heading rows (as in a report that repeats
+        the heading on each page) are skipped.
+        """
+        column_names = None
+        heading_rowx = -1
+        for rowx, row in enumerate(sheet.iter_rows()):
+            column_names = self.get_heading(row)
+            if column_names is not None:
+                heading_rowx = rowx
+                break
+
+        if column_names is None:
+            # No heading row found. Assume default columns.
+            column_names = ("date", "amount", "description")
+
+        rows = sheet.iter_rows(min_row=heading_rowx + 2)
+        for rowx, row in enumerate(rows, start=heading_rowx + 1):
+            if self.get_heading(row) is not None:
+                # Skip a repeated heading.
+                continue
+            attrs = self.parse_excel_row(book, row, rowx, column_names, sheet_name)
+            if attrs is not None:
+                self.add_entry(attrs)
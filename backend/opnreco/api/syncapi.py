@@ -5,8 +5,17 @@ import pytz
 from opnreco.models import perms
 from opnreco.models.db import OPNDownload, OwnerLog
 from opnreco.models.site import API
+from opnreco.opnclient import get_opn_client
 from opnreco.syncbase import SyncBase, VerificationFailure
+from opnreco.syncjob import (
+    background_sync_enabled,
+    enqueue_sync_job,
+    get_sync_job,
+    get_sync_job_status,
+)
+from opnreco.syncprefetch import PrefetchedBatch, StalePrefetch, SyncCursor
 from opnreco.util import to_datetime
+from opnreco.viewcommon import get_tzname, update_local_dates
 from pyramid.httpexceptions import HTTPInsufficientStorage
 from pyramid.view import view_config
 
@@ -29,6 +38,7 @@ class SyncAPI(SyncBase):
                 params = {}
             tzname = params.get("tzname", "").strip()
             if tzname and tzname in pytz.all_timezones:
+                changed = tzname != get_tzname(owner)
                 owner.tzname = tzname
                 request.dbsession.add(
                     OwnerLog(
@@ -42,12 +52,53 @@ class SyncAPI(SyncBase):
                         },
                     )
                 )
+                if changed:
+                    update_local_dates(request, owner, event_type="tzname_init")
 
     def __call__(self):
+        self.set_tzname()
+
+        if background_sync_enabled():
+            return self.sync_in_background()
+
+        try:
+            return self.sync_batch()
+        except VerificationFailure as e:
+            # HTTP Error 507 is reasonably close to 'data verification error'.
+            raise HTTPInsufficientStorage(
+                json_body={
+                    "error": "verification_failure",
+                    "error_description": str(e),
+                }
+            )
+
+    def sync_in_background(self):
+        """Enqueue a SyncJob or report the progress of a SyncJob."""
         request = self.request
-        owner = self.owner
+        try:
+            params = request.json
+        except Exception:
+            params = {}
 
-        self.set_tzname()
+        job_id = params.get("job_id")
+        if job_id:
+            job = get_sync_job(request, job_id)
+        else:
+            job = enqueue_sync_job(request)
+
+        if job.state == "failed" and job.error_type == "verification_failure":
+            raise HTTPInsufficientStorage(
+                json_body={
+                    "error": "verification_failure",
+                    "error_description": job.error_description,
+                }
+            )
+
+        return get_sync_job_status(job)
+
+    def get_sync_cursor(self) -> SyncCursor:
+        """Get the parameters of the next history_sync request."""
+        owner = self.owner
 
         if owner.first_sync_ts is None:
             # Start a new sync. Download transfers created or changed
@@ -64,14 +115,36 @@ class SyncAPI(SyncBase):
             sync_ts = owner.last_sync_ts
             sync_transfer_id = owner.last_sync_transfer_id
             count_remain = False
-        sync_ts_iso = sync_ts.isoformat() + "Z"
 
-        transfers_download = self.download_batch(
-            sync_ts_iso=sync_ts_iso,
+        return SyncCursor(
+            sync_ts_iso=sync_ts.isoformat() + "Z",
             sync_transfer_id=sync_transfer_id,
             count_remain=count_remain,
         )
 
+    def sync_batch(self, prefetched: PrefetchedBatch | None = None):
+        """Download and import one batch of transfers from OPN.
+
+        If a prefetched batch is provided, import it instead of
+        downloading. Raise StalePrefetch if it was requested with
+        a cursor other than the owner's current cursor.
+        """
+        request = self.request
+        owner = self.owner
+
+        cursor = self.get_sync_cursor()
+        sync_ts_iso = cursor.sync_ts_iso
+
+        if prefetched is not None:
+            if prefetched.cursor != cursor:
+                raise StalePrefetch(
+                    "Prefetched batch for %s does not match the sync cursor %s"
+                    % (prefetched.cursor, cursor)
+                )
+            transfers_download = prefetched.transfers_download
+        else:
+            transfers_download = self.download_batch(*cursor)
+
         dbsession = request.dbsession
         more = transfers_download["more"]
         now = datetime.datetime.utcnow()
@@ -137,18 +210,16 @@ class SyncAPI(SyncBase):
             )
         )
 
-        try:
-            self.import_transfer_records(transfers_download)
-            if not more:
-                self.sync_missing()
-        except VerificationFailure as e:
-            # HTTP Error 507 is reasonably close to 'data verification error'.
-            raise HTTPInsufficientStorage(
-                json_body={
-                    "error": "verification_failure",
-                    "error_description": str(e),
-                }
-            )
+        self.import_transfer_records(transfers_download)
+        if not more:
+            self.sync_missing()
+
+        # The latency counters are cumulative for the process.
+        log.info(
+            "OPN latency by endpoint after sync batch for owner %s: %s",
+            owner.id,
+            get_opn_client().get_stats(),
+        )
 
         return {
             "progress_percent": progress_percent,
@@ -0,0 +1,431 @@
+import datetime
+import re
+import unittest
+from decimal import Decimal
+from unittest import mock
+
+import pyramid.testing
+from opnreco.testing import DBSessionFixture
+from sqlalchemy import func
+
+
+def setup_module():
+    global dbsession_fixture
+    dbsession_fixture = DBSessionFixture()
+
+
+def teardown_module():
+    dbsession_fixture.close()
+
+
+class RecoSearchTestBase:
+    def setUp(self):
+        self.config = pyramid.testing.setUp()
+        self.dbsession, self.close_session = dbsession_fixture.begin_session()
+
+    def tearDown(self):
+        self.close_session()
+        pyramid.testing.tearDown()
+
+    def add_file(self):
+        from opnreco.models import db
+
+        dbsession = self.dbsession
+        self.owner = db.Owner(
+            id="102", title="Testy Owner", username="testowner", tzname="UTC"
+        )
+        dbsession.add(self.owner)
+        dbsession.flush()
+        dbsession.add(
+            db.File(
+                id=1239,
+                owner_id="102",
+                file_type="open_circ",
+                title="Test File",
+                currency="USD",
+                has_vault=True,
+            )
+        )
+        dbsession.flush()
+        dbsession.query(
+            func.set_config("opnreco.personal_id", "102", True),
+            func.set_config("opnreco.movement.event_type", "test", True),
+            func.set_config("opnreco.account_entry.event_type", "test", True),
+        ).one()
+
+        self.period = db.Period(owner_id="102", file_id=1239)
+        dbsession.add(self.period)
+        dbsession.flush()
+        self.statement = db.Statement(
+            owner_id="102", file_id=1239, period_id=self.period.id, source="test"
+        )
+        dbsession.add(self.statement)
+        dbsession.flush()
+
+    def add_movement(self, transfer_id, wallet_delta=0, vault_delta=Decimal("-1.00")):
+        from opnreco.models import db
+
+        dbsession = self.dbsession
+        ts = datetime.datetime(2018, 1, 15, 6, 0, 0)
+        record = db.TransferRecord(
+            owner_id="102",
+            transfer_id=transfer_id,
+            workflow_type="redeem",
+            start=ts,
+            currency="USD",
+            amount=Decimal("1.00"),
+            timestamp=ts,
+            next_activity="completed",
+            completed=True,
+            canceled=False,
+        )
+        dbsession.add(record)
+        dbsession.flush()
+        m = db.Movement(
+            owner_id="102",
+            transfer_record_id=record.id,
+            number=1,
+            amount_index=0,
+            loop_id="0",
+            currency="USD",
+            issuer_id="19",
+            from_id="19",
+            to_id="102",
+            amount=Decimal("1.00"),
+            action="test",
+            ts=ts,
+        )
+        dbsession.add(m)
+        dbsession.flush()
+        dbsession.add(
+            db.FileMovement(
+                owner_id="102",
+                movement_id=m.id,
+                file_id=1239,
+                peer_id="19",
+                loop_id=m.loop_id,
+                currency=m.currency,
+                issuer_id=m.issuer_id,
+                transfer_record_id=m.transfer_record_id,
+                ts=m.ts,
+                wallet_delta=wallet_delta,
+                vault_delta=vault_delta,
+                surplus_delta=-wallet_delta,
+                period_id=self.period.id,
+            )
+        )
+        dbsession.flush()
+        return m
+
+    def make_context(self):
+        from opnreco.models.site import PeriodResource
+
+        return PeriodResource(
+            parent=None,
+            name=str(self.period.id),
+            period=self.period,
+            file_archived=False,
+        )
+
+    def make_request(self, **params):
+        return pyramid.testing.DummyRequest(
+            dbsession=self.dbsession, owner=self.owner, json=params
+        )
+
+    def call_without_trgm(self, **params):
+        """Call the view without pg_trgm and list the SQL it executes.
+
+        Return a list of (statement, parameters).
+        """
+        from sqlalchemy import event
+
+        executed = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, *args):
+            executed.append((statement, parameters))
+
+        conn = self.dbsession.connection()
+        event.listen(conn, "before_cursor_execute", before_cursor_execute)
+        try:
+            with mock.patch("opnreco.textsearch.trgm_enabled", return_value=False):
+                res = self._call(**params)
+        finally:
+            event.remove(conn, "before_cursor_execute", before_cursor_execute)
+        return res, executed
+
+    def assert_one_pattern_param(self, executed, operator, pattern):
+        """Assert the search used one bind parameter as its pattern."""
+        [(sql, parameters)] = [
+            (sql, parameters) for (sql, parameters) in executed if operator in sql
+        ]
+        self.assertEqual(1, sql.count(operator))
+        self.assertNotIn("concat", sql)
+        self.assertNotIn("similarity", sql)
+        match = re.search(operator + r" %\((\w+)\)s", sql)
+        self.assertIsNotNone(match, sql)
+        self.assertEqual(pattern, parameters[match.group(1)])
+
+
+class Test_reco_search_account_entries(RecoSearchTestBase, unittest.TestCase):
+    def _call(self, **params):
+        from ..recoapi import reco_search_account_entries
+
+        return reco_search_account_entries(
+            self.make_context(), self.make_request(**params)
+        )
+
+    def add_entries(self):
+        from opnreco.models import db
+
+        self.add_file()
+        for day, description in [
+            (1, "Wire from Acme Widgets"),
+            (2, "ACME"),
+            (3, "Deposit"),
+            (4, "Acme Widget Co"),
+        ]:
+            self.dbsession.add(
+                db.AccountEntry(
+                    owner_id="102",
+                    file_id=1239,
+                    period_id=self.period.id,
+                    statement_id=self.statement.id,
+                    entry_date=datetime.date(2018, 1, day),
+                    loop_id="0",
+                    currency="USD",
+                    delta=Decimal(day),
+                    description=description,
+                )
+            )
+        self.dbsession.flush()
+
+    def test_description_matches_substring_ignoring_case(self):
+        self.add_entries()
+        with mock.patch("opnreco.textsearch.trgm_enabled", return_value=False):
+            res = self._call(description="acme")
+        self.assertEqual(
+            ["Wire from Acme Widgets", "ACME", "Acme Widget Co"],
+            [row["description"] for row in res],
+        )
+
+    def test_description_uses_one_ilike_param_without_trgm(self):
+        self.add_entries()
+        res, executed = self.call_without_trgm(description="acme")
+        self.assertEqual(3, len(res))
+        self.assert_one_pattern_param(executed, "ILIKE", "%acme%")
+
+    def test_description_ranked_by_similarity(self):
+        from opnreco.textsearch import trgm_enabled
+
+        self.add_entries()
+        if not trgm_enabled(self.dbsession):
+            self.skipTest("pg_trgm is not available")
+        res = self._call(description="Acme Widget Co")
+        self.assertEqual("Acme Widget Co", res[0]["description"])
+
+    def test_like_wildcards_pass_through(self):
+        self.add_entries()
+        res = self._call(description="Acme%Co")
+        self.assertEqual(["Acme Widget Co"], [row["description"] for row in res])
+
+    def test_exact_amount(self):
+        self.add_entries()
+        res = self._call(delta="2.00")
+        self.assertEqual(["ACME"], [row["description"] for row in res])
+
+    def test_whole_unit_amount(self):
+        from opnreco.models.db import AccountEntry
+
+        self.add_entries()
+        self.dbsession.query(AccountEntry).filter(
+            AccountEntry.description == "Deposit"
+        ).update({"delta": Decimal("-2.50")}, synchronize_session=False)
+        res = self._call(delta="2")
+        self.assertEqual(["ACME", "Deposit"], [row["description"] for row in res])
+
+    def test_signed_amount(self):
+        from opnreco.models.db import AccountEntry
+
+        self.add_entries()
+        self.dbsession.query(AccountEntry).filter(
+            AccountEntry.description == "Deposit"
+        ).update({"delta": Decimal("-2.00")}, synchronize_session=False)
+        res = self._call(delta="-2")
+        self.assertEqual(["Deposit"], [row["description"] for row in res])
+        res = self._call(delta="+2")
+        self.assertEqual(["ACME"], [row["description"] for row in res])
+
+    def test_no_filters(self):
+        self.add_entries()
+        self.assertEqual([], self._call())
+
+
+class Test_reco_search_movement(RecoSearchTestBase, unittest.TestCase):
+    def _call(self, **params):
+        from ..recoapi import reco_search_movement
+
+        return reco_search_movement(self.make_context(), self.make_request(**params))
+
+    def test_transfer_id_substring(self):
+        self.add_file()
+        self.add_movement("1234567890")
+        m2 = self.add_movement("5550001234")
+        res = self._call(transfer="000-1")
+        self.assertEqual([str(m2.id)], [row["id"] for row in res])
+
+    def test_transfer_id_uses_one_like_param_without_trgm(self):
+        self.add_file()
+        m = self.add_movement("5550001234")
+        res, executed = self.call_without_trgm(transfer="000-1")
+        self.assertEqual([str(m.id)], [row["id"] for row in res])
+        self.assert_one_pattern_param(executed, " LIKE", "%0001%")
+
+    def test_currency(self):
+        self.add_file()
+        self.add_movement("1234567890")
+        self.assertEqual(1, len(self._call(amount="1 usd")))
+        self.assertEqual([], self._call(amount="1 EUR"))
+
+    def test_amount_matches_vault_or_wallet_delta(self):
+        self.add_file()
+        m1 = self.add_movement("1234567890")
+        m2 = self.add_movement(
+            "5550001234", wallet_delta=Decimal("1.25"), vault_delta=0
+        )
+        self.add_movement("5550001235", wallet_delta=0, vault_delta=Decimal("2.00"))
+        res = self._call(amount="1")
+        self.assertEqual([str(m1.id), str(m2.id)], [row["id"] for row in res])
+        res = self._call(amount="1.25")
+        self.assertEqual([str(m2.id)], [row["id"] for row in res])
+        res = self._call(amount="-1")
+        self.assertEqual([str(m1.id)], [row["id"] for row in res])
+
+
+class Test_RecoSave(RecoSearchTestBase, unittest.TestCase):
+    def _call(self, **params):
+        from ..recoapi import RecoSave
+
+        request = pyramid.testing.DummyRequest(
+            dbsession=self.dbsession,
+            owner=self.owner,
+            personal_id="102",
+            remote_addr="127.0.0.1",
+            user_agent="Test UA",
+            json=params,
+        )
+        return RecoSave(self.make_context(), request)()
+
+    def add_entry(self, day):
+        from opnreco.models import db
+
+        entry = db.AccountEntry(
+            owner_id="102",
+            file_id=1239,
+            period_id=self.period.id,
+            statement_id=self.statement.id,
+            entry_date=datetime.date(2018, 1, day),
+            loop_id="0",
+            currency="USD",
+            delta=Decimal("1.00"),
+            description="Entry %d" % day,
+        )
+        self.dbsession.add(entry)
+        self.dbsession.flush()
+        return entry
+
+    def count_update_triggers(self):
+        """Count the statement-level update triggers on the reco members.
+
+        The reco_summary and period_sum triggers run once per statement
+        like this one. (The DDL is rolled back with the test transaction.)
+        """
+        from sqlalchemy import text
+
+        self.dbsession.execute(text("""
+create function test_count_update() returns trigger as $body$
+begin
+    perform set_config('opnreco.test_update_count', (coalesce(
+        nullif(current_setting('opnreco.test_update_count', true), ''),
+        '0')::int + 1)::text, true);
+    return null;
+end;
+$body$ language plpgsql;
+
+create trigger test_file_movement_update_trigger
+after update on file_movement
+    for each statement execute procedure test_count_update();
+
+create trigger test_account_entry_update_trigger
+after update on account_entry
+    for each statement execute procedure test_count_update();
+"""))
+
+        def get_count():
+            return int(
+                self.dbsession.execute(
+                    text(
+                        "select coalesce(nullif(current_setting("
+                        "'opnreco.test_update_count', true), ''), '0')"
+                    )
+                ).scalar()
+            )
+
+        return get_count
+
+    def get_summary(self, reco_id):
+        from opnreco.models import db
+
+        return (
+            self.dbsession.query(db.RecoSummary)
+            .filter(db.RecoSummary.reco_id == reco_id)
+            .populate_existing()
+            .one()
+        )
+
+    def test_multi_row_save_runs_triggers_once_per_table(self):
+        from opnreco.models import db
+
+        self.add_file()
+        movements = [self.add_movement("%d" % (1000 + i)) for i in range(3)]
+        entries = [self.add_entry(i + 1) for i in range(3)]
+        get_count = self.count_update_triggers()
+
+        res = self._call(
+            reco={
+                "reco_type": "standard",
+                "movements": [{"id": m.id} for m in movements],
+                "account_entries": [{"id": e.id} for e in entries],
+            }
+        )
+        self.assertTrue(res["ok"])
+        reco_id = res["reco_id"]
+        # One update of file_movement and one of account_entry.
+        self.assertEqual(2, get_count())
+        summary = self.get_summary(reco_id)
+        self.assertEqual(3, summary.movement_count)
+        self.assertEqual(3, summary.entry_count)
+        self.assertEqual(Decimal("3.00"), summary.account_delta)
+
+        # Remove one movement and one entry.
+        res = self._call(
+            reco_id=reco_id,
+            reco={
+                "reco_type": "standard",
+                "movements": [{"id": m.id} for m in movements[1:]],
+                "account_entries": [{"id": e.id} for e in entries[1:]],
+            },
+        )
+        # Removing and adding take one update of each table.
+        self.assertEqual(6, get_count())
+        summary = self.get_summary(reco_id)
+        self.assertEqual(2, summary.movement_count)
+        self.assertEqual(2, summary.entry_count)
+
+        fm = (
+            self.dbsession.query(db.FileMovement)
+            .filter(db.FileMovement.movement_id == movements[0].id)
+            .one()
+        )
+        self.assertIsNone(fm.reco_id)
+        self.assertEqual(-fm.wallet_delta, fm.surplus_delta)
+        self.assertIsNone(entries[0].reco_id)
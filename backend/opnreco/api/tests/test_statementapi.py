@@ -0,0 +1,218 @@
+import base64
+import datetime
+import io
+import unittest
+from decimal import Decimal
+
+import pyramid.testing
+from opnreco.testing import DBSessionFixture
+
+
+def setup_module():
+    global dbsession_fixture
+    dbsession_fixture = DBSessionFixture()
+
+
+def teardown_module():
+    dbsession_fixture.close()
+
+
+class TestStatementUploadAPI(unittest.TestCase):
+    def setUp(self):
+        self.config = pyramid.testing.setUp()
+        self.dbsession, self.close_session = dbsession_fixture.begin_session()
+
+    def tearDown(self):
+        self.close_session()
+        pyramid.testing.tearDown()
+
+    def _class(self):
+        from ..statementapi import StatementUploadAPI
+
+        return StatementUploadAPI
+
+    def _make(self, content, name="statement.xlsx"):
+        from opnreco.models import db
+        from opnreco.models.site import PeriodResource
+
+        dbsession = self.dbsession
+        owner = db.Owner(id="102", title="Testy Owner", username="testowner")
+        dbsession.add(owner)
+        dbsession.flush()
+        file = db.File(
+            id=1239,
+            owner_id="102",
+            file_type="open_circ",
+            title="Test File",
+            currency="USD",
+            has_vault=True,
+        )
+        dbsession.add(file)
+        dbsession.flush()
+        period = db.Period(owner_id="102", file_id=1239)
+        dbsession.add(period)
+        dbsession.flush()
+
+        context = PeriodResource(
+            parent=None, name=str(period.id), period=period, file_archived=False
+        )
+        request = pyramid.testing.DummyRequest(
+            dbsession=dbsession,
+            owner=owner,
+            personal_id="102",
+            remote_addr="127.0.0.1",
+            user_agent="Test UA",
+            json={
+                "b64": base64.b64encode(content).decode("ascii"),
+                "name": name,
+                "size": len(content),
+                "type": "",
+            },
+        )
+        return self._class()(context, request)
+
+    def make_xlsx(self, sheets):
+        import openpyxl
+
+        book = openpyxl.Workbook()
+        book.remove(book.active)
+        for title, rows in sheets:
+            sheet = book.create_sheet(title)
+            for row in rows:
+                sheet.append(row)
+        f = io.BytesIO()
+        book.save(f)
+        return f.getvalue()
+
+    def get_entries(self):
+        from opnreco.models import db
+
+        return (
+            self.dbsession.query(db.AccountEntry)
+            .order_by(db.AccountEntry.sheet, db.AccountEntry.row)
+            .all()
+        )
+
+    def test_open_excel_with_heading(self):
+        content = self.make_xlsx(
+            [
+                (
+                    "Sheet1",
+                    [
+                        ["First Bank statement"],
+                        [],
+                        ["Date", "Description", "Amount", "Sign"],
+                        ["2018-08-01", "Deposit", "12.34", "CR"],
+                        ["2018-08-02", "Zero", "0.00", "CR"],
+                        [datetime.datetime(2018, 8, 3), "Check", 5, "DR"],
+                        [],
+                        # A repeated heading is skipped.
+                        ["Date", "Description", "Amount", "Sign"],
+                        ["2018-08-04", "", "1.50"],
+                    ],
+                ),
+            ]
+        )
+        obj = self._make(content)
+        obj.entry_batch_size = 2
+        obj()
+
+        entries = self.get_entries()
+        self.assertEqual(
+            [
+                ("1", 4, datetime.date(2018, 8, 1), Decimal("12.34"), "Deposit"),
+                ("1", 6, datetime.date(2018, 8, 3), Decimal("-5"), "Check"),
+                ("1", 9, datetime.date(2018, 8, 4), Decimal("1.50"), ""),
+            ],
+            [(e.sheet, e.row, e.entry_date, e.delta, e.description) for e in entries],
+        )
+        self.assertEqual([], obj.pending_entries)
+
+    def test_open_excel_without_heading(self):
+        content = self.make_xlsx(
+            [("Activity", [["2018-08-01", "7.00", "Fee"], ["2018-08-02", "-3.00"]])]
+        )
+        obj = self._make(content)
+        obj()
+
+        entries = self.get_entries()
+        self.assertEqual(
+            [
+                ("Activity", 1, Decimal("7.00"), "Fee"),
+                ("Activity", 2, Decimal("-3.00"), ""),
+            ],
+            [(e.sheet, e.row, e.delta, e.description) for e in entries],
+        )
+
+    def test_open_excel_heading_after_many_rows(self):
+        rows = [["Report line %d" % i] for i in range(150)]
+        rows.append(["Date", "Amount"])
+        rows.append(["2018-08-01", "4.00"])
+        content = self.make_xlsx([("Sheet1", rows)])
+        obj = self._make(content)
+        obj()
+
+        entries = self.get_entries()
+        self.assertEqual(
+            [("1", 152, Decimal("4.00"))],
+            [(e.sheet, e.row, e.delta) for e in entries],
+        )
+
+    def test_open_excel_parse_error(self):
+        from pyramid.httpexceptions import HTTPBadRequest
+
+        content = self.make_xlsx(
+            [("Sheet1", [["Amount", "Date"], ["1.00", "someday"]])]
+        )
+        obj = self._make(content)
+        with self.assertRaises(HTTPBadRequest) as cm:
+            obj()
+        self.assertEqual("parse_error", cm.exception.json_body["error"])
+        self.assertIn("cell B2", cm.exception.json_body["error_description"])
+
+    def test_open_excel_bulk_insert_and_log(self):
+        from opnreco.models import db
+        from sqlalchemy import event
+
+        rows = [["Date", "Amount", "Description"]]
+        for i in range(5):
+            rows.append(["2018-08-%02d" % (i + 1), "%d.00" % (i + 1), "Entry %d" % i])
+        content = self.make_xlsx([("Sheet1", rows)])
+        obj = self._make(content)
+        obj.entry_batch_size = 3
+
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            if statement.startswith("INSERT INTO account_entry "):
+                statements.append(statement)
+
+        conn = self.dbsession.connection()
+        event.listen(conn, "before_cursor_execute", before_cursor_execute)
+        try:
+            obj()
+        finally:
+            event.remove(conn, "before_cursor_execute", before_cursor_execute)
+
+        # 5 rows in batches of 3.
+        self.assertEqual(2, len(statements))
+
+        entries = self.get_entries()
+        self.assertEqual(5, len(entries))
+        logs = (
+            self.dbsession.query(db.AccountEntryLog)
+            .order_by(db.AccountEntryLog.account_entry_id)
+            .all()
+        )
+        self.assertEqual(
+            [e.id for e in entries], [log.account_entry_id for log in logs]
+        )
+        self.assertEqual({"upload"}, {log.event_type for log in logs})
+        self.assertEqual({"102"}, {log.personal_id for log in logs})
+        self.assertEqual(
+            [e.description for e in entries], [log.description for log in logs]
+        )
+
+        period_sum = self.dbsession.query(db.PeriodSum).one()
+        self.assertEqual(Decimal("15.00"), period_sum.unreco_entries_delta)
+        self.assertEqual(0, period_sum.reco_entries_delta)
@@ -111,6 +111,26 @@ class TestSyncAPI(unittest.TestCase):
         records = self.dbsession.query(db.TransferRecord).all()
         self.assertEqual(0, len(records))
 
+    @responses.activate
+    def test_logs_opn_latency_after_batch(self):
+        responses.add(
+            responses.POST,
+            "https://opn.example.com:9999/wallet/history_sync",
+            json={
+                "results": [],
+                "more": False,
+                "first_sync_ts": None,
+                "last_sync_ts": None,
+            },
+        )
+        obj = self._make()
+        with self.assertLogs("opnreco.api.syncapi", level="INFO") as cm:
+            obj()
+
+        self.assertEqual(1, len(cm.output))
+        self.assertIn("after sync batch for owner 11", cm.output[0])
+        self.assertIn("/wallet/history_sync", cm.output[0])
+
     @responses.activate
     def test_redeem_from_sender_perspective(self):
         from opnreco.models import db
@@ -1722,3 +1742,328 @@ class TestSyncAPI(unittest.TestCase):
         self.assertEqual(1, len(events))
         event = events[0]
         self.assertEqual("sync_file_movements", event.event_type)
+
+    @responses.activate
+    def test_batch_inserts_rows_in_bulk(self):
+        from opnreco.models import db
+        from sqlalchemy import event
+
+        def _make_transfer_result(transfer_id):
+            return {
+                "id": transfer_id,
+                "workflow_type": "grant",
+                "start": "2018-08-01T04:05:06Z",
+                "currency": "USD",
+                "amount": "1.00",
+                "timestamp": "2018-08-01T04:05:08Z",
+                "next_activity": "completed",
+                "completed": True,
+                "canceled": False,
+                "sender_id": "19",
+                "sender_uid": "wingcash:19",
+                "sender_info": {
+                    "title": "Issuer",
+                },
+                "recipient_id": "11",
+                "recipient_uid": "wingcash:11",
+                "recipient_info": {
+                    "title": "Tester",
+                },
+                "movements": [
+                    {
+                        "number": 1,
+                        "timestamp": "2018-08-02T05:06:06Z",
+                        "action": "grant",
+                        "from_id": "19",
+                        "to_id": "11",
+                        "loops": [
+                            {
+                                "currency": "USD",
+                                "loop_id": "0",
+                                "amount": "1.00",
+                                "issuer_id": "19",
+                            }
+                        ],
+                    },
+                ],
+            }
+
+        transfer_ids = ["501", "502", "503", "504"]
+        responses.add(
+            responses.POST,
+            "https://opn.example.com:9999/wallet/history_sync",
+            json={
+                "results": [_make_transfer_result(tid) for tid in transfer_ids],
+                "more": False,
+                "first_sync_ts": "2018-08-01T04:05:10Z",
+                "last_sync_ts": "2018-08-01T04:05:11Z",
+            },
+        )
+        obj = self._make(owner_id="11")
+
+        statements = []
+
+        def before_cursor_execute(
+            conn, cursor, statement, parameters, context, executemany
+        ):
+            statements.append(statement)
+
+        connection = self.dbsession.connection()
+        event.listen(connection, "before_cursor_execute", before_cursor_execute)
+        try:
+            obj()
+        finally:
+            event.remove(connection, "before_cursor_execute", before_cursor_execute)
+
+        def count_inserts(table_name):
+            prefix = "INSERT INTO %s " % table_name
+            return len([s for s in statements if s.startswith(prefix)])
+
+        self.assertEqual(1, count_inserts("transfer_record"))
+        self.assertEqual(1, count_inserts("transfer_download_record"))
+        self.assertEqual(1, count_inserts("movement"))
+        self.assertEqual(1, count_inserts("file_movement"))
+        self.assertEqual(1, count_inserts("file_sync"))
+
+        period_id = self.dbsession.query(db.Period.id).scalar()
+        self.assertEqual(
+            [
+                {"event_type": "peer_add", "peer_id": "11"},
+                {"event_type": "peer_add", "peer_id": "19"},
+                {"event_type": "transfer_add", "transfer_id": "501"},
+                {
+                    "event_type": "movement_add",
+                    "transfer_id": "501",
+                    "movement_number": 1,
+                },
+                {"event_type": "add_period", "period_id": period_id},
+                {"event_type": "transfer_add", "transfer_id": "502"},
+                {
+                    "event_type": "movement_add",
+                    "transfer_id": "502",
+                    "movement_number": 1,
+                },
+                {"event_type": "transfer_add", "transfer_id": "503"},
+                {
+                    "event_type": "movement_add",
+                    "transfer_id": "503",
+                    "movement_number": 1,
+                },
+                {"event_type": "transfer_add", "transfer_id": "504"},
+                {
+                    "event_type": "movement_add",
+                    "transfer_id": "504",
+                    "movement_number": 1,
+                },
+            ],
+            obj.change_log,
+        )
+
+        records = (
+            self.dbsession.query(db.TransferRecord).order_by(db.TransferRecord.id).all()
+        )
+        self.assertEqual(transfer_ids, [r.transfer_id for r in records])
+
+        rows = (
+            self.dbsession.query(db.Movement, db.FileMovement)
+            .join(db.FileMovement, db.FileMovement.movement_id == db.Movement.id)
+            .order_by(db.Movement.id)
+            .all()
+        )
+        self.assertEqual(4, len(rows))
+        for record, (m, fm) in zip(records, rows):
+            self.assertEqual(record.id, m.transfer_record_id)
+            self.assertEqual(record.id, fm.transfer_record_id)
+            self.assertEqual(Decimal("1.00"), fm.wallet_delta)
+
+        syncs = self.dbsession.query(db.FileSync).all()
+        self.assertEqual(4, len(syncs))
+
+        # Download the same transfers again. The interpreter should load the
+        # existing FileMovement and FileSync rows with one query each.
+        del statements[:]
+        responses.replace(
+            responses.POST,
+            "https://opn.example.com:9999/wallet/history_sync",
+            json={
+                "results": [_make_transfer_result(tid) for tid in transfer_ids],
+                "more": False,
+                "first_sync_ts": "2018-08-01T04:05:10Z",
+                "last_sync_ts": "2018-08-01T04:05:12Z",
+            },
+        )
+        event.listen(connection, "before_cursor_execute", before_cursor_execute)
+        try:
+            obj()
+        finally:
+            event.remove(connection, "before_cursor_execute", before_cursor_execute)
+
+        def count_selects(fragment):
+            return len(
+                [s for s in statements if s.startswith("SELECT") and fragment in s]
+            )
+
+        self.assertEqual(1, count_selects("file_movement.movement_id IN"))
+        self.assertEqual(1, count_selects("file_sync.transfer_record_id IN"))
+        self.assertEqual(1, count_selects("set_config"))
+        self.assertEqual(0, count_inserts("file_movement"))
+        self.assertEqual(0, count_inserts("file_sync"))
+        self.assertEqual(4, self.dbsession.query(db.FileMovement).count())
+
+    @responses.activate
+    def test_batch_change_log_keeps_record_order(self):
+        # The interpreters' entries for each transfer follow the
+        # transfer's own entries, as if each transfer were synced in turn.
+        from opnreco.models import db
+
+        def _make_transfer_result(transfer_id, action):
+            return {
+                "id": transfer_id,
+                "workflow_type": "grant",
+                "start": "2018-08-01T04:05:06Z",
+                "currency": "USD",
+                "amount": "1.00",
+                "timestamp": "2018-08-01T04:05:08Z",
+                "next_activity": "completed",
+                "completed": True,
+                "canceled": False,
+                "sender_id": "19",
+                "sender_uid": "wingcash:19",
+                "sender_info": {
+                    "title": "Issuer",
+                },
+                "recipient_id": "11",
+                "recipient_uid": "wingcash:11",
+                "recipient_info": {
+                    "title": "Tester",
+                },
+                "movements": [
+                    {
+                        "number": 1,
+                        "timestamp": "2018-08-02T05:06:06Z",
+                        "action": action,
+                        "from_id": "19",
+                        "to_id": "11",
+                        "loops": [
+                            {
+                                "currency": "USD",
+                                "loop_id": "0",
+                                "amount": "1.00",
+                                "issuer_id": "19",
+                            }
+                        ],
+                    },
+                ],
+            }
+
+        responses.add(
+            responses.POST,
+            "https://opn.example.com:9999/wallet/history_sync",
+            json={
+                "results": [
+                    _make_transfer_result("501", "auto_return"),
+                    _make_transfer_result("502", "grant"),
+                    _make_transfer_result("503", "auto_return"),
+                ],
+                "more": False,
+                "first_sync_ts": "2018-08-01T04:05:10Z",
+                "last_sync_ts": "2018-08-01T04:05:11Z",
+            },
+        )
+        obj = self._make(owner_id="11")
+        obj()
+
+        period_id = self.dbsession.query(db.Period.id).scalar()
+        reco_ids = [
+            reco_id
+            for (reco_id,) in self.dbsession.query(db.Reco.id).order_by(db.Reco.id)
+        ]
+        self.assertEqual(2, len(reco_ids))
+        self.assertEqual(
+            [
+                {"event_type": "peer_add", "peer_id": "11"},
+                {"event_type": "peer_add", "peer_id": "19"},
+                {"event_type": "transfer_add", "transfer_id": "501"},
+                {
+                    "event_type": "movement_add",
+                    "transfer_id": "501",
+                    "movement_number": 1,
+                },
+                {"event_type": "add_period", "period_id": period_id},
+                {"event_type": "reco_add", "reco_ids": [reco_ids[0]]},
+                {"event_type": "transfer_add", "transfer_id": "502"},
+                {
+                    "event_type": "movement_add",
+                    "transfer_id": "502",
+                    "movement_number": 1,
+                },
+                {"event_type": "transfer_add", "transfer_id": "503"},
+                {
+                    "event_type": "movement_add",
+                    "transfer_id": "503",
+                    "movement_number": 1,
+                },
+                {"event_type": "reco_add", "reco_ids": [reco_ids[1]]},
+            ],
+            obj.change_log,
+        )
+
+    def test_background_sync_enqueues_job(self):
+        from opnreco.models import db
+
+        os.environ["background_sync"] = "true"
+        try:
+            obj = self._make()
+            status = obj()
+            self.assertEqual("queued", status["job_state"])
+            self.assertTrue(status["more"])
+            job_id = status["job_id"]
+
+            # Another request reports the same active job.
+            obj = self._class(obj.request)
+            self.assertEqual(job_id, obj()["job_id"])
+            self.assertEqual(1, self.dbsession.query(db.SyncJob).count())
+
+            job = self.dbsession.query(db.SyncJob).one()
+            self.assertEqual("example-token", job.access_token)
+            job.state = "done"
+            job.progress_percent = 100
+            job.access_token = None
+            self.dbsession.flush()
+
+            obj.request.json = {"job_id": job_id}
+            status = obj()
+            self.assertEqual("done", status["job_state"])
+            self.assertFalse(status["more"])
+            self.assertEqual(100, status["progress_percent"])
+
+            # No HTTP request to OPN is made by the sync API in this mode.
+            records = self.dbsession.query(db.TransferRecord).all()
+            self.assertEqual(0, len(records))
+        finally:
+            del os.environ["background_sync"]
+
+    def test_background_sync_reports_verification_failure(self):
+        from opnreco.models import db
+        from pyramid.httpexceptions import HTTPInsufficientStorage
+
+        os.environ["background_sync"] = "true"
+        try:
+            obj = self._make()
+            job_id = obj()["job_id"]
+            job = self.dbsession.query(db.SyncJob).one()
+            job.state = "failed"
+            job.access_token = None
+            job.error_type = "verification_failure"
+            job.error_description = "Verification failure in transfer 501."
+            self.dbsession.flush()
+
+            obj.request.json = {"job_id": job_id}
+            with self.assertRaises(HTTPInsufficientStorage) as cm:
+                obj()
+            self.assertEqual(
+                "Verification failure in transfer 501.",
+                cm.exception.json_body["error_description"],
+            )
+        finally:
+            del os.environ["background_sync"]
@@ -0,0 +1,235 @@
+import datetime
+import unittest
+from decimal import Decimal
+
+import pyramid.testing
+from opnreco.testing import DBSessionFixture
+from sqlalchemy import func
+
+
+def setup_module():
+    global dbsession_fixture
+    dbsession_fixture = DBSessionFixture()
+
+
+def teardown_module():
+    dbsession_fixture.close()
+
+
+class Test_transactions_api(unittest.TestCase):
+    def setUp(self):
+        self.config = pyramid.testing.setUp()
+        self.dbsession, self.close_session = dbsession_fixture.begin_session()
+
+    def tearDown(self):
+        self.close_session()
+        pyramid.testing.tearDown()
+
+    def _call(self, *args, **kw):
+        from ..transactionsapi import transactions_api
+
+        return transactions_api(*args, **kw)
+
+    def add_entries(self):
+        from opnreco.models import db
+
+        dbsession = self.dbsession
+        self.owner = owner = db.Owner(
+            id="102", title="Testy Owner", username="testowner"
+        )
+        dbsession.add(owner)
+        dbsession.flush()
+        dbsession.query(
+            func.set_config("opnreco.personal_id", owner.id, True),
+            func.set_config("opnreco.account_entry.event_type", "test", True),
+        ).one()
+
+        dbsession.add(
+            db.File(
+                id=1239,
+                owner_id="102",
+                file_type="open_circ",
+                title="Test File",
+                currency="USD",
+                has_vault=True,
+            )
+        )
+        dbsession.flush()
+        self.period = period = db.Period(owner_id="102", file_id=1239)
+        dbsession.add(period)
+        dbsession.flush()
+        statement = db.Statement(
+            owner_id="102", file_id=1239, period_id=period.id, source="Test"
+        )
+        dbsession.add(statement)
+        dbsession.flush()
+
+        reco = db.Reco(
+            owner_id="102", period_id=period.id, reco_type="standard", internal=False
+        )
+        dbsession.add(reco)
+        dbsession.flush()
+
+        # Add 6 unreconciled entries and 1 reconciled entry. Several
+        # entries share a date so the IDs break the ties.
+        self.entries = entries = []
+        for day, reco_id in [
+            (3, None),
+            (1, None),
+            (2, None),
+            (2, None),
+            (1, reco.id),
+            (2, None),
+            (5, None),
+        ]:
+            entry = db.AccountEntry(
+                owner_id="102",
+                file_id=1239,
+                period_id=period.id,
+                statement_id=statement.id,
+                entry_date=datetime.date(2018, 8, day),
+                currency="USD",
+                loop_id="0",
+                delta=Decimal(day),
+                description="",
+                reco_id=reco_id,
+            )
+            dbsession.add(entry)
+            dbsession.flush()
+            entries.append(entry)
+        self.reco = reco
+
+    def make_request(self, **params):
+        return pyramid.testing.DummyRequest(
+            dbsession=self.dbsession, owner=self.owner, params=params
+        )
+
+    def make_context(self):
+        from opnreco.models.site import PeriodResource
+
+        return PeriodResource(
+            parent=None,
+            name=str(self.period.id),
+            period=self.period,
+            file_archived=False,
+        )
+
+    def get_ids(self, response):
+        return [(r["reco_id"], r["account_entry_id"]) for r in response["inc_records"]]
+
+    def expected_ids(self):
+        entries = self.entries
+        return [
+            (None, str(entries[1].id)),
+            (str(self.reco.id), None),
+            (None, str(entries[2].id)),
+            (None, str(entries[3].id)),
+            (None, str(entries[5].id)),
+            (None, str(entries[0].id)),
+            (None, str(entries[6].id)),
+        ]
+
+    def test_offset_pagination(self):
+        self.add_entries()
+        response = self._call(
+            self.make_context(), self.make_request(offset="2", limit="3")
+        )
+        self.assertEqual(self.expected_ids()[2:5], self.get_ids(response))
+        self.assertEqual(7, response["rowcount"])
+        self.assertFalse(response["all_shown"])
+        self.assertIsNotNone(response["next_after"])
+
+    def test_all_rows(self):
+        self.add_entries()
+        response = self._call(
+            self.make_context(), self.make_request(offset="0", limit="10000")
+        )
+        self.assertEqual(self.expected_ids(), self.get_ids(response))
+        self.assertTrue(response["all_shown"])
+        self.assertIsNone(response["next_after"])
+        self.assertEqual(Decimal("16"), response["inc_totals"]["all"]["account_delta"])
+        self.assertEqual(response["inc_totals"]["all"], response["inc_totals"]["page"])
+
+    def test_totals_and_page_in_one_statement(self):
+        from sqlalchemy import event
+
+        self.add_entries()
+        after = self.make_after()
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        conn = self.dbsession.connection()
+        event.listen(conn, "before_cursor_execute", before_cursor_execute)
+        try:
+            response = self._call(
+                self.make_context(), self.make_request(after=after, limit="2")
+            )
+        finally:
+            event.remove(conn, "before_cursor_execute", before_cursor_execute)
+
+        self.assertEqual(7, response["rowcount"])
+        self.assertEqual(Decimal("16"), response["inc_totals"]["all"]["account_delta"])
+        self.assertEqual(self.expected_ids()[1:3], self.get_ids(response))
+        # The page and totals come from one statement that evaluates the
+        # combined rows once. Recos on the page need one more statement
+        # each for movements and entries.
+        main_sql = statements[0]
+        self.assertIn("all_rows AS MATERIALIZED", main_sql)
+        self.assertEqual(2, main_sql.count("UNION ALL"))
+        self.assertNotIn(" OVER ", main_sql)
+        self.assertLessEqual(len(statements), 3)
+
+    def test_empty_page_still_has_totals(self):
+        self.add_entries()
+        response = self._call(
+            self.make_context(), self.make_request(offset="10", limit="2")
+        )
+        self.assertEqual([], response["inc_records"])
+        self.assertEqual(7, response["rowcount"])
+        self.assertEqual(Decimal("16"), response["inc_totals"]["all"]["account_delta"])
+        self.assertIsNone(response["next_after"])
+
+    def test_keyset_pagination_follows_next_after(self):
+        self.add_entries()
+        pages = []
+        params = {"offset": "0", "limit": "2"}
+        while True:
+            response = self._call(self.make_context(), self.make_request(**params))
+            pages.append(self.get_ids(response))
+            after = response["next_after"]
+            if after is None:
+                break
+            # The offset is not required with 'after'.
+            params = {"after": after, "limit": "2"}
+
+        self.assertEqual([2, 2, 2, 1], [len(page) for page in pages])
+        self.assertEqual(self.expected_ids(), sum(pages, []))
+
+    def test_reject_limit_over_max_page_size(self):
+        from pyramid.httpexceptions import HTTPBadRequest
+
+        self.add_entries()
+        for params in (
+            {"offset": "0", "limit": "10001"},
+            {"offset": "0", "limit": "all"},
+            {"after": self.make_after(), "limit": "10001"},
+        ):
+            with self.assertRaises(HTTPBadRequest) as cm:
+                self._call(self.make_context(), self.make_request(**params))
+            self.assertEqual("limit_too_large", cm.exception.json_body["error"])
+
+    def make_after(self):
+        response = self._call(
+            self.make_context(), self.make_request(offset="0", limit="1")
+        )
+        return response["next_after"]
+
+    def test_invalid_after(self):
+        from pyramid.httpexceptions import HTTPBadRequest
+
+        self.add_entries()
+        with self.assertRaises(HTTPBadRequest) as cm:
+            self._call(self.make_context(), self.make_request(after="bogus", limit="2"))
+        self.assertEqual("invalid_after", cm.exception.json_body["error"])
@@ -0,0 +1,224 @@
+import datetime
+import unittest
+from decimal import Decimal
+
+import pyramid.testing
+from opnreco.testing import DBSessionFixture
+from sqlalchemy import func
+
+
+def setup_module():
+    global dbsession_fixture
+    dbsession_fixture = DBSessionFixture()
+
+
+def teardown_module():
+    dbsession_fixture.close()
+
+
+class Test_find_reco_summary_mismatch(unittest.TestCase):
+    def setUp(self):
+        self.config = pyramid.testing.setUp()
+        self.dbsession, self.close_session = dbsession_fixture.begin_session()
+
+    def tearDown(self):
+        self.close_session()
+        pyramid.testing.tearDown()
+
+    def _call(self):
+        from ..verifyapi import find_reco_summary_mismatch
+
+        return find_reco_summary_mismatch(dbsession=self.dbsession, owner_id="102")
+
+    def add_file(self):
+        from opnreco.models import db
+
+        dbsession = self.dbsession
+        dbsession.add(db.Owner(id="102", title="Testy Owner", username="testowner"))
+        dbsession.flush()
+        dbsession.add(
+            db.File(
+                id=1239,
+                owner_id="102",
+                file_type="open_circ",
+                title="Test File",
+                currency="USD",
+                has_vault=True,
+            )
+        )
+        dbsession.flush()
+
+        dbsession.query(
+            func.set_config("opnreco.personal_id", "102", True),
+            func.set_config("opnreco.movement.event_type", "test", True),
+            func.set_config("opnreco.account_entry.event_type", "test", True),
+        ).one()
+
+        self.period = db.Period(owner_id="102", file_id=1239)
+        dbsession.add(self.period)
+        self.record = db.TransferRecord(
+            owner_id="102",
+            transfer_id="6502",
+            workflow_type="redeem",
+            start=datetime.datetime(2018, 1, 15, 6, 0, 0),
+            currency="USD",
+            amount=Decimal("1.00"),
+            timestamp=datetime.datetime(2018, 1, 15, 6, 0, 1),
+            next_activity="completed",
+            completed=True,
+            canceled=False,
+        )
+        dbsession.add(self.record)
+        dbsession.flush()
+        self.statement = db.Statement(
+            owner_id="102", file_id=1239, period_id=self.period.id, source="test"
+        )
+        dbsession.add(self.statement)
+        self.reco = db.Reco(
+            owner_id="102",
+            period_id=self.period.id,
+            reco_type="standard",
+            internal=False,
+        )
+        dbsession.add(self.reco)
+        dbsession.flush()
+
+    def add_file_movement(self, number, vault_delta, reco=None):
+        from opnreco.models import db
+
+        dbsession = self.dbsession
+        m = db.Movement(
+            owner_id="102",
+            transfer_record_id=self.record.id,
+            number=number,
+            amount_index=0,
+            loop_id="0",
+            currency="USD",
+            issuer_id="19",
+            from_id="19",
+            to_id="102",
+            amount=abs(Decimal(vault_delta)),
+            action="test",
+            ts=datetime.datetime(2018, 1, 15, 6, 0, number),
+        )
+        dbsession.add(m)
+        dbsession.flush()
+
+        fm = db.FileMovement(
+            owner_id="102",
+            movement_id=m.id,
+            file_id=1239,
+            peer_id="19",
+            loop_id=m.loop_id,
+            currency=m.currency,
+            issuer_id=m.issuer_id,
+            transfer_record_id=m.transfer_record_id,
+            ts=m.ts,
+            wallet_delta=0,
+            vault_delta=Decimal(vault_delta),
+            surplus_delta=0,
+            period_id=self.period.id,
+            reco_id=reco.id if reco is not None else None,
+        )
+        dbsession.add(fm)
+        dbsession.flush()
+        return fm
+
+    def add_account_entry(self, day, delta, reco=None):
+        from opnreco.models import db
+
+        e = db.AccountEntry(
+            owner_id="102",
+            file_id=1239,
+            period_id=self.period.id,
+            statement_id=self.statement.id,
+            entry_date=datetime.date(2018, 1, day),
+            loop_id="0",
+            currency="USD",
+            delta=Decimal(delta),
+            description="Test entry",
+            reco_id=reco.id if reco is not None else None,
+        )
+        self.dbsession.add(e)
+        self.dbsession.flush()
+        return e
+
+    def get_summary(self):
+        from opnreco.models import db
+
+        self.dbsession.expire_all()
+        return (
+            self.dbsession.query(db.RecoSummary)
+            .filter(db.RecoSummary.reco_id == self.reco.id)
+            .one_or_none()
+        )
+
+    def test_summary_follows_changes(self):
+        self.add_file()
+        self.assertIsNone(self.get_summary())
+
+        fm1 = self.add_file_movement(1, "-3.00", reco=self.reco)
+        fm2 = self.add_file_movement(2, "-4.00")
+        self.add_account_entry(17, "3.00", reco=self.reco)
+        entry2 = self.add_account_entry(16, "4.00")
+
+        summary = self.get_summary()
+        self.assertEqual(1, summary.movement_count)
+        self.assertEqual(Decimal("-3.00"), summary.vault_delta)
+        self.assertEqual(datetime.datetime(2018, 1, 15, 6, 0, 1), summary.min_ts)
+        self.assertEqual(1, summary.entry_count)
+        self.assertEqual(Decimal("3.00"), summary.account_delta)
+        self.assertEqual(datetime.date(2018, 1, 17), summary.min_entry_date)
+        self.assertIsNone(self._call())
+
+        # Add a movement and an entry to the reco.
+        fm2.reco_id = self.reco.id
+        entry2.reco_id = self.reco.id
+        self.dbsession.flush()
+        summary = self.get_summary()
+        self.assertEqual(2, summary.movement_count)
+        self.assertEqual(Decimal("-7.00"), summary.vault_delta)
+        self.assertEqual(Decimal("7.00"), summary.account_delta)
+        self.assertEqual(datetime.date(2018, 1, 16), summary.min_entry_date)
+
+        # Remove all the movements from the reco.
+        fm1.reco_id = None
+        fm2.reco_id = None
+        self.dbsession.flush()
+        summary = self.get_summary()
+        self.assertEqual(0, summary.movement_count)
+        self.assertIsNone(summary.vault_delta)
+        self.assertIsNone(summary.min_ts)
+        self.assertEqual(2, summary.entry_count)
+        self.assertIsNone(self._call())
+
+        # Delete an entry.
+        self.dbsession.delete(entry2)
+        self.dbsession.flush()
+        self.assertEqual(1, self.get_summary().entry_count)
+
+    def test_detects_mismatch(self):
+        from opnreco.models import db
+
+        self.add_file()
+        self.add_file_movement(1, "-3.00", reco=self.reco)
+        self.assertIsNone(self._call())
+
+        (
+            self.dbsession.query(db.RecoSummary)
+            .filter(db.RecoSummary.reco_id == self.reco.id)
+            .update({"vault_delta": Decimal("9.99")})
+        )
+        self.assertEqual(self.reco.id, self._call())
+
+    def test_detects_missing_summary(self):
+        from opnreco.models import db
+
+        self.add_file()
+        self.add_file_movement(1, "-3.00", reco=self.reco)
+        (
+            self.dbsession.query(db.RecoSummary)
+            .filter(db.RecoSummary.reco_id == self.reco.id)
+            .delete()
+        )
+        self.assertEqual(self.reco.id, self._call())
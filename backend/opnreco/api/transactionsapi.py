@@ -1,20 +1,126 @@
+import base64
 import collections
+import datetime
+import json
 from decimal import Decimal
 
 from opnreco.models import perms
-from opnreco.models.db import AccountEntry, FileMovement, Reco, TransferRecord, now_func
+from opnreco.models.db import (
+    AccountEntry,
+    FileMovement,
+    Reco,
+    RecoSummary,
+    TransferRecord,
+    now_func,
+)
 from opnreco.models.site import PeriodResource
-from opnreco.param import get_offset_limit
+from opnreco.param import get_limit, get_offset_limit
+from opnreco.util import to_datetime
+from pyramid.httpexceptions import HTTPBadRequest
 from pyramid.view import view_config
-from sqlalchemy import BigInteger, Date, DateTime, Numeric, String, case, cast, func
+from sqlalchemy import (
+    BigInteger,
+    Date,
+    DateTime,
+    Numeric,
+    String,
+    case,
+    cast,
+    func,
+    literal,
+    literal_column,
+    select,
+    true,
+    tuple_,
+    union_all,
+)
 
 null = None
 zero = Decimal()
 
+# The maximum number of rows in a page of the transactions report.
+# This must be at least the largest page size offered by the frontend
+# pager (frontend/src/util/Pager.js).
+max_page_size = 10000
 
 movement_delta_cols = -(FileMovement.wallet_delta + FileMovement.vault_delta)
 reco_movement_delta_cols = FileMovement.surplus_delta - FileMovement.vault_delta
 
+# Rows are sorted by (entry_date, ts, account_entry_id, movement_id,
+# reco_id) with nulls last. The sort key replaces nulls with these
+# maximum values so rows can be compared with a row value comparison.
+max_date = literal_column("'infinity'::date", Date)
+max_ts = literal_column("'infinity'::timestamp", DateTime)
+max_id = literal(2**63 - 1, BigInteger)
+
+
+def get_sort_key(c):
+    """Get the sort key columns of a query or subquery column collection."""
+    return (
+        func.coalesce(c.entry_date, max_date),
+        func.coalesce(c.ts, max_ts),
+        func.coalesce(c.account_entry_id, max_id),
+        func.coalesce(c.movement_id, max_id),
+        func.coalesce(c.reco_id, max_id),
+    )
+
+
+def get_total_cols(c):
+    """Get the row count and total aggregate columns of the report rows."""
+    amount_expr = func.coalesce(c.account_delta, c.movement_delta)
+    inc_row = amount_expr > 0
+    dec_row = amount_expr < 0
+    aggregates = {
+        "rowcount": func.count(1),
+        "inc_account_delta": func.sum(case([(inc_row, c.account_delta)], else_=0)),
+        "dec_account_delta": func.sum(case([(dec_row, c.account_delta)], else_=0)),
+        "inc_reco_movement_delta": func.sum(
+            case([(inc_row, c.reco_movement_delta)], else_=0)
+        ),
+        "dec_reco_movement_delta": func.sum(
+            case([(dec_row, c.reco_movement_delta)], else_=0)
+        ),
+    }
+    return [expr.label(name) for name, expr in aggregates.items()]
+
+
+def encode_after(row) -> str:
+    """Encode the sort key of a row as an opaque 'after' token."""
+    values = [
+        None if row.entry_date is None else row.entry_date.isoformat(),
+        None if row.ts is None else row.ts.isoformat(),
+        row.account_entry_id,
+        row.movement_id,
+        row.reco_id,
+    ]
+    data = json.dumps(values, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def decode_after(token: str) -> tuple:
+    """Decode an 'after' token to sort key values (SQL expressions)."""
+    try:
+        data = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        entry_date, ts, account_entry_id, movement_id, reco_id = json.loads(data)
+        ids = [account_entry_id, movement_id, reco_id]
+        if not all(x is None or isinstance(x, int) for x in ids):
+            raise ValueError("Invalid ID")
+        return (
+            (
+                max_date
+                if entry_date is None
+                else literal(datetime.date.fromisoformat(entry_date), Date)
+            ),
+            max_ts if ts is None else literal(to_datetime(ts), DateTime),
+        ) + tuple(max_id if x is None else literal(x, BigInteger) for x in ids)
+    except Exception:
+        raise HTTPBadRequest(
+            json_body={
+                "error": "invalid_after",
+                "error_description": "The 'after' parameter is not valid.",
+            }
+        )
+
 
 @view_config(
     name="transactions",
@@ -25,98 +131,76 @@ reco_movement_delta_cols = FileMovement.surplus_delta - FileMovement.vault_delta
 def transactions_api(context, request):
     period_id = context.period.id
     params = request.params
-    offset, limit = get_offset_limit(params)
+    after = params.get("after")
+    if after:
+        # Keyset pagination: list the rows after the given sort key.
+        after_key = decode_after(after)
+        offset = 0
+        limit = get_limit(params, max_limit=max_page_size)
+    else:
+        after_key = None
+        offset, limit = get_offset_limit(params, max_limit=max_page_size)
 
     dbsession = request.dbsession
     owner = request.owner
     owner_id = owner.id
 
     # Compose a big query that returns a combination of reconciled rows,
-    # unreconciled account entries, and unreconciled movements.
-    # (The big query causes all ordering and paging to be done in the
-    # database, which is faster than retrieving rows first.)
-
-    account_delta_c = (
-        dbsession.query(func.sum(AccountEntry.delta))
-        .filter(AccountEntry.reco_id == Reco.id)
-        .correlate(Reco)
-        .as_scalar()
-        .label("account_delta")
-    )
-
-    entry_date_c = (
-        dbsession.query(func.min(AccountEntry.entry_date))
-        .filter(AccountEntry.reco_id == Reco.id)
-        .correlate(Reco)
-        .as_scalar()
-        .label("entry_date")
-    )
-
-    ts_c = (
-        dbsession.query(func.min(FileMovement.ts))
-        .filter(FileMovement.reco_id == Reco.id)
-        .correlate(Reco)
-        .as_scalar()
-        .label("ts")
-    )
-
-    movement_delta_c = (
-        dbsession.query(func.sum(movement_delta_cols))
-        .filter(FileMovement.reco_id == Reco.id)
-        .correlate(Reco)
-        .as_scalar()
-        .label("movement_delta")
-    )
-
-    reco_movement_delta_c = (
-        dbsession.query(func.sum(reco_movement_delta_cols))
-        .filter(FileMovement.reco_id == Reco.id)
-        .correlate(Reco)
-        .as_scalar()
-        .label("reco_movement_delta")
-    )
+    # unreconciled account entries, and unreconciled movements, along with
+    # the row count and totals. (The big query causes all ordering, paging,
+    # and totaling to be done in the database in a single statement.)
 
     # List the reconciled entries in the period.
     # Since recos can contain any number of account entries and movements,
     # list just the reco IDs, delta totals, and dates. Get the reco-specific
     # account entries and movements after ordering and pagination.
-    query = dbsession.query(
-        Reco.id.label("reco_id"),
-        cast(None, BigInteger).label("account_entry_id"),
-        entry_date_c,
-        account_delta_c,
+    # The totals and dates come from reco_summary.
+    reco_query = (
+        dbsession.query(
+            Reco.id.label("reco_id"),
+            cast(None, BigInteger).label("account_entry_id"),
+            RecoSummary.min_entry_date.label("entry_date"),
+            RecoSummary.account_delta.label("account_delta"),
+            cast(None, BigInteger).label("movement_id"),
+            RecoSummary.min_ts.label("ts"),
+            (-(RecoSummary.wallet_delta + RecoSummary.vault_delta)).label(
+                "movement_delta"
+            ),
+            (RecoSummary.surplus_delta - RecoSummary.vault_delta).label(
+                "reco_movement_delta"
+            ),
+            cast(None, String).label("workflow_type"),
+            cast(None, String).label("transfer_id"),
+        )
+        .outerjoin(RecoSummary, RecoSummary.reco_id == Reco.id)
+        .filter(
+            Reco.owner_id == owner_id,
+            Reco.period_id == period_id,
+            ~Reco.internal,
+        )
+    )
+
+    # Include the unreconciled account entries.
+    entry_query = dbsession.query(
+        AccountEntry.reco_id,
+        AccountEntry.id.label("account_entry_id"),
+        AccountEntry.entry_date,
+        AccountEntry.delta.label("account_delta"),
         cast(None, BigInteger).label("movement_id"),
-        ts_c,
-        movement_delta_c,
-        reco_movement_delta_c,
+        cast(None, DateTime).label("ts"),
+        cast(None, Numeric).label("movement_delta"),
+        cast(None, Numeric).label("reco_movement_delta"),
         cast(None, String).label("workflow_type"),
         cast(None, String).label("transfer_id"),
     ).filter(
-        Reco.owner_id == owner_id,
-        Reco.period_id == period_id,
-        ~Reco.internal,
+        AccountEntry.owner_id == owner_id,
+        AccountEntry.period_id == period_id,
+        AccountEntry.delta != 0,
+        AccountEntry.reco_id == null,
     )
 
-    query = query.union(
-        # Include the unreconciled account entries.
-        dbsession.query(
-            AccountEntry.reco_id,
-            AccountEntry.id.label("account_entry_id"),
-            AccountEntry.entry_date,
-            AccountEntry.delta.label("account_delta"),
-            cast(None, BigInteger).label("movement_id"),
-            cast(None, DateTime).label("ts"),
-            cast(None, Numeric).label("movement_delta"),
-            cast(None, Numeric).label("reco_movement_delta"),
-            cast(None, String).label("workflow_type"),
-            cast(None, String).label("transfer_id"),
-        ).filter(
-            AccountEntry.owner_id == owner_id,
-            AccountEntry.period_id == period_id,
-            AccountEntry.delta != 0,
-            AccountEntry.reco_id == null,
-        ),
-        # Include the unreconciled movements.
+    # Include the unreconciled movements.
+    movement_query = (
         dbsession.query(
             FileMovement.reco_id,
             cast(None, BigInteger).label("account_entry_id"),
@@ -135,49 +219,50 @@ def transactions_api(context, request):
             FileMovement.period_id == period_id,
             movement_delta_cols != 0,
             FileMovement.reco_id == null,
-        ),
+        )
     )
 
-    total_cte = query.cte("total_cte")
-    amount_expr = func.coalesce(total_cte.c.account_delta, total_cte.c.movement_delta)
-    inc_row = amount_expr > 0
-    dec_row = amount_expr < 0
-    totals_row = dbsession.query(
-        now_func.label("now"),
-        func.count(1).label("rowcount"),
-        func.sum(
-            case(
-                [
-                    (inc_row, total_cte.c.account_delta),
-                ],
-                else_=0,
-            )
-        ).label("inc_account_delta"),
-        func.sum(
-            case(
-                [
-                    (dec_row, total_cte.c.account_delta),
-                ],
-                else_=0,
-            )
-        ).label("dec_account_delta"),
-        func.sum(
-            case(
-                [
-                    (inc_row, total_cte.c.reco_movement_delta),
-                ],
-                else_=0,
-            )
-        ).label("inc_reco_movement_delta"),
-        func.sum(
-            case(
-                [
-                    (dec_row, total_cte.c.reco_movement_delta),
-                ],
-                else_=0,
-            )
-        ).label("dec_reco_movement_delta"),
-    ).one()
+    # Evaluate the combined rows once, then get the totals and the page
+    # from them in the same statement. The totals are outer joined to the
+    # page so they come back even when the page is empty.
+    all_rows = (
+        union_all(reco_query, entry_query, movement_query)
+        .cte("all_rows")
+        .prefix_with("MATERIALIZED", dialect="postgresql")
+    )
+    totals = select(now_func.label("now"), *get_total_cols(all_rows.c)).subquery(
+        "totals"
+    )
+    sort_key = get_sort_key(all_rows.c)
+    page = select(all_rows)
+    if after_key is not None:
+        page = page.where(tuple_(*sort_key) > tuple_(*after_key))
+    # Get one extra row to find out whether there is another page.
+    page = page.order_by(*sort_key).offset(offset).limit(limit + 1).subquery("page")
+    rows = (
+        dbsession.query(totals, page)
+        .select_from(totals)
+        .outerjoin(page, true())
+        .order_by(*get_sort_key(page.c))
+        .all()
+    )
+
+    totals_row = rows[0]
+    # Every report row has a reco, account entry, or movement ID.
+    main_rows = [
+        row
+        for row in rows
+        if row.reco_id is not None
+        or row.account_entry_id is not None
+        or row.movement_id is not None
+    ]
+
+    if len(main_rows) > limit:
+        del main_rows[limit:]
+        next_after = encode_after(main_rows[-1]) if main_rows else None
+    else:
+        next_after = None
+
     all_incs = {
         "account_delta": totals_row.inc_account_delta or zero,
         "reco_movement_delta": totals_row.inc_reco_movement_delta or zero,
@@ -187,21 +272,6 @@ def transactions_api(context, request):
         "reco_movement_delta": totals_row.dec_reco_movement_delta or zero,
     }
 
-    subq = query.subquery("subq")
-    main_rows_query = (
-        dbsession.query(subq)
-        .order_by(
-            subq.c.entry_date,
-            subq.c.ts,
-            subq.c.account_entry_id,
-            subq.c.movement_id,
-        )
-        .offset(offset)
-    )
-    if limit is not None:
-        main_rows_query = main_rows_query.limit(limit)
-    main_rows = main_rows_query.all()
-
     # Now main_rows contains the rows for the table.
 
     inc_records = []
@@ -262,9 +332,7 @@ def transactions_api(context, request):
         d = (
             account_delta
             if account_delta is not None
-            else movement_delta
-            if movement_delta is not None
-            else zero
+            else movement_delta if movement_delta is not None else zero
         )
         inc = True if d > zero else False if d < zero else None
 
@@ -358,6 +426,7 @@ def transactions_api(context, request):
         "now": totals_row.now,
         "rowcount": totals_row.rowcount,
         "all_shown": all_shown,
+        "next_after": next_after,
         "inc_records": inc_records,
         "inc_totals": {
             "page": page_incs,
@@ -8,18 +8,21 @@ from opnreco.models.db import (
     FileMovement,
     Period,
     Reco,
+    RecoSummary,
     TransferRecord,
     VerificationResult,
 )
 from opnreco.models.site import API
 from opnreco.syncbase import SyncBase, VerificationFailure
 from opnreco.util import to_datetime
+from opnreco.viewcommon import PeriodSumMismatch, compute_period_totals
 from pyramid.decorator import reify
 from pyramid.httpexceptions import HTTPBadRequest, HTTPInsufficientStorage
 from pyramid.view import view_config
-from sqlalchemy import func
+from sqlalchemy import func, tuple_
 
 log = logging.getLogger(__name__)
+null = None
 
 
 @view_config(name="verify", context=API, permission=perms.use_app, renderer="json")
@@ -271,27 +274,14 @@ class VerifyAPI(SyncBase):
         dbsession = request.dbsession
         owner = request.owner
 
-        movement_delta_c = FileMovement.wallet_delta + FileMovement.vault_delta
-        movement_subq = (
-            dbsession.query(func.sum(movement_delta_c).label("delta"))
-            .filter(FileMovement.reco_id == Reco.id)
-            .correlate(Reco)
-            .as_scalar()
-        )
-
-        entry_subq = (
-            dbsession.query(func.sum(AccountEntry.delta).label("delta"))
-            .filter(AccountEntry.reco_id == Reco.id)
-            .correlate(Reco)
-            .as_scalar()
-        )
-
+        movement_delta_c = RecoSummary.wallet_delta + RecoSummary.vault_delta
         row = (
             dbsession.query(Reco.id)
+            .join(RecoSummary, RecoSummary.reco_id == Reco.id)
             .filter(
                 Reco.owner_id == owner.id,
                 Reco.reco_type == "standard",
-                movement_subq + entry_subq != 0,
+                movement_delta_c + RecoSummary.account_delta != 0,
             )
             .order_by(Reco.id)
             .first()
@@ -354,12 +344,105 @@ class VerifyAPI(SyncBase):
 
             prev_period = period
 
+        # Ensure the stored period sums match the movements and account
+        # entries in each period.
+        try:
+            compute_period_totals(
+                dbsession=dbsession,
+                owner_id=owner.id,
+                period_ids=[period.id for period in periods],
+                verify=True,
+            )
+        except PeriodSumMismatch as e:
+            msg = "Period totals verification failure: %s" % e
+            raise VerificationFailure(msg, transfer_id=None)
+
+        # Ensure the stored reco summaries match the movements and
+        # account entries in each reco.
+        reco_id = find_reco_summary_mismatch(dbsession=dbsession, owner_id=owner.id)
+        if reco_id is not None:
+            msg = (
+                "Reconciliation summary verification failure: "
+                "the stored summary of reconciliation %s does not match "
+                "its movements and account entries." % reco_id
+            )
+            raise VerificationFailure(msg, transfer_id=None)
+
         self.ivr.internal_result = {
             "recos_ok": True,
             "periods_ok": True,
+            "period_sums_ok": True,
+            "reco_summaries_ok": True,
         }
 
 
+def find_reco_summary_mismatch(dbsession, owner_id):
+    """Find a reco whose reco_summary row disagrees with its members.
+
+    Return the first mismatched reco ID or None.
+    """
+    movement_subq = (
+        dbsession.query(
+            FileMovement.reco_id,
+            func.count(1).label("movement_count"),
+            func.sum(FileMovement.wallet_delta).label("wallet_delta"),
+            func.sum(FileMovement.vault_delta).label("vault_delta"),
+            func.sum(FileMovement.surplus_delta).label("surplus_delta"),
+            func.min(FileMovement.ts).label("min_ts"),
+            func.min(FileMovement.local_date).label("min_local_date"),
+        )
+        .filter(FileMovement.owner_id == owner_id, FileMovement.reco_id != null)
+        .group_by(FileMovement.reco_id)
+        .subquery("movement_subq")
+    )
+
+    entry_subq = (
+        dbsession.query(
+            AccountEntry.reco_id,
+            func.count(1).label("entry_count"),
+            func.sum(AccountEntry.delta).label("account_delta"),
+            func.min(AccountEntry.entry_date).label("min_entry_date"),
+        )
+        .filter(AccountEntry.owner_id == owner_id, AccountEntry.reco_id != null)
+        .group_by(AccountEntry.reco_id)
+        .subquery("entry_subq")
+    )
+
+    stored = tuple_(
+        func.coalesce(RecoSummary.movement_count, 0),
+        RecoSummary.wallet_delta,
+        RecoSummary.vault_delta,
+        RecoSummary.surplus_delta,
+        RecoSummary.min_ts,
+        RecoSummary.min_local_date,
+        func.coalesce(RecoSummary.entry_count, 0),
+        RecoSummary.account_delta,
+        RecoSummary.min_entry_date,
+    )
+    computed = tuple_(
+        func.coalesce(movement_subq.c.movement_count, 0),
+        movement_subq.c.wallet_delta,
+        movement_subq.c.vault_delta,
+        movement_subq.c.surplus_delta,
+        movement_subq.c.min_ts,
+        movement_subq.c.min_local_date,
+        func.coalesce(entry_subq.c.entry_count, 0),
+        entry_subq.c.account_delta,
+        entry_subq.c.min_entry_date,
+    )
+
+    row = (
+        dbsession.query(Reco.id)
+        .outerjoin(RecoSummary, RecoSummary.reco_id == Reco.id)
+        .outerjoin(movement_subq, movement_subq.c.reco_id == Reco.id)
+        .outerjoin(entry_subq, entry_subq.c.reco_id == Reco.id)
+        .filter(Reco.owner_id == owner_id, stored.is_distinct_from(computed))
+        .order_by(Reco.id)
+        .first()
+    )
+    return None if row is None else row[0]
+
+
 @view_config(
     name="verify-details", context=API, permission=perms.use_app, renderer="json"
 )
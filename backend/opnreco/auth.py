@@ -1,10 +1,10 @@
-import datetime
 import logging
 import os
 
-import requests
 from opnreco.models.db import OwnerLog
-from opnreco.util import check_requests_response
+from opnreco.opnclient import get_opn_client
+from opnreco.tokencache import TokenCache, make_token_cache
+from opnreco.util import PeriodicStatsLog, check_requests_response
 from pyramid.authorization import Authenticated, Everyone
 from pyramid.interfaces import IAuthenticationPolicy
 from zope.interface import implementer
@@ -16,71 +16,57 @@ log = logging.getLogger(__name__)
 class OPNTokenAuthenticationPolicy(object):
     """Authentication policy based on OPN access tokens.
 
-    Maintains a cache of valid access tokens.
+    Maintains a cache of valid access tokens and logs the cache stats
+    periodically. See opnreco/tokencache.py for the cache configuration.
     """
 
-    def __init__(self):
+    def __init__(self, token_cache: TokenCache | None = None):
         self.opn_api_url = os.environ["opn_api_url"]
-        self.token_cache = {}  # {access_token: {id, valid_until, wallet_info}}
-        self.cache_duration = datetime.timedelta(seconds=60)
+        if token_cache is None:
+            token_cache = make_token_cache()
+        # {access_token: {id, wallet_info}}
+        self.token_cache = token_cache
+        self.stats_log = PeriodicStatsLog(
+            log, "Token cache stats: %s", token_cache.get_stats
+        )
 
     def _get_profile_id_for_token(self, request, token):
         if not token:
             return None
 
-        now = datetime.datetime.utcnow()
         entry = self.token_cache.get(token)
+        self.stats_log.maybe_log()
         if entry is not None:
-            if now < entry["valid_until"]:
-                request.wallet_info = entry["wallet_info"]
-                return entry["id"]
-
-            wallet_info = self._request_wallet_info(request, token)
-            if wallet_info:
-                # This token hasn't actually expired yet.
-                profile_info = wallet_info["profile"]
-                profile_id = profile_info["id"]
-                self.token_cache[token] = {
-                    "id": profile_id,
-                    "valid_until": now + self.cache_duration,
-                    "wallet_info": wallet_info,
-                }
-                request.wallet_info = wallet_info
-                return profile_id
-
-            else:
-                # This token expired.
-                # Take an opportunity to clean up the token cache.
-                to_delete = []
-                for token, entry1 in self.token_cache.items():
-                    if now >= entry1["valid_until"]:
-                        to_delete.append(token)
-                for token in to_delete:
-                    self.token_cache.pop(token, None)
-                return None
+            request.wallet_info = entry["wallet_info"]
+            return entry["id"]
 
         wallet_info = self._request_wallet_info(request, token)
         if wallet_info is not None:
             profile_info = wallet_info["profile"]
             profile_id = profile_info["id"]
-            self.token_cache[token] = {
-                "id": profile_id,
-                "valid_until": now + self.cache_duration,
-                "wallet_info": wallet_info,
-            }
+            self.token_cache.set(
+                token,
+                {
+                    "id": profile_id,
+                    "wallet_info": wallet_info,
+                },
+            )
             request.wallet_info = wallet_info
 
-            request.owner  # Add the Owner to the database
-            request.dbsession.add(
-                OwnerLog(
-                    owner_id=profile_id,
-                    personal_id=request.personal_id,
-                    event_type="access",
-                    remote_addr=request.remote_addr,
-                    user_agent=request.user_agent,
-                    content={"title": profile_info["title"]},
+            if self.token_cache.add_seen(token):
+                # Log the first validation of the token, not the
+                # revalidations after its cache entry expires.
+                request.owner  # Add the Owner to the database
+                request.dbsession.add(
+                    OwnerLog(
+                        owner_id=profile_id,
+                        personal_id=request.personal_id,
+                        event_type="access",
+                        remote_addr=request.remote_addr,
+                        user_agent=request.user_agent,
+                        content={"title": profile_info["title"]},
+                    )
                 )
-            )
 
             return profile_id
 
@@ -89,9 +75,7 @@ class OPNTokenAuthenticationPolicy(object):
     def _request_wallet_info(self, request, token):
         """Get the wallet info from OPN."""
         url = "%s/wallet/info" % self.opn_api_url
-        r = requests.get(
-            url, headers={"Authorization": "Bearer %s" % token}, timeout=30
-        )
+        r = get_opn_client().get(url, token, endpoint="/wallet/info", timeout=30)
         if not check_requests_response(r, raise_exc=False):
             return None
         return r.json()
@@ -1,22 +1,19 @@
 import collections
 import datetime
 import logging
-from decimal import Decimal
 
-from opnreco.models.db import AccountEntry, FileMovement, Period, Reco, TransferRecord
-from opnreco.viewcommon import get_tzname
-from sqlalchemy import (
-    BigInteger,
-    Date,
-    Numeric,
-    String,
-    cast,
-    func,
-    literal,
-    select,
-    union_all,
+from opnreco.models.db import (
+    AccountEntry,
+    BundleMember,
+    FileMovement,
+    Period,
+    Reco,
+    TransferRecord,
 )
-from sqlalchemy.dialects.postgresql import array, array_agg
+from opnreco.viewcommon import get_tzname
+from sqlalchemy import and_, func, select, union_all
+from sqlalchemy.dialects.postgresql import aggregate_order_by, array, array_agg
+from sqlalchemy.orm import aliased
 
 log = logging.getLogger(__name__)
 
@@ -80,14 +77,10 @@ def build_single_movement_query(dbsession, owner, period):
     - delta
     - movement_ids
     """
-    movement_date_c = func.date(
-        func.timezone(get_tzname(owner), func.timezone("UTC", FileMovement.ts))
-    )
-
     return (
         dbsession.query(
             TransferRecord.transfer_id,
-            movement_date_c.label("date"),
+            FileMovement.local_date.label("date"),
             file_movement_delta.label("delta"),
             array([FileMovement.movement_id]).label("movement_ids"),
         )
@@ -104,265 +97,136 @@ def build_single_movement_query(dbsession, owner, period):
     )
 
 
-class BundleFinder:
+def build_bundle_query(dbsession, owner, period):
     """Build a query that lists the qualified, unreconciled bundled transfers.
 
-    (Note: In this class, there is a strict distinction between "bundle"
+    (Note: In this function, there is a strict distinction between "bundle"
     and "bundled". A bundle transfer contains bundled transfers.)
 
-    Find both the unreconciled bundle transfers and the related unreconciled
-    bundled transfers. Ensure they match, then provide a list of bundles
-    as a query with standard columns.
+    A bundle qualifies for automatic reconciliation, once for each issuer,
+    when every bundled transfer listed in bundle_member for that issuer has
+    unreconciled movements in this file that add up to the member's amount.
+    If a bundled transfer was not downloaded, is already reconciled (in
+    full or in part), or sent a different amount, the bundle does not
+    qualify for that issuer.
 
-    find() returns None if there are no qualified unreconciled bundle
-    transfers. Otherwise, it returns a query providing these columns:
+    Return a query providing these columns:
 
     - transfer_id
     - date
-    - currency
-    - loop_id
     - delta
     - movement_ids
     """
-
-    def __init__(self, dbsession, owner, period):
-        self.dbsession = dbsession
-        self.owner = owner
-        self.period = period
-
-    def find(self):
-        """Create and return bundle_query or None (if nothing qualifies)."""
-        movement_list_lookup = self.build_movement_list_lookup()
-        if not movement_list_lookup:
-            return None
-
-        bundle_records = self.list_bundle_records()
-        if not bundle_records:
-            return None
-
-        qualified_bundles = self.list_qualified_bundles(
-            bundle_records=bundle_records, movement_list_lookup=movement_list_lookup
-        )
-        if not qualified_bundles:
-            return None
-
-        return self.build_query(qualified_bundles=qualified_bundles)
-
-    def build_movement_list_lookup(self):
-        """List the unreconciled movements that could be part of bundles."""
-        dbsession = self.dbsession
-        owner = self.owner
-        period = self.period
-
-        movement_rows = (
-            dbsession.query(
-                FileMovement.issuer_id,
-                TransferRecord.transfer_id,
-                func.sum(file_movement_delta).label("delta"),
-                array_agg(FileMovement.movement_id).label("movement_ids"),
-            )
-            .select_from(FileMovement)
-            .join(TransferRecord, TransferRecord.id == FileMovement.transfer_record_id)
-            .join(Period, Period.id == FileMovement.period_id)
-            .filter(
-                FileMovement.owner_id == owner.id,
-                FileMovement.file_id == period.file_id,
-                FileMovement.reco_id == null,
-                file_movement_delta != 0,
-                TransferRecord.bundle_transfer_id != null,
-                ~Period.closed,
-            )
-            .group_by(
-                FileMovement.issuer_id,
-                TransferRecord.transfer_id,
-            )
-            .all()
+    # bundled_movement_cte lists the unreconciled bundled movements
+    # in the open periods of this file.
+    bundled_movement_cte = (
+        select(
+            FileMovement.movement_id,
+            FileMovement.issuer_id,
+            TransferRecord.transfer_id,
+            TransferRecord.bundle_transfer_id,
+            file_movement_delta.label("delta"),
         )
-
-        log.info(
-            "BundleFinder: %s unreconciled bundled movement(s) for period %s",
-            len(movement_rows),
-            period.id,
+        .select_from(FileMovement)
+        .join(TransferRecord, TransferRecord.id == FileMovement.transfer_record_id)
+        .join(Period, Period.id == FileMovement.period_id)
+        .where(
+            FileMovement.owner_id == owner.id,
+            FileMovement.file_id == period.file_id,
+            FileMovement.reco_id == null,
+            file_movement_delta != 0,
+            TransferRecord.bundle_transfer_id != null,
+            ~Period.closed,
         )
+        .cte("bundled_movement_cte")
+    )
 
-        # movement_list_lookup: {
-        #     (bundled_transfer_id, issuer_id): (delta, movement_ids)
-        # }
-        movement_list_lookup = {}
-        for row in movement_rows:
-            key = (row.transfer_id, row.issuer_id)
-            movement_list_lookup[key] = (row.delta, row.movement_ids)
-
-        return movement_list_lookup
-
-    def list_bundle_records(self):
-        """List bundle transfers that contain unreconciled bundled movements."""
-        dbsession = self.dbsession
-        owner = self.owner
-        period = self.period
-
-        # bundle_transfer_ids_cte lists the bundle transfer IDs
-        # of the unreconciled bundled movements for this file.
-        bundle_transfer_ids_cte = (
-            dbsession.query(TransferRecord.bundle_transfer_id)
-            .select_from(FileMovement)
-            .join(TransferRecord, TransferRecord.id == FileMovement.transfer_record_id)
-            .join(Period, Period.id == FileMovement.period_id)
-            .filter(
-                FileMovement.owner_id == owner.id,
-                FileMovement.file_id == period.file_id,
-                FileMovement.reco_id == null,
-                file_movement_delta != 0,
-                TransferRecord.bundle_transfer_id != null,
-                ~Period.closed,
-            )
-            .distinct()
-            .cte("bundle_transfer_ids_cte")
+    # member_movements lists the members of the bundles that contain
+    # unreconciled bundled movements, joined to the movements of each
+    # member. member_delta is the total delta of the movements of each
+    # member; it is null when the member has no movements.
+    bundle_record = aliased(TransferRecord, name="bundle_record")
+    member_key = (
+        BundleMember.bundle_record_id,
+        BundleMember.issuer_id,
+        BundleMember.transfer_id,
+    )
+    member_movements = (
+        select(
+            bundle_record.id.label("bundle_record_id"),
+            bundle_record.transfer_id,
+            bundle_record.start,
+            BundleMember.issuer_id,
+            BundleMember.amount,
+            func.sum(bundled_movement_cte.c.delta)
+            .over(partition_by=member_key)
+            .label("member_delta"),
+            bundled_movement_cte.c.movement_id,
+            bundled_movement_cte.c.delta,
         )
-
-        record_date_c = func.date(
-            func.timezone(get_tzname(owner), func.timezone("UTC", TransferRecord.start))
+        .select_from(bundle_record)
+        .join(BundleMember, BundleMember.bundle_record_id == bundle_record.id)
+        .outerjoin(
+            bundled_movement_cte,
+            and_(
+                bundled_movement_cte.c.transfer_id == BundleMember.transfer_id,
+                bundled_movement_cte.c.issuer_id == BundleMember.issuer_id,
+            ),
         )
-
-        bundle_records = (
-            dbsession.query(
-                TransferRecord.transfer_id,
-                TransferRecord.bundled_transfers,
-                record_date_c.label("date"),
-            )
-            .filter(
-                TransferRecord.owner_id == owner.id,
-                TransferRecord.transfer_id.in_(bundle_transfer_ids_cte.select()),
-                TransferRecord.bundled_transfers != null,
-                func.jsonb_array_length(TransferRecord.bundled_transfers) > 0,
-            )
-            .order_by(TransferRecord.start, TransferRecord.transfer_id)
-            .all()
+        .where(
+            bundle_record.owner_id == owner.id,
+            bundle_record.transfer_id.in_(
+                select(bundled_movement_cte.c.bundle_transfer_id)
+            ),
         )
+        .subquery("member_movements")
+    )
 
-        log.info(
-            "BundleFinder: %s unreconciled bundle(s) for period %s",
-            len(bundle_records),
-            period.id,
-        )
+    record_date_c = func.date(
+        func.timezone(get_tzname(owner), func.timezone("UTC", member_movements.c.start))
+    )
 
-        return bundle_records
-
-    def list_qualified_bundles(self, bundle_records, movement_list_lookup):
-        """List the bundle records qualified for auto reconciliation.
-
-        The results must be formatted for building the bundle_query.
-
-        Note that this may generate more than one bundle per transfer,
-        especially if the bundle transfer used multiple issuers.
-
-        Return [(
-            bundle_transfer_id,
-            date,
-            delta,
-            movement_ids,
-        )].
-        """
-        qualified_bundles = []
-
-        for bundle_record in bundle_records:
-            # specs is the mapping of movements required for each bundle
-            # to qualify for automatic bundle reconciliation.
-            # specs:
-            # {issuer_id: {bundled_transfer_id: delta}}
-            specs = collections.defaultdict(lambda: collections.defaultdict(Decimal))
-            for t in bundle_record.bundled_transfers:
-                key = t["issuer_id"]
-                specs[key][t["transfer_id"]] += Decimal(t["amount"])
-
-            for issuer_id, spec in sorted(specs.items()):
-                # issuer_id and spec describe a potentially reconcilable
-                # bundle. Do the unreconciled movements match the spec?
-                qualified = True
-                bundled_movement_ids = []
-                total_delta = Decimal()
-                for bundled_transfer_id, spec_delta in sorted(spec.items()):
-                    movement_key = (bundled_transfer_id, issuer_id)
-                    movements_info = movement_list_lookup.get(movement_key)
-                    if not movements_info:
-                        # The bundle should not be reconciled
-                        # automatically because this bundled transfer
-                        # was not downloaded or is already
-                        # reconciled (in full or in part).
-                        qualified = False
-                        break
-                    else:
-                        movements_delta, movement_ids = movements_info
-                        if movements_delta != spec_delta:
-                            # The bundle transfer should not be reconciled
-                            # automatically because this bundled transfer
-                            # did not send the specified amount or is already
-                            # reconciled (in full or in part).
-                            qualified = False
-                            break
-                        else:
-                            bundled_movement_ids.extend(movement_ids)
-                            total_delta += spec_delta
-
-                if not qualified:
-                    continue
-
-                # Found a qualified bundle. Add it to qualified_bundles.
-                qualified_bundles.append(
-                    (
-                        bundle_record.transfer_id,
-                        bundle_record.date,
-                        total_delta,
-                        bundled_movement_ids,
-                    )
+    return (
+        select(
+            member_movements.c.transfer_id,
+            record_date_c.label("date"),
+            func.sum(member_movements.c.delta).label("delta"),
+            array_agg(
+                aggregate_order_by(
+                    member_movements.c.movement_id, member_movements.c.movement_id
                 )
-
-        log.info(
-            "BundleFinder: %s qualified bundle(s) for period %s",
-            len(qualified_bundles),
-            self.period.id,
+            ).label("movement_ids"),
         )
-        return qualified_bundles
-
-    def build_query(self, qualified_bundles):
-        """Create a query from the qualified bundles."""
-        stmts = []
-        for tup in qualified_bundles:
-            (
-                transfer_id,
-                date,
-                delta,
-                movement_ids,
-            ) = tup
-            if not stmts:
-                # Apply column types and labels to the first row.
-                stmts.append(
-                    select(
-                        cast(literal(transfer_id), String).label("transfer_id"),
-                        cast(literal(date), Date).label("date"),
-                        cast(literal(delta), Numeric).label("delta"),
-                        array(movement_ids, type_=BigInteger).label("movement_ids"),
-                    )
-                )
-            else:
-                # The column types and labels in the remaining rows are
-                # inferred from the first row.
-                stmts.append(
-                    select(
-                        literal(transfer_id),
-                        literal(date),
-                        literal(delta),
-                        array(movement_ids),
-                    )
+        .group_by(
+            member_movements.c.bundle_record_id,
+            member_movements.c.transfer_id,
+            member_movements.c.start,
+            member_movements.c.issuer_id,
+        )
+        .having(
+            func.bool_and(
+                func.coalesce(
+                    member_movements.c.member_delta == member_movements.c.amount,
+                    False,
                 )
-
-        query = union_all(*stmts)
-        return query
+            )
+        )
+    )
 
 
 def auto_reco_statement(dbsession, owner, period, statement):
     """Add external reconciliations automatically for a statement."""
+    by_delta = list_statement_matches(
+        dbsession=dbsession, owner=owner, period=period, statement=statement
+    )
+    apply_matches(dbsession=dbsession, owner=owner, period=period, by_delta=by_delta)
+
 
+def list_statement_matches(dbsession, owner, period, statement, sql_date_window=True):
+    """List the possible reconciliations of a statement with movements.
+
+    Return {delta: [SortableMatch]}.
+    """
     # Reconcile with individual movements
     single_movement_query = build_single_movement_query(
         dbsession=dbsession, owner=owner, period=period
@@ -370,20 +234,54 @@ def auto_reco_statement(dbsession, owner, period, statement):
 
     # Also reconcile with bundled movements (receive_ach_file transfers,
     # for example.)
-    bundle_query = BundleFinder(dbsession=dbsession, owner=owner, period=period).find()
+    bundle_query = build_bundle_query(dbsession=dbsession, owner=owner, period=period)
+
+    movement_query = union_all(bundle_query, single_movement_query)
+
+    return find_matches(
+        dbsession=dbsession,
+        owner=owner,
+        period=period,
+        statement=statement,
+        movement_query=movement_query,
+        sql_date_window=sql_date_window,
+    )
 
-    if bundle_query is not None:
-        # Include bundle matches.
-        movement_query = union_all(bundle_query, single_movement_query)
-    else:
-        movement_query = single_movement_query
 
+def find_matches(
+    dbsession, owner, period, statement, movement_query, sql_date_window=True
+):
+    """List the possible reconciliations of a statement, grouped by delta.
+
+    Match the statement's unreconciled account entries with the movements
+    listed by movement_query that have the same delta. Qualify only the
+    matches where the account entry happened on the day of the movement
+    or up to max_autoreco_delay after.
+
+    If sql_date_window is true (the default), the date window is part of
+    the join condition, so the database discards the unqualified pairs.
+    Otherwise all the pairs with an equal delta are loaded and filtered
+    here, which is useful only for comparison (see
+    opnreco.scripts.benchautoreco).
+
+    Return {delta: [SortableMatch]}.
+    """
     movement_cte = movement_query.cte("movement_cte")
 
     # Build all_matches, a list of all possible reconciliations
     # of this statement with existing OPN movements.
     # This query is an intentional but filtered cartesian join between
-    # movement_cte and the account_entry table.
+    # movement_cte and the account_entry table. The date window keeps
+    # a large backlog of unreconciled movements from multiplying the
+    # result size.
+
+    join_condition = movement_cte.c.delta == AccountEntry.delta
+    if sql_date_window:
+        join_condition = and_(
+            join_condition,
+            AccountEntry.entry_date >= movement_cte.c.date,
+            AccountEntry.entry_date <= movement_cte.c.date + max_autoreco_delay.days,
+        )
 
     all_matches = (
         dbsession.query(
@@ -395,7 +293,7 @@ def auto_reco_statement(dbsession, owner, period, statement):
             movement_cte.c.date.label("movement_date"),
             movement_cte.c.transfer_id,
         )
-        .join(movement_cte, movement_cte.c.delta == AccountEntry.delta)
+        .join(movement_cte, join_condition)
         .join(Period, Period.id == AccountEntry.period_id)
         .filter(
             AccountEntry.owner_id == owner.id,
@@ -425,6 +323,11 @@ def auto_reco_statement(dbsession, owner, period, statement):
 
         by_delta[match.delta].append(SortableMatch(match))
 
+    return by_delta
+
+
+def apply_matches(dbsession, owner, period, by_delta):
+    """Create Recos for the best of the possible matches."""
     # For each group of possible matches in by_delta, apply the best
     # matches first. As matches are chosen, later matches are disqualified
     # automatically because the movement_id has been added to the
@@ -0,0 +1,140 @@
+"""Compress API responses for clients that accept gzip or brotli.
+
+Configure with these environment variables:
+
+- api_compress_min_size: the smallest body to compress, in bytes
+  (default 1024)
+- api_compress_level: the gzip compression level, 1-9 (default 6)
+- api_brotli_quality: the brotli quality, 0-11 (default 5). Brotli is
+  offered only when the brotli package is installed.
+
+The size, ratio, and time counters are logged every stats_log_interval
+seconds (default 300).
+"""
+
+import gzip
+import logging
+import os
+import threading
+import time
+
+from opnreco.util import PeriodicStatsLog
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+log = logging.getLogger(__name__)
+
+compressible_types = frozenset(
+    [
+        "application/json",
+        "text/html",
+        "text/plain",
+    ]
+)
+
+
+class CompressionStats:
+    """Size and time counters for one content encoding."""
+
+    def __init__(self):
+        self.count = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.total_seconds = 0.0
+
+    def add(self, bytes_in: int, bytes_out: int, seconds: float):
+        self.count += 1
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        self.total_seconds += seconds
+
+    def as_json(self) -> dict:
+        return {
+            "count": self.count,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "ratio": self.bytes_in / self.bytes_out if self.bytes_out else 0.0,
+            "total_seconds": self.total_seconds,
+        }
+
+
+_stats: dict[str, CompressionStats] = {}
+_stats_lock = threading.Lock()
+
+
+def get_compression_stats() -> dict[str, dict]:
+    """Get a snapshot of the compression counters by content encoding."""
+    with _stats_lock:
+        return {encoding: stats.as_json() for encoding, stats in _stats.items()}
+
+
+def reset_compression_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def tween_factory(handler, registry):
+    environ = os.environ
+    min_size = int(environ.get("api_compress_min_size", "1024"))
+    gzip_level = int(environ.get("api_compress_level", "6"))
+    brotli_quality = int(environ.get("api_brotli_quality", "5"))
+
+    compressors = {"gzip": lambda body: gzip.compress(body, compresslevel=gzip_level)}
+    if brotli is not None:
+        compressors["br"] = lambda body: brotli.compress(body, quality=brotli_quality)
+    # List the preferred encoding first.
+    offers = sorted(compressors, key=lambda encoding: encoding != "br")
+    stats_log = PeriodicStatsLog(
+        log, "API compression stats by encoding: %s", get_compression_stats
+    )
+
+    def compress_tween(request):
+        response = handler(request)
+        if (
+            response is None
+            or not request.path.startswith("/api/")
+            or response.status_code != 200
+            or response.content_encoding
+            or response.content_type not in compressible_types
+        ):
+            return response
+
+        # The response depends on Accept-Encoding even when uncompressed.
+        response.vary = tuple(response.vary or ()) + ("Accept-Encoding",)
+
+        if not request.headers.get("Accept-Encoding"):
+            # Don't compress for clients that don't ask for it, even
+            # though HTTP allows any encoding in that case.
+            return response
+
+        accepted = request.accept_encoding.acceptable_offers(offers)
+        if not accepted:
+            return response
+
+        body = response.body
+        if len(body) < min_size:
+            return response
+
+        encoding = accepted[0][0]
+        start = time.monotonic()
+        compressed = compressors[encoding](body)
+        elapsed = time.monotonic() - start
+
+        response.body = compressed
+        response.content_encoding = encoding
+        with _stats_lock:
+            stats = _stats.get(encoding)
+            if stats is None:
+                stats = _stats[encoding] = CompressionStats()
+            stats.add(len(body), len(compressed), elapsed)
+        stats_log.maybe_log()
+        return response
+
+    return compress_tween
+
+
+def includeme(config):
+    config.add_tween("opnreco.compress.tween_factory")
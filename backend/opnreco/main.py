@@ -2,12 +2,12 @@ import datetime
 import os
 import re
 
-import requests
 import sqlalchemy.dialects.postgresql
 from dotenv import load_dotenv
 from opnreco.auth import OPNTokenAuthenticationPolicy
 from opnreco.models.db import Owner, OwnerLog
 from opnreco.models.site import Site
+from opnreco.opnclient import get_opn_client
 from opnreco.render import CustomJSONRenderer
 from opnreco.util import check_requests_response
 from pyramid.authorization import ACLAuthorizationPolicy
@@ -49,7 +49,7 @@ def wallet_info(request):
 
     api_url = os.environ["opn_api_url"]
     url = "%s/wallet/info" % api_url
-    r = requests.get(url, headers={"Authorization": "Bearer %s" % access_token})
+    r = get_opn_client().get(url, access_token, endpoint="/wallet/info")
     check_requests_response(r)
     return r.json()
 
@@ -142,6 +142,7 @@ def main(global_config, **settings):
     config.add_renderer("json", CustomJSONRenderer)
 
     config.include("opnreco.cors")
+    config.include("opnreco.compress")
     config.include("pyramid_retry")
     config.include("pyramid_tm")
     config.include("opnreco.models.dbmeta")
@@ -0,0 +1,896 @@
+-- Convert to the 2.3 schema.
+
+begin;
+
+-- Add the period_sum table, which holds running sums of the movements and
+-- account entries in each period.
+
+CREATE TABLE public.period_sum (
+    period_id bigint NOT NULL,
+    owner_id character varying NOT NULL,
+    internal_reco_circ numeric NOT NULL,
+    internal_reco_surplus numeric NOT NULL,
+    external_reco_circ numeric NOT NULL,
+    reco_entries_delta numeric NOT NULL,
+    unreco_movements_circ numeric NOT NULL,
+    unreco_movements_surplus numeric NOT NULL,
+    unreco_entries_delta numeric NOT NULL
+);
+
+ALTER TABLE ONLY public.period_sum
+    ADD CONSTRAINT pk_period_sum PRIMARY KEY (period_id);
+
+ALTER TABLE ONLY public.period_sum
+    ADD CONSTRAINT fk_period_sum_period_id_period FOREIGN KEY (period_id)
+        REFERENCES public.period(id) ON DELETE CASCADE;
+
+ALTER TABLE ONLY public.period_sum
+    ADD CONSTRAINT fk_period_sum_owner_id_owner FOREIGN KEY (owner_id)
+        REFERENCES public.owner(id);
+
+CREATE INDEX ix_period_sum_owner_id ON public.period_sum USING btree (owner_id);
+
+insert into period_sum (
+    period_id,
+    owner_id,
+    internal_reco_circ,
+    internal_reco_surplus,
+    external_reco_circ,
+    reco_entries_delta,
+    unreco_movements_circ,
+    unreco_movements_surplus,
+    unreco_entries_delta)
+select
+    period.id,
+    period.owner_id,
+    coalesce(fm_internal.circ, 0),
+    coalesce(fm_internal.surplus, 0),
+    coalesce(fm_external.circ, 0),
+    coalesce(entry_reco.delta, 0),
+    coalesce(fm_unreco.circ, 0),
+    coalesce(fm_unreco.surplus, 0),
+    coalesce(entry_unreco.delta, 0)
+from period
+left join (
+    select file_movement.period_id,
+        sum(-file_movement.vault_delta) as circ,
+        sum(file_movement.surplus_delta) as surplus
+    from file_movement
+    join reco on (reco.id = file_movement.reco_id)
+    where reco.internal
+    group by file_movement.period_id
+) fm_internal on (fm_internal.period_id = period.id)
+left join (
+    select file_movement.period_id,
+        sum(-file_movement.vault_delta) as circ
+    from file_movement
+    join reco on (reco.id = file_movement.reco_id)
+    where not reco.internal
+    group by file_movement.period_id
+) fm_external on (fm_external.period_id = period.id)
+left join (
+    select period_id,
+        sum(-vault_delta) as circ,
+        sum(surplus_delta) as surplus
+    from file_movement
+    where reco_id is null
+    group by period_id
+) fm_unreco on (fm_unreco.period_id = period.id)
+left join (
+    select period_id, sum(delta) as delta
+    from account_entry
+    where reco_id is not null
+    group by period_id
+) entry_reco on (entry_reco.period_id = period.id)
+left join (
+    select period_id, sum(delta) as delta
+    from account_entry
+    where reco_id is null
+    group by period_id
+) entry_unreco on (entry_unreco.period_id = period.id);
+
+create or replace function period_sum_add(
+    owner_id_input varchar,
+    period_id_input bigint,
+    internal_reco_circ_input numeric,
+    internal_reco_surplus_input numeric,
+    external_reco_circ_input numeric,
+    reco_entries_delta_input numeric,
+    unreco_movements_circ_input numeric,
+    unreco_movements_surplus_input numeric,
+    unreco_entries_delta_input numeric
+) returns void
+as $body$
+begin
+    insert into period_sum as ps (
+        period_id,
+        owner_id,
+        internal_reco_circ,
+        internal_reco_surplus,
+        external_reco_circ,
+        reco_entries_delta,
+        unreco_movements_circ,
+        unreco_movements_surplus,
+        unreco_entries_delta)
+    values (
+        period_id_input,
+        owner_id_input,
+        internal_reco_circ_input,
+        internal_reco_surplus_input,
+        external_reco_circ_input,
+        reco_entries_delta_input,
+        unreco_movements_circ_input,
+        unreco_movements_surplus_input,
+        unreco_entries_delta_input)
+    on conflict (period_id) do update set
+        internal_reco_circ =
+            ps.internal_reco_circ + excluded.internal_reco_circ,
+        internal_reco_surplus =
+            ps.internal_reco_surplus + excluded.internal_reco_surplus,
+        external_reco_circ =
+            ps.external_reco_circ + excluded.external_reco_circ,
+        reco_entries_delta =
+            ps.reco_entries_delta + excluded.reco_entries_delta,
+        unreco_movements_circ =
+            ps.unreco_movements_circ + excluded.unreco_movements_circ,
+        unreco_movements_surplus =
+            ps.unreco_movements_surplus + excluded.unreco_movements_surplus,
+        unreco_entries_delta =
+            ps.unreco_entries_delta + excluded.unreco_entries_delta;
+end;
+$body$ language plpgsql;
+
+create or replace function period_sum_add_file_movement(
+    fm file_movement, sign numeric
+) returns void
+as $body$
+declare
+    circ numeric := -sign * fm.vault_delta;
+    surplus numeric := sign * fm.surplus_delta;
+begin
+    if fm.reco_id is null then
+        perform period_sum_add(
+            fm.owner_id, fm.period_id, 0, 0, 0, 0, circ, surplus, 0);
+    elsif (select internal from reco where id = fm.reco_id) then
+        perform period_sum_add(
+            fm.owner_id, fm.period_id, circ, surplus, 0, 0, 0, 0, 0);
+    else
+        perform period_sum_add(
+            fm.owner_id, fm.period_id, 0, 0, circ, 0, 0, 0, 0);
+    end if;
+end;
+$body$ language plpgsql;
+
+create or replace function period_sum_file_movement_process() returns trigger
+as $triggerbody$
+begin
+    if (TG_OP = 'UPDATE'
+            and old.period_id = new.period_id
+            and old.reco_id is not distinct from new.reco_id
+            and old.vault_delta = new.vault_delta
+            and old.surplus_delta = new.surplus_delta) then
+        return null;
+    end if;
+    if (TG_OP = 'UPDATE' or TG_OP = 'DELETE') then
+        perform period_sum_add_file_movement(old, -1);
+    end if;
+    if (TG_OP = 'UPDATE' or TG_OP = 'INSERT') then
+        perform period_sum_add_file_movement(new, 1);
+    end if;
+    return null;
+end;
+$triggerbody$ language plpgsql;
+
+create trigger period_sum_file_movement_trigger
+after insert or update or delete on file_movement
+    for each row execute procedure period_sum_file_movement_process();
+
+create or replace function period_sum_add_account_entry(
+    e account_entry, sign numeric
+) returns void
+as $body$
+begin
+    if e.reco_id is null then
+        perform period_sum_add(
+            e.owner_id, e.period_id, 0, 0, 0, 0, 0, 0, sign * e.delta);
+    else
+        perform period_sum_add(
+            e.owner_id, e.period_id, 0, 0, 0, sign * e.delta, 0, 0, 0);
+    end if;
+end;
+$body$ language plpgsql;
+
+create or replace function period_sum_account_entry_process() returns trigger
+as $triggerbody$
+begin
+    if (TG_OP = 'UPDATE'
+            and old.period_id = new.period_id
+            and old.reco_id is not distinct from new.reco_id
+            and old.delta = new.delta) then
+        return null;
+    end if;
+    if (TG_OP = 'UPDATE' or TG_OP = 'DELETE') then
+        perform period_sum_add_account_entry(old, -1);
+    end if;
+    if (TG_OP = 'UPDATE' or TG_OP = 'INSERT') then
+        perform period_sum_add_account_entry(new, 1);
+    end if;
+    return null;
+end;
+$triggerbody$ language plpgsql;
+
+create trigger period_sum_account_entry_trigger
+after update or delete on account_entry
+    for each row execute procedure period_sum_account_entry_process();
+
+-- Add inserted account entries to the sums once per period rather than
+-- once per row.
+create or replace function period_sum_account_entry_insert_process()
+returns trigger
+as $triggerbody$
+begin
+    perform period_sum_add(
+        s.owner_id, s.period_id, 0, 0, 0, s.reco_delta, 0, 0, s.unreco_delta)
+    from (
+        select
+            owner_id,
+            period_id,
+            coalesce(sum(delta) filter (where reco_id is not null), 0)
+                as reco_delta,
+            coalesce(sum(delta) filter (where reco_id is null), 0)
+                as unreco_delta
+        from new_rows
+        group by owner_id, period_id
+    ) s;
+    return null;
+end;
+$triggerbody$ language plpgsql;
+
+create trigger period_sum_account_entry_insert_trigger
+after insert on account_entry
+    referencing new table as new_rows
+    for each statement
+    execute procedure period_sum_account_entry_insert_process();
+
+create or replace function period_sum_reco_process() returns trigger
+as $triggerbody$
+declare
+    sign numeric := case when new.internal then 1 else -1 end;
+    row record;
+begin
+    -- Move the sums of the reco's movements between the internal
+    -- and external columns.
+    for row in
+        select owner_id, period_id,
+            sum(-vault_delta) as circ, sum(surplus_delta) as surplus
+        from file_movement
+        where reco_id = new.id
+        group by owner_id, period_id
+    loop
+        perform period_sum_add(
+            row.owner_id,
+            row.period_id,
+            sign * row.circ,
+            sign * row.surplus,
+            -sign * row.circ,
+            0, 0, 0, 0);
+    end loop;
+    return null;
+end;
+$triggerbody$ language plpgsql;
+
+create trigger period_sum_reco_trigger
+after update of internal on reco
+    for each row when (old.internal is distinct from new.internal)
+    execute procedure period_sum_reco_process();
+
+commit;
+
+begin;
+
+-- Add the sync_job table, the queue of background syncs run by
+-- opnreco_sync_worker.
+
+CREATE TABLE public.sync_job (
+    id bigint NOT NULL,
+    owner_id character varying NOT NULL,
+    created timestamp without time zone DEFAULT timezone('UTC'::text, now()) NOT NULL,
+    updated timestamp without time zone DEFAULT timezone('UTC'::text, now()) NOT NULL,
+    state character varying NOT NULL,
+    personal_id character varying NOT NULL,
+    access_token character varying,
+    remote_addr character varying,
+    user_agent character varying,
+    progress_percent integer NOT NULL,
+    change_count bigint NOT NULL,
+    download_count bigint NOT NULL,
+    first_sync_ts timestamp without time zone,
+    last_sync_ts timestamp without time zone,
+    error_type character varying,
+    error_description character varying,
+    CONSTRAINT ck_sync_job_state CHECK (
+        ((state)::text = ANY ((ARRAY['queued', 'running', 'done', 'failed'])::text[]))),
+    CONSTRAINT ck_sync_job_finished_without_token CHECK (
+        ((state)::text = ANY ((ARRAY['queued', 'running'])::text[]))
+        OR access_token IS NULL)
+);
+
+CREATE SEQUENCE public.sync_job_id_seq
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1;
+
+ALTER SEQUENCE public.sync_job_id_seq OWNED BY public.sync_job.id;
+
+ALTER TABLE ONLY public.sync_job
+    ADD CONSTRAINT pk_sync_job PRIMARY KEY (id),
+    ALTER COLUMN id SET DEFAULT nextval('public.sync_job_id_seq'::regclass);
+
+ALTER TABLE ONLY public.sync_job
+    ADD CONSTRAINT fk_sync_job_owner_id_owner FOREIGN KEY (owner_id)
+        REFERENCES public.owner(id);
+
+CREATE INDEX ix_sync_job_owner_id ON public.sync_job USING btree (owner_id);
+
+CREATE UNIQUE INDEX ix_sync_job_single_active ON public.sync_job
+    USING btree (owner_id)
+    WHERE ((state)::text = ANY ((ARRAY['queued', 'running'])::text[]));
+
+CREATE INDEX ix_sync_job_active ON public.sync_job
+    USING btree (id)
+    WHERE ((state)::text = ANY ((ARRAY['queued', 'running'])::text[]));
+
+commit;
+
+begin;
+
+-- Log account entry inserts with a statement-level trigger.
+
+drop trigger account_entry_log_trigger on account_entry;
+
+create trigger account_entry_log_trigger
+after update or delete on account_entry
+    for each row execute procedure account_entry_log_process();
+
+create or replace function account_entry_log_insert_process() returns trigger
+as $triggerbody$
+begin
+    insert into account_entry_log (
+        account_entry_id,
+        personal_id,
+        event_type,
+        statement_id,
+        sheet,
+        row,
+        entry_date,
+        delta,
+        description,
+        reco_id
+    )
+    select
+        new_rows.id,
+        current_setting('opnreco.personal_id'),
+        current_setting('opnreco.account_entry.event_type'),
+        new_rows.statement_id,
+        new_rows.sheet,
+        new_rows.row,
+        new_rows.entry_date,
+        new_rows.delta,
+        new_rows.description,
+        new_rows.reco_id
+    from new_rows
+    order by new_rows.id;
+    return null;
+end;
+$triggerbody$ language plpgsql;
+
+create trigger account_entry_log_insert_trigger
+after insert on account_entry
+    referencing new table as new_rows
+    for each statement execute procedure account_entry_log_insert_process();
+
+commit;
+
+begin;
+
+-- Add the reco_summary table, which holds the aggregates of the movements
+-- and account entries in each reco.
+
+CREATE TABLE public.reco_summary (
+    reco_id bigint NOT NULL,
+    movement_count integer NOT NULL,
+    wallet_delta numeric,
+    vault_delta numeric,
+    surplus_delta numeric,
+    min_ts timestamp without time zone,
+    entry_count integer NOT NULL,
+    account_delta numeric,
+    min_entry_date date
+);
+
+ALTER TABLE ONLY public.reco_summary
+    ADD CONSTRAINT pk_reco_summary PRIMARY KEY (reco_id);
+
+ALTER TABLE ONLY public.reco_summary
+    ADD CONSTRAINT fk_reco_summary_reco_id_reco FOREIGN KEY (reco_id)
+        REFERENCES public.reco(id) ON DELETE CASCADE;
+
+create or replace function reco_summary_refresh(reco_ids bigint[])
+returns void
+as $body$
+begin
+    insert into reco_summary as rs (
+        reco_id,
+        movement_count,
+        wallet_delta,
+        vault_delta,
+        surplus_delta,
+        min_ts,
+        entry_count,
+        account_delta,
+        min_entry_date)
+    select
+        reco.id,
+        coalesce(m.movement_count, 0),
+        m.wallet_delta,
+        m.vault_delta,
+        m.surplus_delta,
+        m.min_ts,
+        coalesce(e.entry_count, 0),
+        e.account_delta,
+        e.min_entry_date
+    from reco
+    left join (
+        select
+            reco_id,
+            count(1) as movement_count,
+            sum(wallet_delta) as wallet_delta,
+            sum(vault_delta) as vault_delta,
+            sum(surplus_delta) as surplus_delta,
+            min(ts) as min_ts
+        from file_movement
+        where reco_id = any(reco_ids)
+        group by reco_id
+    ) m on (m.reco_id = reco.id)
+    left join (
+        select
+            reco_id,
+            count(1) as entry_count,
+            sum(delta) as account_delta,
+            min(entry_date) as min_entry_date
+        from account_entry
+        where reco_id = any(reco_ids)
+        group by reco_id
+    ) e on (e.reco_id = reco.id)
+    where reco.id = any(reco_ids)
+    on conflict (reco_id) do update set
+        movement_count = excluded.movement_count,
+        wallet_delta = excluded.wallet_delta,
+        vault_delta = excluded.vault_delta,
+        surplus_delta = excluded.surplus_delta,
+        min_ts = excluded.min_ts,
+        entry_count = excluded.entry_count,
+        account_delta = excluded.account_delta,
+        min_entry_date = excluded.min_entry_date;
+end;
+$body$ language plpgsql;
+
+-- Refresh the recos affected by a statement once per statement.
+create or replace function reco_summary_file_movement_process()
+returns trigger
+as $triggerbody$
+begin
+    if TG_OP = 'INSERT' then
+        perform reco_summary_refresh(array(
+            select distinct reco_id from new_rows
+            where reco_id is not null));
+    elsif TG_OP = 'DELETE' then
+        perform reco_summary_refresh(array(
+            select distinct reco_id from old_rows
+            where reco_id is not null));
+    else
+        perform reco_summary_refresh(array(
+            select distinct changed.reco_id
+            from old_rows o
+            join new_rows n using (file_id, movement_id)
+            cross join lateral (values (o.reco_id), (n.reco_id))
+                as changed (reco_id)
+            where changed.reco_id is not null
+                and (o.reco_id, o.wallet_delta, o.vault_delta,
+                    o.surplus_delta, o.ts)
+                is distinct from (n.reco_id, n.wallet_delta, n.vault_delta,
+                    n.surplus_delta, n.ts)));
+    end if;
+    return null;
+end;
+$triggerbody$ language plpgsql;
+
+create trigger reco_summary_file_movement_insert_trigger
+after insert on file_movement
+    referencing new table as new_rows
+    for each statement
+    execute procedure reco_summary_file_movement_process();
+
+create trigger reco_summary_file_movement_update_trigger
+after update on file_movement
+    referencing old table as old_rows new table as new_rows
+    for each statement
+    execute procedure reco_summary_file_movement_process();
+
+create trigger reco_summary_file_movement_delete_trigger
+after delete on file_movement
+    referencing old table as old_rows
+    for each statement
+    execute procedure reco_summary_file_movement_process();
+
+create or replace function reco_summary_account_entry_process()
+returns trigger
+as $triggerbody$
+begin
+    if TG_OP = 'INSERT' then
+        perform reco_summary_refresh(array(
+            select distinct reco_id from new_rows
+            where reco_id is not null));
+    elsif TG_OP = 'DELETE' then
+        perform reco_summary_refresh(array(
+            select distinct reco_id from old_rows
+            where reco_id is not null));
+    else
+        perform reco_summary_refresh(array(
+            select distinct changed.reco_id
+            from old_rows o
+            join new_rows n using (id)
+            cross join lateral (values (o.reco_id), (n.reco_id))
+                as changed (reco_id)
+            where changed.reco_id is not null
+                and (o.reco_id, o.delta, o.entry_date)
+                is distinct from (n.reco_id, n.delta, n.entry_date)));
+    end if;
+    return null;
+end;
+$triggerbody$ language plpgsql;
+
+create trigger reco_summary_account_entry_insert_trigger
+after insert on account_entry
+    referencing new table as new_rows
+    for each statement
+    execute procedure reco_summary_account_entry_process();
+
+create trigger reco_summary_account_entry_update_trigger
+after update on account_entry
+    referencing old table as old_rows new table as new_rows
+    for each statement
+    execute procedure reco_summary_account_entry_process();
+
+create trigger reco_summary_account_entry_delete_trigger
+after delete on account_entry
+    referencing old table as old_rows
+    for each statement
+    execute procedure reco_summary_account_entry_process();
+
+select reco_summary_refresh(array(select id from reco));
+
+commit;
+
+begin;
+
+-- Add period.date_range, the inclusive range of dates in each period.
+-- Prevent overlapping periods in a file with an exclusion constraint.
+-- The constraint can't be added while periods overlap, so list any
+-- overlapping periods first; fix them and run this block again.
+
+ALTER TABLE public.period
+    ADD COLUMN date_range daterange
+    GENERATED ALWAYS AS (daterange(start_date, end_date, '[]')) STORED;
+
+do $body$
+declare
+    overlap_list text;
+begin
+    select string_agg(
+        format('file %s: periods %s and %s', a.file_id, a.id, b.id),
+        '; ' order by a.file_id, a.id, b.id)
+    into overlap_list
+    from period a
+    join period b on (
+        b.file_id = a.file_id
+        and b.id > a.id
+        and b.date_range && a.date_range);
+
+    if overlap_list is not null then
+        raise exception 'Overlapping periods: %', overlap_list
+            using hint = 'Change the dates so the periods of each file '
+                'do not overlap, then run this migration block again.';
+    end if;
+end;
+$body$;
+
+ALTER TABLE public.period ADD CONSTRAINT ex_period_date_range
+    EXCLUDE USING gist (
+        int8range(file_id, file_id, '[]') WITH &&,
+        date_range WITH &&);
+
+commit;
+
+begin;
+
+-- Add partial indexes of the unreconciled movements and account entries.
+-- The included columns allow index-only scans for the period totals.
+
+CREATE INDEX ix_file_movement_unreco_period ON public.file_movement USING btree (period_id) INCLUDE (owner_id, wallet_delta, vault_delta, surplus_delta) WHERE (reco_id IS NULL);
+CREATE INDEX ix_account_entry_unreco_period ON public.account_entry USING btree (period_id) INCLUDE (owner_id, delta) WHERE (reco_id IS NULL);
+
+commit;
+
+
+begin;
+
+-- Index the substring searches of the reco dialog with trigrams when the
+-- pg_trgm extension is available.
+
+do $body$
+begin
+    begin
+        create extension if not exists pg_trgm;
+    exception when others then
+        raise notice 'pg_trgm is not available: %', sqlerrm;
+    end;
+
+    if exists (select 1 from pg_extension where extname = 'pg_trgm') then
+        create index ix_transfer_record_transfer_id_trgm on transfer_record
+            using gin (transfer_id gin_trgm_ops);
+        create index ix_account_entry_description_trgm on account_entry
+            using gin (description gin_trgm_ops);
+    end if;
+end;
+$body$;
+
+commit;
+
+begin;
+
+-- Store the absolute deltas of movements and account entries and index
+-- them for the amount searches of the reco dialog. Adding the stored
+-- columns rewrites both tables.
+
+ALTER TABLE public.file_movement
+    ADD COLUMN abs_wallet_delta numeric
+        GENERATED ALWAYS AS (abs(wallet_delta)) STORED,
+    ADD COLUMN abs_vault_delta numeric
+        GENERATED ALWAYS AS (abs(vault_delta)) STORED;
+
+ALTER TABLE public.account_entry
+    ADD COLUMN abs_delta numeric GENERATED ALWAYS AS (abs(delta)) STORED;
+
+CREATE INDEX ix_file_movement_abs_wallet_delta ON public.file_movement USING btree (owner_id, file_id, abs_wallet_delta);
+CREATE INDEX ix_file_movement_abs_vault_delta ON public.file_movement USING btree (owner_id, file_id, abs_vault_delta);
+CREATE INDEX ix_account_entry_abs_delta ON public.account_entry USING btree (owner_id, file_id, abs_delta);
+
+commit;
+
+begin;
+
+-- Add file_movement.local_date, the date of each movement in the owner's
+-- time zone, and reco_summary.min_local_date. Skip the movement log while
+-- filling in the dates; the reco_summary trigger fills in min_local_date.
+
+ALTER TABLE public.reco_summary ADD COLUMN min_local_date date;
+ALTER TABLE public.file_movement ADD COLUMN local_date date;
+
+create or replace function reco_summary_refresh(reco_ids bigint[])
+returns void
+as $body$
+begin
+    insert into reco_summary as rs (
+        reco_id,
+        movement_count,
+        wallet_delta,
+        vault_delta,
+        surplus_delta,
+        min_ts,
+        min_local_date,
+        entry_count,
+        account_delta,
+        min_entry_date)
+    select
+        reco.id,
+        coalesce(m.movement_count, 0),
+        m.wallet_delta,
+        m.vault_delta,
+        m.surplus_delta,
+        m.min_ts,
+        m.min_local_date,
+        coalesce(e.entry_count, 0),
+        e.account_delta,
+        e.min_entry_date
+    from reco
+    left join (
+        select
+            reco_id,
+            count(1) as movement_count,
+            sum(wallet_delta) as wallet_delta,
+            sum(vault_delta) as vault_delta,
+            sum(surplus_delta) as surplus_delta,
+            min(ts) as min_ts,
+            min(local_date) as min_local_date
+        from file_movement
+        where reco_id = any(reco_ids)
+        group by reco_id
+    ) m on (m.reco_id = reco.id)
+    left join (
+        select
+            reco_id,
+            count(1) as entry_count,
+            sum(delta) as account_delta,
+            min(entry_date) as min_entry_date
+        from account_entry
+        where reco_id = any(reco_ids)
+        group by reco_id
+    ) e on (e.reco_id = reco.id)
+    where reco.id = any(reco_ids)
+    on conflict (reco_id) do update set
+        movement_count = excluded.movement_count,
+        wallet_delta = excluded.wallet_delta,
+        vault_delta = excluded.vault_delta,
+        surplus_delta = excluded.surplus_delta,
+        min_ts = excluded.min_ts,
+        min_local_date = excluded.min_local_date,
+        entry_count = excluded.entry_count,
+        account_delta = excluded.account_delta,
+        min_entry_date = excluded.min_entry_date;
+end;
+$body$ language plpgsql;
+
+-- Refresh the recos affected by a statement once per statement.
+create or replace function reco_summary_file_movement_process()
+returns trigger
+as $triggerbody$
+begin
+    if TG_OP = 'INSERT' then
+        perform reco_summary_refresh(array(
+            select distinct reco_id from new_rows
+            where reco_id is not null));
+    elsif TG_OP = 'DELETE' then
+        perform reco_summary_refresh(array(
+            select distinct reco_id from old_rows
+            where reco_id is not null));
+    else
+        perform reco_summary_refresh(array(
+            select distinct changed.reco_id
+            from old_rows o
+            join new_rows n using (file_id, movement_id)
+            cross join lateral (values (o.reco_id), (n.reco_id))
+                as changed (reco_id)
+            where changed.reco_id is not null
+                and (o.reco_id, o.wallet_delta, o.vault_delta,
+                    o.surplus_delta, o.ts, o.local_date)
+                is distinct from (n.reco_id, n.wallet_delta, n.vault_delta,
+                    n.surplus_delta, n.ts, n.local_date)));
+    end if;
+    return null;
+end;
+$triggerbody$ language plpgsql;
+
+alter table file_movement disable trigger file_movement_log_trigger;
+
+update file_movement set local_date = date(timezone(
+    coalesce(nullif(owner.tzname, ''), 'America/New_York'),
+    timezone('UTC', file_movement.ts)))
+from owner
+where owner.id = file_movement.owner_id;
+
+alter table file_movement enable trigger file_movement_log_trigger;
+
+ALTER TABLE public.file_movement ALTER COLUMN local_date SET NOT NULL;
+
+create or replace function file_movement_local_date_process() returns trigger
+as $triggerbody$
+begin
+    select date(timezone(
+        coalesce(nullif(owner.tzname, ''), 'America/New_York'),
+        timezone('UTC', new.ts)))
+    into new.local_date
+    from owner
+    where owner.id = new.owner_id;
+    return new;
+end;
+$triggerbody$ language plpgsql;
+
+create trigger file_movement_local_date_trigger
+before insert on file_movement
+    for each row when (new.local_date is null)
+    execute procedure file_movement_local_date_process();
+
+CREATE INDEX ix_file_movement_local_date ON public.file_movement USING btree (owner_id, file_id, local_date);
+
+commit;
+
+begin;
+
+-- Add the bundle_member table, maintained from
+-- transfer_record.bundled_transfers by triggers.
+
+CREATE TABLE public.bundle_member (
+    bundle_record_id bigint NOT NULL,
+    transfer_id character varying NOT NULL,
+    issuer_id character varying NOT NULL,
+    amount numeric NOT NULL
+);
+
+ALTER TABLE ONLY public.bundle_member
+    ADD CONSTRAINT pk_bundle_member PRIMARY KEY (bundle_record_id, transfer_id, issuer_id);
+
+ALTER TABLE ONLY public.bundle_member
+    ADD CONSTRAINT fk_bundle_member_bundle_record_id_transfer_record FOREIGN KEY (bundle_record_id) REFERENCES public.transfer_record(id) ON DELETE CASCADE;
+
+CREATE INDEX ix_bundle_member_transfer_id ON public.bundle_member USING btree (transfer_id, issuer_id);
+
+create or replace function bundle_member_refresh(record_ids bigint[])
+returns void
+as $body$
+begin
+    delete from bundle_member where bundle_record_id = any(record_ids);
+    -- A bundle with any element that lacks a transfer ID, an issuer ID,
+    -- or a decimal amount gets no members, so it never qualifies for
+    -- auto-reconciliation. (Skipping just the bad elements could let the
+    -- rest of the bundle qualify without them.)
+    insert into bundle_member (bundle_record_id, transfer_id, issuer_id, amount)
+    select
+        transfer_record.id,
+        t.value ->> 'transfer_id',
+        t.value ->> 'issuer_id',
+        sum((t.value ->> 'amount')::numeric)
+    from transfer_record
+    cross join jsonb_array_elements(transfer_record.bundled_transfers) t
+    where transfer_record.id = any(record_ids)
+        and transfer_record.bundled_transfers is not null
+        and not exists (
+            select 1
+            from jsonb_array_elements(transfer_record.bundled_transfers) e
+            where e.value ->> 'transfer_id' is null
+                or e.value ->> 'issuer_id' is null
+                or coalesce(e.value ->> 'amount', '')
+                    !~ '^[+-]?([0-9]+([.][0-9]*)?|[.][0-9]+)$')
+    group by transfer_record.id, 2, 3;
+end;
+$body$ language plpgsql;
+
+-- Refresh the bundles affected by a statement once per statement.
+-- Deleted transfer records cascade to bundle_member.
+create or replace function bundle_member_transfer_record_process()
+returns trigger
+as $triggerbody$
+begin
+    if TG_OP = 'INSERT' then
+        perform bundle_member_refresh(array(
+            select id from new_rows
+            where bundled_transfers is not null));
+    else
+        perform bundle_member_refresh(array(
+            select n.id
+            from old_rows o
+            join new_rows n using (id)
+            where o.bundled_transfers is distinct from n.bundled_transfers));
+    end if;
+    return null;
+end;
+$triggerbody$ language plpgsql;
+
+create trigger bundle_member_transfer_record_insert_trigger
+after insert on transfer_record
+    referencing new table as new_rows
+    for each statement
+    execute procedure bundle_member_transfer_record_process();
+
+create trigger bundle_member_transfer_record_update_trigger
+after update on transfer_record
+    referencing old table as old_rows new table as new_rows
+    for each statement
+    execute procedure bundle_member_transfer_record_process();
+
+select bundle_member_refresh(array(
+    select id from transfer_record where bundled_transfers is not null));
+
+commit;
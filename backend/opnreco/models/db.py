@@ -4,8 +4,10 @@ from sqlalchemy import (
     Boolean,
     CheckConstraint,
     Column,
+    Computed,
     Date,
     DateTime,
+    FetchedValue,
     ForeignKey,
     ForeignKeyConstraint,
     Index,
@@ -19,7 +21,7 @@ from sqlalchemy import (
     func,
     or_,
 )
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import DATERANGE, JSONB
 from sqlalchemy.orm import declarative_base, deferred, relationship
 from sqlalchemy.schema import MetaData
 
@@ -214,6 +216,13 @@ class Period(Base):
 
     closed = Column(Boolean, nullable=False, default=False)
 
+    # date_range is the inclusive range from start_date to end_date.
+    # A null date leaves the range unbounded on that side.
+    date_range = Column(
+        DATERANGE,
+        Computed("daterange(start_date, end_date, '[]')", persisted=True),
+    )
+
     owner = relationship(Owner)
     file = relationship(File)
 
@@ -255,6 +264,21 @@ Index(
 )
 
 
+# Prevent overlapping periods in a file with an exclusion constraint.
+# file_id is compared as a single-value range so the constraint needs
+# only the built-in GiST range operator class, not btree_gist. (A file
+# belongs to one owner, so owner_id doesn't need to be compared.)
+period_date_range_ddl = DDL(
+    """
+alter table period add constraint ex_period_date_range
+    exclude using gist (
+        int8range(file_id, file_id, '[]') with &&,
+        date_range with &&);
+"""
+)
+event.listen(Period.__table__, "after_create", period_date_range_ddl)
+
+
 class TransferRecord(Base):
     """An owner's transfer record.
 
@@ -318,6 +342,103 @@ Index(
 )
 
 
+class BundleMember(Base):
+    """A transfer bundled by a bundle transfer, summed by issuer.
+
+    The rows mirror transfer_record.bundled_transfers so bundle
+    auto-reconciliation can join the members to the unreconciled
+    movements. The bundle_member trigger keeps them current.
+    """
+
+    __tablename__ = "bundle_member"
+    bundle_record_id = Column(
+        BigInteger,
+        ForeignKey("transfer_record.id", ondelete="CASCADE"),
+        nullable=False,
+        primary_key=True,
+    )
+    # transfer_id is the ID of the bundled transfer.
+    transfer_id = Column(String, nullable=False, primary_key=True)
+    issuer_id = Column(String, nullable=False, primary_key=True)
+    amount = Column(Numeric, nullable=False)
+
+
+Index(
+    "ix_bundle_member_transfer_id",
+    BundleMember.transfer_id,
+    BundleMember.issuer_id,
+)
+
+
+bundle_member_ddl = DDL(
+    """
+create or replace function bundle_member_refresh(record_ids bigint[])
+returns void
+as $body$
+begin
+    delete from bundle_member where bundle_record_id = any(record_ids);
+    -- A bundle with any element that lacks a transfer ID, an issuer ID,
+    -- or a decimal amount gets no members, so it never qualifies for
+    -- auto-reconciliation. (Skipping just the bad elements could let the
+    -- rest of the bundle qualify without them.)
+    insert into bundle_member (bundle_record_id, transfer_id, issuer_id, amount)
+    select
+        transfer_record.id,
+        t.value ->> 'transfer_id',
+        t.value ->> 'issuer_id',
+        sum((t.value ->> 'amount')::numeric)
+    from transfer_record
+    cross join jsonb_array_elements(transfer_record.bundled_transfers) t
+    where transfer_record.id = any(record_ids)
+        and transfer_record.bundled_transfers is not null
+        and not exists (
+            select 1
+            from jsonb_array_elements(transfer_record.bundled_transfers) e
+            where e.value ->> 'transfer_id' is null
+                or e.value ->> 'issuer_id' is null
+                or coalesce(e.value ->> 'amount', '')
+                    !~ '^[+-]?([0-9]+([.][0-9]*)?|[.][0-9]+)$')
+    group by transfer_record.id, 2, 3;
+end;
+$body$ language plpgsql;
+
+-- Refresh the bundles affected by a statement once per statement.
+-- Deleted transfer records cascade to bundle_member.
+create or replace function bundle_member_transfer_record_process()
+returns trigger
+as $triggerbody$
+begin
+    if TG_OP = 'INSERT' then
+        perform bundle_member_refresh(array(
+            select id from new_rows
+            where bundled_transfers is not null));
+    else
+        perform bundle_member_refresh(array(
+            select n.id
+            from old_rows o
+            join new_rows n using (id)
+            where o.bundled_transfers is distinct from n.bundled_transfers));
+    end if;
+    return null;
+end;
+$triggerbody$ language plpgsql;
+
+create trigger bundle_member_transfer_record_insert_trigger
+after insert on transfer_record
+    referencing new table as new_rows
+    for each statement
+    execute procedure bundle_member_transfer_record_process();
+
+create trigger bundle_member_transfer_record_update_trigger
+after update on transfer_record
+    referencing old table as old_rows new table as new_rows
+    for each statement
+    execute procedure bundle_member_transfer_record_process();
+"""
+)
+event.listen(BundleMember.__table__, "after_create", bundle_member_ddl)
+
+
 class OPNDownload(Base):
     """A record of OPN data downloaded for an owner.
 
@@ -331,6 +452,70 @@ class OPNDownload(Base):
     content = Column(JSONB, nullable=False)
 
 
+class SyncJob(Base):
+    """A request to download an owner's OPN transfer history in the background.
+
+    The sync worker (opnreco_sync_worker) runs each batch of a job in its own
+    transaction, resuming from Owner.last_sync_ts and
+    Owner.last_sync_transfer_id, so an interrupted job continues where it
+    stopped.
+    """
+
+    __tablename__ = "sync_job"
+    id = Column(BigInteger, nullable=False, primary_key=True)
+    owner_id = Column(String, ForeignKey("owner.id"), nullable=False, index=True)
+    created = Column(DateTime, nullable=False, server_default=now_func)
+    updated = Column(DateTime, nullable=False, server_default=now_func)
+    state = Column(
+        String,
+        CheckConstraint(
+            "state in ('queued', 'running', 'done', 'failed')", name="state"
+        ),
+        nullable=False,
+    )
+    # personal_id is the OPN personal profile ID of the person who
+    # requested the sync.
+    personal_id = Column(String, nullable=False)
+    # access_token is the token the worker uses to call OPN.
+    # It is cleared when the job finishes.
+    access_token = Column(String, nullable=True)
+    remote_addr = Column(String, nullable=True)
+    user_agent = Column(String, nullable=True)
+
+    progress_percent = Column(Integer, nullable=False, default=0)
+    change_count = Column(BigInteger, nullable=False, default=0)
+    download_count = Column(BigInteger, nullable=False, default=0)
+    first_sync_ts = Column(DateTime, nullable=True)
+    last_sync_ts = Column(DateTime, nullable=True)
+    # error_type is 'verification_failure' or 'error' when the job failed.
+    error_type = Column(String, nullable=True)
+    error_description = Column(Unicode, nullable=True)
+
+    __table_args__ = (
+        CheckConstraint(
+            # Don't keep the token after the job is done or failed.
+            or_(state.in_(["queued", "running"]), access_token == null),
+            name="finished_without_token",
+        ),
+        {},
+    )
+
+
+Index(
+    "ix_sync_job_single_active",
+    SyncJob.owner_id,
+    postgresql_where=SyncJob.state.in_(["queued", "running"]),
+    unique=True,
+)
+
+
+Index(
+    "ix_sync_job_active",
+    SyncJob.id,
+    postgresql_where=SyncJob.state.in_(["queued", "running"]),
+)
+
+
 class TransferDownloadRecord(Base):
     """A record of which download(s) provided TransferRecord data."""
 
@@ -461,6 +646,12 @@ class FileMovement(Base):
     transfer_record_id = Column(BigInteger, nullable=False)
     ts = Column(DateTime, nullable=False)
 
+    # local_date is the date of ts in the owner's time zone. The
+    # interpreter provides it; otherwise the file_movement_local_date
+    # trigger fills it in. update_local_dates() recomputes it when
+    # the owner's time zone changes.
+    local_date = Column(Date, nullable=False, server_default=FetchedValue())
+
     # peer_id is an OPN profile ID. It matches the from_id, to_id, or
     # issuer_id column, depending on the file-specific movement
     # interpretation.
@@ -478,6 +669,10 @@ class FileMovement(Base):
     wallet_delta = Column(Numeric, nullable=False)
     vault_delta = Column(Numeric, nullable=False)
 
+    # The absolute deltas let amount searches use an index range scan.
+    abs_wallet_delta = Column(Numeric, Computed("abs(wallet_delta)", persisted=True))
+    abs_vault_delta = Column(Numeric, Computed("abs(vault_delta)", persisted=True))
+
     ################
     # Mutable fields
     ################
@@ -547,6 +742,68 @@ class FileMovement(Base):
     )
 
 
+# Partial index of the unreconciled movements, which are a small
+# fraction of the movements once a file is mostly reconciled. The
+# included columns let period total queries use index-only scans.
+# Queries by file join the open periods and use this index too.
+Index(
+    "ix_file_movement_unreco_period",
+    FileMovement.period_id,
+    postgresql_where=(FileMovement.reco_id == null),
+    postgresql_include=["owner_id", "wallet_delta", "vault_delta", "surplus_delta"],
+)
+
+
+# Index for matching movements by date in the owner's time zone.
+Index(
+    "ix_file_movement_local_date",
+    FileMovement.owner_id,
+    FileMovement.file_id,
+    FileMovement.local_date,
+)
+
+
+file_movement_local_date_ddl = DDL(
+    """
+create or replace function file_movement_local_date_process() returns trigger
+as $triggerbody$
+begin
+    select date(timezone(
+        coalesce(nullif(owner.tzname, ''), 'America/New_York'),
+        timezone('UTC', new.ts)))
+    into new.local_date
+    from owner
+    where owner.id = new.owner_id;
+    return new;
+end;
+$triggerbody$ language plpgsql;
+
+create trigger file_movement_local_date_trigger
+before insert on file_movement
+    for each row when (new.local_date is null)
+    execute procedure file_movement_local_date_process();
+"""
+)
+event.listen(FileMovement.__table__, "after_create", file_movement_local_date_ddl)
+
+
+# Indexes for the amount searches of the reco dialog.
+Index(
+    "ix_file_movement_abs_wallet_delta",
+    FileMovement.owner_id,
+    FileMovement.file_id,
+    FileMovement.abs_wallet_delta,
+)
+
+
+Index(
+    "ix_file_movement_abs_vault_delta",
+    FileMovement.owner_id,
+    FileMovement.file_id,
+    FileMovement.abs_vault_delta,
+)
+
+
 class FileMovementLog(Base):
     """Log of changes to a file movement.
 
@@ -678,6 +935,9 @@ class AccountEntry(Base):
     # increase and decrease have well-understood meanings.
     delta = Column(Numeric, nullable=False)
 
+    # abs_delta lets amount searches use an index range scan.
+    abs_delta = Column(Numeric, Computed("abs(delta)", persisted=True))
+
     # description contains descriptive info provided by the bank.
     description = Column(Unicode, nullable=False)
 
@@ -703,6 +963,49 @@ class AccountEntry(Base):
     )
 
 
+# Partial index of the unreconciled account entries.
+Index(
+    "ix_account_entry_unreco_period",
+    AccountEntry.period_id,
+    postgresql_where=(AccountEntry.reco_id == null),
+    postgresql_include=["owner_id", "delta"],
+)
+
+
+# Index for the amount searches of the reco dialog.
+Index(
+    "ix_account_entry_abs_delta",
+    AccountEntry.owner_id,
+    AccountEntry.file_id,
+    AccountEntry.abs_delta,
+)
+
+
+# Index the substring searches of the reco dialog with trigrams when the
+# pg_trgm extension is available. See opnreco/textsearch.py.
+text_search_ddl = DDL(
+    """
+do $body$
+begin
+    begin
+        create extension if not exists pg_trgm;
+    exception when others then
+        raise notice 'pg_trgm is not available: %%', sqlerrm;
+    end;
+
+    if exists (select 1 from pg_extension where extname = 'pg_trgm') then
+        create index ix_transfer_record_transfer_id_trgm on transfer_record
+            using gin (transfer_id gin_trgm_ops);
+        create index ix_account_entry_description_trgm on account_entry
+            using gin (description gin_trgm_ops);
+    end if;
+end;
+$body$;
+"""
+)
+event.listen(Base.metadata, "after_create", text_search_ddl)
+
+
 class AccountEntryLog(Base):
     """Log of changes to an account entry.
 
@@ -795,8 +1098,47 @@ end;
 $triggerbody$ language plpgsql;
 
 create trigger account_entry_log_trigger
-after insert or update or delete on account_entry
+after update or delete on account_entry
     for each row execute procedure account_entry_log_process();
+
+-- Log inserts with one statement per insert statement, so bulk inserts
+-- (such as statement uploads) don't run a log insert for each row.
+create or replace function account_entry_log_insert_process() returns trigger
+as $triggerbody$
+begin
+    insert into account_entry_log (
+        account_entry_id,
+        personal_id,
+        event_type,
+        statement_id,
+        sheet,
+        row,
+        entry_date,
+        delta,
+        description,
+        reco_id
+    )
+    select
+        new_rows.id,
+        current_setting('opnreco.personal_id'),
+        current_setting('opnreco.account_entry.event_type'),
+        new_rows.statement_id,
+        new_rows.sheet,
+        new_rows.row,
+        new_rows.entry_date,
+        new_rows.delta,
+        new_rows.description,
+        new_rows.reco_id
+    from new_rows
+    order by new_rows.id;
+    return null;
+end;
+$triggerbody$ language plpgsql;
+
+create trigger account_entry_log_insert_trigger
+after insert on account_entry
+    referencing new table as new_rows
+    for each statement execute procedure account_entry_log_insert_process();
 """
 )
 event.listen(AccountEntry.__table__, "after_create", account_entry_log_ddl)
@@ -849,6 +1191,435 @@ Index(
 )
 
 
+class PeriodSum(Base):
+    """Running sums of the movements and account entries in a period.
+
+    The rows are maintained by triggers on file_movement, account_entry,
+    and reco, so compute_period_totals() can read the totals of a period
+    without aggregating all of its movements and account entries.
+    The circ sums are the negated vault deltas of the file movements.
+    """
+
+    __tablename__ = "period_sum"
+    period_id = Column(
+        BigInteger,
+        ForeignKey("period.id", ondelete="CASCADE"),
+        nullable=False,
+        primary_key=True,
+    )
+    owner_id = Column(String, ForeignKey("owner.id"), nullable=False, index=True)
+
+    # Movements in internal recos.
+    internal_reco_circ = Column(Numeric, nullable=False)
+    internal_reco_surplus = Column(Numeric, nullable=False)
+    # Movements in external (not internal) recos.
+    external_reco_circ = Column(Numeric, nullable=False)
+    # Account entries in recos.
+    reco_entries_delta = Column(Numeric, nullable=False)
+    # Unreconciled movements.
+    unreco_movements_circ = Column(Numeric, nullable=False)
+    unreco_movements_surplus = Column(Numeric, nullable=False)
+    # Unreconciled account entries.
+    unreco_entries_delta = Column(Numeric, nullable=False)
+
+
+# The period_sum triggers span several tables, so create them once all the
+# tables exist.
+period_sum_ddl = DDL(
+    """
+create or replace function period_sum_add(
+    owner_id_input varchar,
+    period_id_input bigint,
+    internal_reco_circ_input numeric,
+    internal_reco_surplus_input numeric,
+    external_reco_circ_input numeric,
+    reco_entries_delta_input numeric,
+    unreco_movements_circ_input numeric,
+    unreco_movements_surplus_input numeric,
+    unreco_entries_delta_input numeric
+) returns void
+as $body$
+begin
+    insert into period_sum as ps (
+        period_id,
+        owner_id,
+        internal_reco_circ,
+        internal_reco_surplus,
+        external_reco_circ,
+        reco_entries_delta,
+        unreco_movements_circ,
+        unreco_movements_surplus,
+        unreco_entries_delta)
+    values (
+        period_id_input,
+        owner_id_input,
+        internal_reco_circ_input,
+        internal_reco_surplus_input,
+        external_reco_circ_input,
+        reco_entries_delta_input,
+        unreco_movements_circ_input,
+        unreco_movements_surplus_input,
+        unreco_entries_delta_input)
+    on conflict (period_id) do update set
+        internal_reco_circ =
+            ps.internal_reco_circ + excluded.internal_reco_circ,
+        internal_reco_surplus =
+            ps.internal_reco_surplus + excluded.internal_reco_surplus,
+        external_reco_circ =
+            ps.external_reco_circ + excluded.external_reco_circ,
+        reco_entries_delta =
+            ps.reco_entries_delta + excluded.reco_entries_delta,
+        unreco_movements_circ =
+            ps.unreco_movements_circ + excluded.unreco_movements_circ,
+        unreco_movements_surplus =
+            ps.unreco_movements_surplus + excluded.unreco_movements_surplus,
+        unreco_entries_delta =
+            ps.unreco_entries_delta + excluded.unreco_entries_delta;
+end;
+$body$ language plpgsql;
+
+create or replace function period_sum_add_file_movement(
+    fm file_movement, sign numeric
+) returns void
+as $body$
+declare
+    circ numeric := -sign * fm.vault_delta;
+    surplus numeric := sign * fm.surplus_delta;
+begin
+    if fm.reco_id is null then
+        perform period_sum_add(
+            fm.owner_id, fm.period_id, 0, 0, 0, 0, circ, surplus, 0);
+    elsif (select internal from reco where id = fm.reco_id) then
+        perform period_sum_add(
+            fm.owner_id, fm.period_id, circ, surplus, 0, 0, 0, 0, 0);
+    else
+        perform period_sum_add(
+            fm.owner_id, fm.period_id, 0, 0, circ, 0, 0, 0, 0);
+    end if;
+end;
+$body$ language plpgsql;
+
+create or replace function period_sum_file_movement_process() returns trigger
+as $triggerbody$
+begin
+    if (TG_OP = 'UPDATE'
+            and old.period_id = new.period_id
+            and old.reco_id is not distinct from new.reco_id
+            and old.vault_delta = new.vault_delta
+            and old.surplus_delta = new.surplus_delta) then
+        return null;
+    end if;
+    if (TG_OP = 'UPDATE' or TG_OP = 'DELETE') then
+        perform period_sum_add_file_movement(old, -1);
+    end if;
+    if (TG_OP = 'UPDATE' or TG_OP = 'INSERT') then
+        perform period_sum_add_file_movement(new, 1);
+    end if;
+    return null;
+end;
+$triggerbody$ language plpgsql;
+
+create trigger period_sum_file_movement_trigger
+after insert or update or delete on file_movement
+    for each row execute procedure period_sum_file_movement_process();
+
+create or replace function period_sum_add_account_entry(
+    e account_entry, sign numeric
+) returns void
+as $body$
+begin
+    if e.reco_id is null then
+        perform period_sum_add(
+            e.owner_id, e.period_id, 0, 0, 0, 0, 0, 0, sign * e.delta);
+    else
+        perform period_sum_add(
+            e.owner_id, e.period_id, 0, 0, 0, sign * e.delta, 0, 0, 0);
+    end if;
+end;
+$body$ language plpgsql;
+
+create or replace function period_sum_account_entry_process() returns trigger
+as $triggerbody$
+begin
+    if (TG_OP = 'UPDATE'
+            and old.period_id = new.period_id
+            and old.reco_id is not distinct from new.reco_id
+            and old.delta = new.delta) then
+        return null;
+    end if;
+    if (TG_OP = 'UPDATE' or TG_OP = 'DELETE') then
+        perform period_sum_add_account_entry(old, -1);
+    end if;
+    if (TG_OP = 'UPDATE' or TG_OP = 'INSERT') then
+        perform period_sum_add_account_entry(new, 1);
+    end if;
+    return null;
+end;
+$triggerbody$ language plpgsql;
+
+create trigger period_sum_account_entry_trigger
+after update or delete on account_entry
+    for each row execute procedure period_sum_account_entry_process();
+
+-- Add inserted account entries to the sums once per period rather than
+-- once per row.
+create or replace function period_sum_account_entry_insert_process()
+returns trigger
+as $triggerbody$
+begin
+    perform period_sum_add(
+        s.owner_id, s.period_id, 0, 0, 0, s.reco_delta, 0, 0, s.unreco_delta)
+    from (
+        select
+            owner_id,
+            period_id,
+            coalesce(sum(delta) filter (where reco_id is not null), 0)
+                as reco_delta,
+            coalesce(sum(delta) filter (where reco_id is null), 0)
+                as unreco_delta
+        from new_rows
+        group by owner_id, period_id
+    ) s;
+    return null;
+end;
+$triggerbody$ language plpgsql;
+
+create trigger period_sum_account_entry_insert_trigger
+after insert on account_entry
+    referencing new table as new_rows
+    for each statement
+    execute procedure period_sum_account_entry_insert_process();
+
+create or replace function period_sum_reco_process() returns trigger
+as $triggerbody$
+declare
+    sign numeric := case when new.internal then 1 else -1 end;
+    row record;
+begin
+    -- Move the sums of the reco's movements between the internal
+    -- and external columns.
+    for row in
+        select owner_id, period_id,
+            sum(-vault_delta) as circ, sum(surplus_delta) as surplus
+        from file_movement
+        where reco_id = new.id
+        group by owner_id, period_id
+    loop
+        perform period_sum_add(
+            row.owner_id,
+            row.period_id,
+            sign * row.circ,
+            sign * row.surplus,
+            -sign * row.circ,
+            0, 0, 0, 0);
+    end loop;
+    return null;
+end;
+$triggerbody$ language plpgsql;
+
+create trigger period_sum_reco_trigger
+after update of internal on reco
+    for each row when (old.internal is distinct from new.internal)
+    execute procedure period_sum_reco_process();
+"""
+)
+event.listen(Base.metadata, "after_create", period_sum_ddl)
+
+
+class RecoSummary(Base):
+    """Aggregates of the movements and account entries in a reco.
+
+    The rows are maintained by triggers on file_movement and account_entry,
+    so reports can look up the dates and deltas of each reco rather than
+    aggregating its movements and account entries. Like sum() and min(),
+    the delta and date columns are null when the reco has no movements
+    (or no account entries). Recos that have never had a movement or
+    account entry may have no reco_summary row.
+    """
+
+    __tablename__ = "reco_summary"
+    reco_id = Column(
+        BigInteger,
+        ForeignKey("reco.id", ondelete="CASCADE"),
+        nullable=False,
+        primary_key=True,
+    )
+
+    movement_count = Column(Integer, nullable=False)
+    wallet_delta = Column(Numeric, nullable=True)
+    vault_delta = Column(Numeric, nullable=True)
+    surplus_delta = Column(Numeric, nullable=True)
+    min_ts = Column(DateTime, nullable=True)
+    min_local_date = Column(Date, nullable=True)
+
+    entry_count = Column(Integer, nullable=False)
+    account_delta = Column(Numeric, nullable=True)
+    min_entry_date = Column(Date, nullable=True)
+
+
+reco_summary_ddl = DDL(
+    """
+create or replace function reco_summary_refresh(reco_ids bigint[])
+returns void
+as $body$
+begin
+    insert into reco_summary as rs (
+        reco_id,
+        movement_count,
+        wallet_delta,
+        vault_delta,
+        surplus_delta,
+        min_ts,
+        min_local_date,
+        entry_count,
+        account_delta,
+        min_entry_date)
+    select
+        reco.id,
+        coalesce(m.movement_count, 0),
+        m.wallet_delta,
+        m.vault_delta,
+        m.surplus_delta,
+        m.min_ts,
+        m.min_local_date,
+        coalesce(e.entry_count, 0),
+        e.account_delta,
+        e.min_entry_date
+    from reco
+    left join (
+        select
+            reco_id,
+            count(1) as movement_count,
+            sum(wallet_delta) as wallet_delta,
+            sum(vault_delta) as vault_delta,
+            sum(surplus_delta) as surplus_delta,
+            min(ts) as min_ts,
+            min(local_date) as min_local_date
+        from file_movement
+        where reco_id = any(reco_ids)
+        group by reco_id
+    ) m on (m.reco_id = reco.id)
+    left join (
+        select
+            reco_id,
+            count(1) as entry_count,
+            sum(delta) as account_delta,
+            min(entry_date) as min_entry_date
+        from account_entry
+        where reco_id = any(reco_ids)
+        group by reco_id
+    ) e on (e.reco_id = reco.id)
+    where reco.id = any(reco_ids)
+    on conflict (reco_id) do update set
+        movement_count = excluded.movement_count,
+        wallet_delta = excluded.wallet_delta,
+        vault_delta = excluded.vault_delta,
+        surplus_delta = excluded.surplus_delta,
+        min_ts = excluded.min_ts,
+        min_local_date = excluded.min_local_date,
+        entry_count = excluded.entry_count,
+        account_delta = excluded.account_delta,
+        min_entry_date = excluded.min_entry_date;
+end;
+$body$ language plpgsql;
+
+-- Refresh the recos affected by a statement once per statement.
+create or replace function reco_summary_file_movement_process()
+returns trigger
+as $triggerbody$
+begin
+    if TG_OP = 'INSERT' then
+        perform reco_summary_refresh(array(
+            select distinct reco_id from new_rows
+            where reco_id is not null));
+    elsif TG_OP = 'DELETE' then
+        perform reco_summary_refresh(array(
+            select distinct reco_id from old_rows
+            where reco_id is not null));
+    else
+        perform reco_summary_refresh(array(
+            select distinct changed.reco_id
+            from old_rows o
+            join new_rows n using (file_id, movement_id)
+            cross join lateral (values (o.reco_id), (n.reco_id))
+                as changed (reco_id)
+            where changed.reco_id is not null
+                and (o.reco_id, o.wallet_delta, o.vault_delta,
+                    o.surplus_delta, o.ts, o.local_date)
+                is distinct from (n.reco_id, n.wallet_delta, n.vault_delta,
+                    n.surplus_delta, n.ts, n.local_date)));
+    end if;
+    return null;
+end;
+$triggerbody$ language plpgsql;
+
+create trigger reco_summary_file_movement_insert_trigger
+after insert on file_movement
+    referencing new table as new_rows
+    for each statement
+    execute procedure reco_summary_file_movement_process();
+
+create trigger reco_summary_file_movement_update_trigger
+after update on file_movement
+    referencing old table as old_rows new table as new_rows
+    for each statement
+    execute procedure reco_summary_file_movement_process();
+
+create trigger reco_summary_file_movement_delete_trigger
+after delete on file_movement
+    referencing old table as old_rows
+    for each statement
+    execute procedure reco_summary_file_movement_process();
+
+create or replace function reco_summary_account_entry_process()
+returns trigger
+as $triggerbody$
+begin
+    if TG_OP = 'INSERT' then
+        perform reco_summary_refresh(array(
+            select distinct reco_id from new_rows
+            where reco_id is not null));
+    elsif TG_OP = 'DELETE' then
+        perform reco_summary_refresh(array(
+            select distinct reco_id from old_rows
+            where reco_id is not null));
+    else
+        perform reco_summary_refresh(array(
+            select distinct changed.reco_id
+            from old_rows o
+            join new_rows n using (id)
+            cross join lateral (values (o.reco_id), (n.reco_id))
+                as changed (reco_id)
+            where changed.reco_id is not null
+                and (o.reco_id, o.delta, o.entry_date)
+                is distinct from (n.reco_id, n.delta, n.entry_date)));
+    end if;
+    return null;
+end;
+$triggerbody$ language plpgsql;
+
+create trigger reco_summary_account_entry_insert_trigger
+after insert on account_entry
+    referencing new table as new_rows
+    for each statement
+    execute procedure reco_summary_account_entry_process();
+
+create trigger reco_summary_account_entry_update_trigger
+after update on account_entry
+    referencing old table as old_rows new table as new_rows
+    for each statement
+    execute procedure reco_summary_account_entry_process();
+
+create trigger reco_summary_account_entry_delete_trigger
+after delete on account_entry
+    referencing old table as old_rows
+    for each statement
+    execute procedure reco_summary_account_entry_process();
+"""
+)
+event.listen(Base.metadata, "after_create", reco_summary_ddl)
+
+
 class VerificationResult(Base):
     """A short lived record of a transfer integrity verification operation.
 
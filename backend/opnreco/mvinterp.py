@@ -18,7 +18,7 @@ from opnreco.models.db import (
     TransferRecord,
 )
 from opnreco.reify import reify
-from opnreco.viewcommon import add_open_period, configure_dblog, get_period_for_day
+from opnreco.viewcommon import PeriodIndex, add_open_period, configure_dblog
 from sqlalchemy import and_
 
 log = logging.getLogger(__name__)
@@ -83,6 +83,11 @@ class MovementInterpreter:
             .all()
         )
 
+    @reify
+    def open_period_index(self) -> PeriodIndex:
+        """Get a PeriodIndex of the open Periods for the File."""
+        return PeriodIndex(self.open_period_list)
+
     @reify
     def open_period_ids(self) -> set[int]:
         """Get the set of open Period IDs for the File."""
@@ -139,10 +144,13 @@ class MovementInterpreter:
         return enabled
 
     def get_file_movements(
-        self, movements: Sequence[Movement], is_new_record: bool
+        self, movements: Sequence[Movement]
     ) -> dict[int, FileMovement]:
-        if is_new_record:
-            # There should be no existing FileMovements for this record.
+        """Load the existing FileMovements for a list of Movements.
+
+        Return {movement_id: FileMovement}.
+        """
+        if not movements:
             return {}
 
         # Fill file_movements with the existing FileMovements.
@@ -162,6 +170,23 @@ class MovementInterpreter:
             file_movements[file_movement.movement_id] = file_movement
         return file_movements
 
+    def get_synced_record_ids(self, records: Sequence[TransferRecord]) -> set[int]:
+        """List which of the given TransferRecords have a FileSync row."""
+        if not records:
+            return set()
+
+        dbsession = self.request.dbsession
+        record_ids = [record.id for record in records]
+        rows: Sequence[tuple[int]] = (
+            dbsession.query(FileSync.transfer_record_id)
+            .filter(
+                FileSync.file_id == self.file.id,
+                FileSync.transfer_record_id.in_(record_ids),
+            )
+            .all()
+        )
+        return set(row[0] for row in rows)
+
     def sync_file_movements(
         self, record: TransferRecord, movements: Sequence[Movement], is_new_record: bool
     ):
@@ -169,14 +194,41 @@ class MovementInterpreter:
 
         Also auto-reconcile if at least 2 movements fit the File.
         """
+        [entries] = self.sync_file_movement_batch([(record, movements, is_new_record)])
+        self.change_log.extend(entries)
+
+    def sync_file_movement_batch(
+        self, batch: Sequence[tuple[TransferRecord, Sequence[Movement], bool]]
+    ) -> list[list[dict]]:
+        """Add the FileMovements for a batch of TransferRecords.
+
+        The batch is a list of (record, movements, is_new_record). The
+        existing FileMovement and FileSync rows for the batch are loaded
+        with one query each and the new rows are written in a single flush.
+        Then auto-reconcile each record where at least 2 movements
+        fit the File.
+
+        Return the change_log entries for each item in the batch. The caller
+        adds them to the change_log, so each record's entries can stay
+        next to the record's other entries.
+        """
         dbsession = self.request.dbsession
 
-        file_movements = self.get_file_movements(
-            movements=movements,
-            is_new_record=is_new_record,
-        )
+        # record_logs: [[change_log entry] for each item in the batch]
+        record_logs: list[list[dict]] = [[] for _ in batch]
 
-        to_reconcile: list[tuple[FileMovement, Movement]] = []
+        # New records have no FileMovements or FileSync rows yet.
+        old_records: list[TransferRecord] = []
+        old_movements: list[Movement] = []
+        for record, movements, is_new_record in batch:
+            if not is_new_record:
+                old_records.append(record)
+                old_movements.extend(movements)
+        file_movements = self.get_file_movements(movements=old_movements)
+        synced_record_ids = self.get_synced_record_ids(records=old_records)
+
+        # to_autoreco: [(index, record, [(FileMovement, Movement)], is_new_record)]
+        to_autoreco: list[tuple[int, TransferRecord, list[MovementTuple], bool]] = []
 
         configured_logging = []
 
@@ -187,91 +239,94 @@ class MovementInterpreter:
                 )
                 configured_logging.append(True)
 
-        for movement in movements:
-            movement_id: int = movement.id  # type: ignore
-            file_movement = file_movements.get(movement_id)
-            kw = self.interpret(movement)
-            if kw and file_movement is None:
-                # Add a file movement.
-                configure_logging()
-
-                day = (
-                    movement.ts.replace(tzinfo=pytz.utc)
-                    .astimezone(self.timezone)
-                    .date()
-                )
-                period = self.get_open_period(day=day)
-
-                file_movement = FileMovement(
-                    owner_id=self.owner_id,
-                    movement_id=movement.id,
-                    file_id=self.file.id,
-                    period_id=period.id,
-                    **kw
-                )
-                dbsession.add(file_movement)
-
-            elif (
-                not kw
-                and file_movement is not None
-                and file_movement.reco_id is None
-                and file_movement.period_id in self.open_period_ids
-            ):
-                # This movement no longer applies to the file
-                # and the file movement is safe to delete, so delete it.
-                configure_logging()
-                dbsession.delete(file_movement)
-                file_movement = None
-
-            elif (
-                kw
-                and file_movement is not None
-                and file_movement.reco_id is None
-                and file_movement.period_id in self.open_period_ids
-            ):
-                # Update the file movement if needed.
-                if file_movement.peer_id != kw["peer_id"]:
-                    configure_logging()
-                    file_movement.peer_id = kw["peer_id"]
-                if file_movement.wallet_delta != kw["wallet_delta"]:
-                    configure_logging()
-                    file_movement.wallet_delta = kw["wallet_delta"]
-                    file_movement.surplus_delta = kw["surplus_delta"]
-                if file_movement.vault_delta != kw["vault_delta"]:
-                    configure_logging()
-                    file_movement.vault_delta = kw["vault_delta"]
+        for index, (record, movements, is_new_record) in enumerate(batch):
+            to_reconcile: list[MovementTuple] = []
 
-            if file_movement is not None:
-                to_reconcile.append((file_movement, movement))
+            for movement in movements:
+                movement_id: int = movement.id  # type: ignore
+                file_movement = file_movements.get(movement_id)
+                kw = self.interpret(movement)
+                if kw and file_movement is None:
+                    # Add a file movement.
+                    configure_logging()
 
-        # The TransferRecord is now reflected in this File.
-        # Is there a FileSync record yet?
-        if is_new_record:
-            # It's safe to assume there isn't a FileSync record yet.
-            add_sync_record = True
-        else:
-            row = (
-                dbsession.query(FileSync.transfer_record_id)
-                .filter(
-                    FileSync.file_id == self.file.id,
-                    FileSync.transfer_record_id == record.id,
+                    day = (
+                        movement.ts.replace(tzinfo=pytz.utc)
+                        .astimezone(self.timezone)
+                        .date()
+                    )
+                    period = self.get_open_period(
+                        day=day, change_log=record_logs[index]
+                    )
+
+                    file_movement = FileMovement(
+                        owner_id=self.owner_id,
+                        movement_id=movement.id,
+                        file_id=self.file.id,
+                        period_id=period.id,
+                        local_date=day,
+                        **kw
+                    )
+                    dbsession.add(file_movement)
+
+                elif (
+                    not kw
+                    and file_movement is not None
+                    and file_movement.reco_id is None
+                    and file_movement.period_id in self.open_period_ids
+                ):
+                    # This movement no longer applies to the file
+                    # and the file movement is safe to delete, so delete it.
+                    configure_logging()
+                    dbsession.delete(file_movement)
+                    file_movement = None
+
+                elif (
+                    kw
+                    and file_movement is not None
+                    and file_movement.reco_id is None
+                    and file_movement.period_id in self.open_period_ids
+                ):
+                    # Update the file movement if needed.
+                    if file_movement.peer_id != kw["peer_id"]:
+                        configure_logging()
+                        file_movement.peer_id = kw["peer_id"]
+                    if file_movement.wallet_delta != kw["wallet_delta"]:
+                        configure_logging()
+                        file_movement.wallet_delta = kw["wallet_delta"]
+                        file_movement.surplus_delta = kw["surplus_delta"]
+                    if file_movement.vault_delta != kw["vault_delta"]:
+                        configure_logging()
+                        file_movement.vault_delta = kw["vault_delta"]
+
+                if file_movement is not None:
+                    to_reconcile.append((file_movement, movement))
+
+            # The TransferRecord is now reflected in this File.
+            # Add the FileSync record if there isn't one yet.
+            if is_new_record or record.id not in synced_record_ids:
+                dbsession.add(
+                    FileSync(file_id=self.file.id, transfer_record_id=record.id)
                 )
-                .first()
-            )
-            add_sync_record = row is None
 
-        if add_sync_record:
-            # Add the FileSync record.
-            dbsession.add(FileSync(file_id=self.file.id, transfer_record_id=record.id))
+            if len(to_reconcile) >= 1:
+                to_autoreco.append((index, record, to_reconcile, is_new_record))
+
+        # Write the FileMovement and FileSync changes for the whole batch.
+        dbsession.flush()
 
-        if len(to_reconcile) >= 1:
-            # Auto-reconciliation within the transfer might be possible.
+        if to_autoreco:
+            # Auto-reconciliation within the transfers might be possible.
             configure_dblog(request=self.request, movement_event_type="autoreco")
-            self.autoreco(
-                record=record,
-                movement_rows=to_reconcile,
-                is_new_record=is_new_record,
-            )
+            for index, record, to_reconcile, is_new_record in to_autoreco:
+                self.autoreco(
+                    record=record,
+                    movement_rows=to_reconcile,
+                    is_new_record=is_new_record,
+                    change_log=record_logs[index],
+                )
+
+        return record_logs
 
     def sync_missing(self):
         """Fill in any missing TransferRecord interpretations for this File."""
@@ -325,12 +380,18 @@ class MovementInterpreter:
             )
             existing_record_ids = {row[0] for row in file_movement_batch}
 
-            for record in record_batch:
-                self.sync_file_movements(
-                    record=record,
-                    movements=movement_dict.get(record.id, ()),
-                    is_new_record=(record.id not in existing_record_ids),
-                )
+            record_logs = self.sync_file_movement_batch(
+                [
+                    (
+                        record,
+                        movement_dict.get(record.id, ()),
+                        record.id not in existing_record_ids,
+                    )
+                    for record in record_batch
+                ]
+            )
+            for entries in record_logs:
+                self.change_log.extend(entries)
 
     def interpret(self, movement):
         """Compute the FileMovement attrs for a Movement in this File.
@@ -441,16 +502,14 @@ class MovementInterpreter:
             "surplus_delta": -wallet_delta,
         }
 
-    def get_open_period(self, day: datetime.date):
+    def get_open_period(self, day: datetime.date, change_log: list[dict]):
         """Get an open Period for a movement_date."""
         period = self.open_periods.get(day)
         if period is not None:
             return period
 
-        open_period_list = self.open_period_list
-
         # See if any of the existing periods match.
-        period = get_period_for_day(open_period_list, day)
+        period = self.open_period_index.get(day)
         if period is not None:
             # Found a matching open period.
             self.open_periods[day] = period
@@ -465,10 +524,11 @@ class MovementInterpreter:
         )
 
         self.open_period_list.append(period)
+        self.open_period_index = PeriodIndex(self.open_period_list)
         self.open_periods[day] = period
         period_id: int = period.id  # type: ignore
         self.open_period_ids.add(period_id)
-        self.change_log.append(
+        change_log.append(
             {
                 "event_type": "add_period",
                 "period_id": period.id,
@@ -496,6 +556,7 @@ class MovementInterpreter:
         record: TransferRecord,
         movement_rows: Sequence[MovementTuple],
         is_new_record: bool,
+        change_log: list[dict],
     ):
         """Auto-reconcile some of the movements in a File + TransferRecord."""
         dbsession = self.request.dbsession
@@ -558,7 +619,7 @@ class MovementInterpreter:
                 file_movement.period_id = reco.period_id
 
         if added_reco_ids:
-            self.change_log.append(
+            change_log.append(
                 {
                     "event_type": "reco_add",
                     "reco_ids": added_reco_ids,
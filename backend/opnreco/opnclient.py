@@ -0,0 +1,175 @@
+import logging
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+log = logging.getLogger(__name__)
+
+
+class EndpointStats:
+    """Latency counters for one OPN endpoint."""
+
+    def __init__(self):
+        self.count = 0
+        self.error_count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def add(self, seconds: float, error: bool):
+        self.count += 1
+        if error:
+            self.error_count += 1
+        self.total_seconds += seconds
+        if seconds > self.max_seconds:
+            self.max_seconds = seconds
+
+    def as_json(self) -> dict:
+        return {
+            "count": self.count,
+            "error_count": self.error_count,
+            "total_seconds": self.total_seconds,
+            "max_seconds": self.max_seconds,
+            "mean_seconds": self.total_seconds / self.count if self.count else 0.0,
+        }
+
+
+class OPNClient:
+    """HTTP client for the OPN API with pooled keep-alive connections.
+
+    One instance is shared by the process (see get_opn_client()) so
+    calls reuse TCP/TLS connections. GET requests, which are idempotent,
+    are retried with exponential backoff on connection errors and
+    502/503/504 responses. POST requests are never retried.
+
+    The defaults can be changed with these environment variables:
+
+    - opn_pool_size: connections kept open per host (default 10)
+    - opn_connect_timeout: seconds to wait for a connection (default 5)
+    - opn_read_timeout: seconds to wait for a response (default 60)
+    - opn_get_retries: retries for a failed GET (default 2)
+    - opn_retry_backoff: backoff factor between retries (default 0.2)
+    """
+
+    def __init__(
+        self,
+        pool_size: int | None = None,
+        connect_timeout: float | None = None,
+        read_timeout: float | None = None,
+        get_retries: int | None = None,
+        retry_backoff: float | None = None,
+    ):
+        environ = os.environ
+        if pool_size is None:
+            pool_size = int(environ.get("opn_pool_size", "10"))
+        if connect_timeout is None:
+            connect_timeout = float(environ.get("opn_connect_timeout", "5"))
+        if read_timeout is None:
+            read_timeout = float(environ.get("opn_read_timeout", "60"))
+        if get_retries is None:
+            get_retries = int(environ.get("opn_get_retries", "2"))
+        if retry_backoff is None:
+            retry_backoff = float(environ.get("opn_retry_backoff", "0.2"))
+
+        self.timeout = (connect_timeout, read_timeout)
+
+        retry = Retry(
+            total=get_retries,
+            backoff_factor=retry_backoff,
+            allowed_methods=frozenset(["GET"]),
+            status_forcelist=(502, 503, 504),
+            # Return the last response so check_requests_response()
+            # can report the error.
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        self.session = session
+
+        self._stats: dict[str, EndpointStats] = {}
+        self._stats_lock = threading.Lock()
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        access_token: str | None,
+        endpoint: str,
+        **kw,
+    ) -> requests.Response:
+        """Send a request to OPN and record its latency.
+
+        endpoint names the API endpoint (without IDs) in the latency
+        counters, such as "/wallet/info" or "/p/{id}".
+        """
+        headers = kw.pop("headers", None) or {}
+        if access_token:
+            headers["Authorization"] = "Bearer %s" % access_token
+        kw.setdefault("timeout", self.timeout)
+
+        start = time.monotonic()
+        error = True
+        try:
+            r = self.session.request(method, url, headers=headers, **kw)
+            error = r.status_code >= 400
+            return r
+        finally:
+            elapsed = time.monotonic() - start
+            with self._stats_lock:
+                stats = self._stats.get(endpoint)
+                if stats is None:
+                    stats = self._stats[endpoint] = EndpointStats()
+                stats.add(elapsed, error)
+
+    def get(self, url, access_token, endpoint, **kw) -> requests.Response:
+        return self.request("GET", url, access_token, endpoint, **kw)
+
+    def post(self, url, access_token, endpoint, **kw) -> requests.Response:
+        return self.request("POST", url, access_token, endpoint, **kw)
+
+    def get_stats(self) -> dict[str, dict]:
+        """Get a snapshot of the latency counters by endpoint."""
+        with self._stats_lock:
+            return {
+                endpoint: stats.as_json() for endpoint, stats in self._stats.items()
+            }
+
+    def close(self):
+        self.session.close()
+
+
+_client: OPNClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_opn_client() -> OPNClient:
+    """Get the process-wide OPNClient, creating it if necessary."""
+    global _client
+    client = _client
+    if client is None:
+        with _client_lock:
+            client = _client
+            if client is None:
+                client = _client = OPNClient()
+    return client
+
+
+def reset_opn_client():
+    """Close and discard the process-wide OPNClient.
+
+    The next call to get_opn_client() creates a new client that reads
+    the environment again.
+    """
+    global _client
+    with _client_lock:
+        client = _client
+        _client = None
+    if client is not None:
+        client.close()
@@ -6,13 +6,21 @@ from pyramid.httpexceptions import HTTPBadRequest
 null = None
 
 
-def get_offset_limit(params):
+def get_offset_limit(params, max_limit=None):
     """Get the offset and limit from request params."""
     offset_str = params.get("offset", "")
     if not re.match(r"^[0-9]{1,20}$", offset_str):
         raise HTTPBadRequest(json_body={"error": "offset_required"})
     offset = max(int(offset_str), 0)
+    return offset, get_limit(params, max_limit=max_limit)
 
+
+def get_limit(params, max_limit=None):
+    """Get the limit from request params.
+
+    Return None for no limit ("all"). If max_limit is given, reject
+    "all" and any limit greater than max_limit.
+    """
     limit_str = params.get("limit", "")
     if limit_str == "all":
         limit = None
@@ -21,7 +29,17 @@ def get_offset_limit(params):
             raise HTTPBadRequest(json_body={"error": "limit_required"})
         limit = max(int(limit_str), 0)
 
-    return offset, limit
+    if max_limit is not None and (limit is None or limit > max_limit):
+        raise HTTPBadRequest(
+            json_body={
+                "error": "limit_too_large",
+                "error_description": (
+                    "The limit must be no greater than %d." % max_limit
+                ),
+            }
+        )
+
+    return limit
 
 
 amount_re = re.compile(r"[+-\u2212]?[0-9.,]{1,20}", re.U)
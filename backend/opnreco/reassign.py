@@ -5,19 +5,17 @@ to other open periods.
 
 import datetime
 
-from opnreco.models.db import AccountEntry, FileMovement, OwnerLog, Period, Reco
-from opnreco.viewcommon import add_open_period, get_period_for_day, get_tzname
-from sqlalchemy import (
-    BigInteger,
-    Date,
-    and_,
-    cast,
-    exists,
-    func,
-    literal,
-    select,
-    union_all,
+from opnreco.models.db import (
+    AccountEntry,
+    FileMovement,
+    OwnerLog,
+    Period,
+    Reco,
+    RecoSummary,
 )
+from opnreco.viewcommon import add_open_period
+from sqlalchemy import Date, and_, case, exists, func, literal, or_, select, update
+from sqlalchemy.dialects.postgresql import DATERANGE
 
 null = None
 
@@ -25,11 +23,9 @@ null = None
 class MovementReassignOp:
     """Operation config for (push|pull)_unreco to reassign movements."""
 
-    def __init__(self, owner):
+    def __init__(self):
         self.table = FileMovement
-        self.date_c = func.date(
-            func.timezone(get_tzname(owner), func.timezone("UTC", FileMovement.ts))
-        )
+        self.date_c = FileMovement.local_date
         self.id_c = FileMovement.movement_id
         self.plural = "movements"
 
@@ -44,64 +40,68 @@ class AccountEntryReassignOp:
         self.plural = "account_entries"
 
 
-def make_day_period_cte(days, period_list, default_endless=True):
-    """Create a CTE (common table expr) that maps a date to a period ID.
+def get_open_period_id_c(owner_id, file_id, exclude_period_id, day_c):
+    """Make a scalar subquery that chooses the open period for a date.
 
-    Provide a list of days to include in the CTE and the candidate periods.
+    Like get_period_for_day(), choose the open period whose date_range
+    contains the date, falling back to the open period with no end date.
+    The subquery is NULL when no open period is available. The date_range
+    lookup uses the GiST index on period.
+    """
+    contains = Period.date_range.contains(day_c)
+    return (
+        select(Period.id)
+        .where(
+            Period.owner_id == owner_id,
+            Period.file_id == file_id,
+            ~Period.closed,
+            Period.id != exclude_period_id,
+            or_(contains, Period.end_date == null),
+        )
+        .order_by(case((contains, 0), else_=1), Period.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
 
-    Return a tuple:
-    - day_periods: [(day, period_id)]
-    - day_period_cte
-    - missing_periods, a boolean that is true when some of the days
-      don't map to any period.
+
+def get_date_range_c(period):
+    """Make a daterange expression matching the dates of a period."""
+    return func.daterange(
+        literal(period.start_date, Date),
+        literal(period.end_date, Date),
+        "[]",
+        type_=DATERANGE,
+    )
+
+
+def get_period_date_filters(period, date_c):
+    """List the filters that match a date column to the dates of a period.
+
+    Unlike a daterange containment test, the comparisons can use a
+    btree index on the date column.
     """
-    # Choose a period for the movements, entries, or recos on a given date.
-    day_periods: list[tuple[datetime.date, int]] = []  # [(date, period_id)]
-    missing_period = False
-    for day in days:
-        period = get_period_for_day(period_list, day, default_endless=default_endless)
-        if period is None:
-            missing_period = True
-        else:
-            day_periods.append((day, period.id))  # type: ignore
-
-    if day_periods:
-        # Turn day_periods into day_period_cte, a common table expression
-        # that contains a simple mapping of date to period ID.
-        # See: https://stackoverflow.com/questions/44140632
-
-        # Optimization to reduce the size of the statement:
-        # Type cast only for first row;
-        # for other rows the database will infer.
-        stmts = [
-            select(
-                cast(literal(d), Date).label("day"),
-                cast(literal(pid), BigInteger).label("period_id"),
-            )
-            for (d, pid) in day_periods[:1]
-        ]
-        stmts.extend(select(literal(d), literal(pid)) for (d, pid) in day_periods[1:])
-        day_period_cte = union_all(*stmts).cte(name="day_period_cte")
+    filters = []
+    if period.start_date is not None:
+        filters.append(date_c >= period.start_date)
+    if period.end_date is not None:
+        filters.append(date_c <= period.end_date)
+    return filters
 
-    else:
-        # There are no periods for any of the days.
-        # Use a table with zero rows as day_period_cte.
-        day_period_cte = (
-            select(
-                cast(literal(None), Date).label("day"),
-                cast(literal(None), BigInteger).label("period_id"),
-            )
-            .where(literal(1) == literal(0))
-            .cte(name="day_period_cte")
-        )
 
-    return day_periods, day_period_cte, missing_period
+def expire_period_ids(dbsession, table, id_c, item_ids):
+    """Expire the period_id of reassigned rows loaded in the session."""
+    id_attr = id_c.key
+    item_id_set = set(item_ids)
+    for obj in list(dbsession.identity_map.values()):
+        if isinstance(obj, table) and getattr(obj, id_attr) in item_id_set:
+            dbsession.expire(obj, ["period_id"])
 
 
 def push_unreco(request, period, op):
     """Push the unreconciled movements or entries to other open periods.
 
-    Create a new period if necessary.
+    Create a new period if necessary. The target periods are chosen
+    in SQL and each item table gets one UPDATE.
     """
     dbsession = request.dbsession
     owner = request.owner
@@ -115,44 +115,22 @@ def push_unreco(request, period, op):
         op.table.reco_id == null,
     )
 
-    # List the dates of all items in the period.
-    unreco_query = dbsession.query(
-        op.date_c.label("day"),
-        op.id_c.label("item_id"),
-    ).filter(item_filter)
-    unreco_rows = unreco_query.all()
-
-    if not unreco_rows:
-        # There are no unreconciled items in the period.
-        return 0
-
-    # List the other open periods for the file.
-    period_list = (
-        dbsession.query(Period)
-        .filter(
-            Period.owner_id == owner_id,
-            Period.file_id == period.file_id,
-            ~Period.closed,
-            Period.id != period.id,
+    def make_target_c():
+        return get_open_period_id_c(
+            owner_id=owner_id,
+            file_id=period.file_id,
+            exclude_period_id=period.id,
+            day_c=op.date_c,
         )
-        .all()
-    )
 
-    # List the items to reassign.
-    days = set()
-    item_ids = []
-    for day, item_id in unreco_rows:
-        days.add(day)
-        if item_id is not None:
-            item_ids.append(item_id)
-
-    # Map the days to periods.
-    day_periods, day_period_cte, missing_period = make_day_period_cte(
-        days=sorted(days), period_list=period_list
-    )
+    # Find out whether any item has no open period to go to.
+    missing_period = dbsession.query(
+        exists().where(item_filter, make_target_c() == null)
+    ).scalar()
 
     # If no period is available for some of the items,
-    # create a new period.
+    # create a new period. The new period has no end date, so
+    # it accepts all the items that had nowhere to go.
     if missing_period:
         new_period = add_open_period(
             request=request,
@@ -164,19 +142,21 @@ def push_unreco(request, period, op):
         new_period_id = None
 
     # Reassign the items.
-    subq = (
-        dbsession.query(day_period_cte.c.period_id)
-        .filter(day_period_cte.c.day == op.date_c)
-        .as_scalar()
-    )
-    (
-        dbsession.query(op.table)
-        .filter(item_filter)
-        .update(
-            {"period_id": func.coalesce(subq, new_period_id)},
-            synchronize_session="fetch",
-        )
-    )
+    rows = dbsession.execute(
+        update(op.table)
+        .where(item_filter)
+        .values(period_id=make_target_c())
+        .returning(op.id_c, op.date_c, op.table.period_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+    if not rows:
+        # There were no unreconciled items in the period.
+        return 0
+
+    item_ids = sorted(item_id for (item_id, day, period_id) in rows)
+    expire_period_ids(dbsession, op.table, op.id_c, item_ids)
+    day_periods = sorted(set((day, period_id) for (item_id, day, period_id) in rows))
 
     dbsession.add(
         OwnerLog(
@@ -197,72 +177,48 @@ def push_unreco(request, period, op):
 
 
 def pull_unreco(request, period, op):
-    """Pull unreconciled items from other open periods into this period."""
+    """Pull unreconciled items from other open periods into this period.
+
+    The items are chosen by date range and reassigned in one UPDATE.
+    """
     dbsession = request.dbsession
     owner = request.owner
     owner_id = owner.id
     assert period.owner_id == owner_id
 
+    open_period_ids = select(Period.id).where(
+        Period.owner_id == owner_id,
+        Period.file_id == period.file_id,
+        ~Period.closed,
+        Period.id != period.id,
+    )
+
+    # List the unreconciled items in other open periods
+    # whose date falls in the range of this period.
     item_filter = and_(
         op.table.owner_id == owner_id,
         op.table.file_id == period.file_id,
-        op.table.period_id != period.id,
+        op.table.period_id.in_(open_period_ids),
         op.table.reco_id == null,
-        ~Period.closed,
-    )
-
-    # List the dates of all unreconciled items in other open periods
-    # for the same peer loop.
-    day_rows = (
-        dbsession.query(op.date_c)
-        .join(Period, Period.id == op.table.period_id)
-        .filter(item_filter)
-        .distinct()
-        .all()
-    )
-
-    if not day_rows:
-        # There are no items to pull in.
-        return 0
-
-    # List the dates of the items to pull in.
-    reassign_days = []
-    period_list = [period]
-    for (day,) in day_rows:
-        if get_period_for_day(period_list, day, default_endless=False) is period:
-            reassign_days.append(day)
-
-    if not reassign_days:
-        # None of the items found should be pulled in to this period.
-        return 0
-
-    # Map the reassignable items to this period.
-    day_periods, day_period_cte, missing_period = make_day_period_cte(
-        days=sorted(reassign_days), period_list=period_list, default_endless=False
+        *get_period_date_filters(period, op.date_c),
     )
 
-    # Make a subquery that lists the items to reassign.
-    ids_query = (
-        select(op.id_c)
-        .select_from(
-            op.table.__table__.join(Period, Period.id == op.table.period_id).join(
-                day_period_cte, day_period_cte.c.day == op.date_c
-            )
-        )
+    # Reassign items.
+    rows = dbsession.execute(
+        update(op.table)
         .where(item_filter)
-    )
+        .values(period_id=period.id)
+        .returning(op.id_c, op.date_c)
+        .execution_options(synchronize_session=False)
+    ).all()
 
-    item_ids = [item_id for (item_id,) in dbsession.execute(ids_query)]
+    if not rows:
+        # There were no items to pull in.
+        return 0
 
-    # Reassign items.
-    (
-        dbsession.query(op.table)
-        .filter(
-            op.id_c.in_(ids_query),
-            op.table.file_id == period.file_id,
-        )
-        .update({"period_id": period.id}, synchronize_session="fetch")
-    )
+    item_ids = sorted(item_id for (item_id, day) in rows)
+    expire_period_ids(dbsession, op.table, op.id_c, item_ids)
+    day_periods = [(day, period.id) for day in sorted(set(day for (_, day) in rows))]
 
     dbsession.add(
         OwnerLog(
@@ -281,6 +237,28 @@ def pull_unreco(request, period, op):
     return len(item_ids)
 
 
+def get_reco_date_cols(dbsession):
+    """Get the earliest entry date and local movement date of Reco rows.
+
+    The dates come from reco_summary by primary key lookup.
+    """
+    entry_date_c = (
+        dbsession.query(RecoSummary.min_entry_date)
+        .filter(RecoSummary.reco_id == Reco.id)
+        .correlate(Reco)
+        .as_scalar()
+    )
+
+    movement_date_c = (
+        dbsession.query(RecoSummary.min_local_date)
+        .filter(RecoSummary.reco_id == Reco.id)
+        .correlate(Reco)
+        .as_scalar()
+    )
+
+    return entry_date_c, movement_date_c
+
+
 def pull_recos(request, period):
     """Pull recos from other open periods into this period."""
     dbsession = request.dbsession
@@ -288,91 +266,41 @@ def pull_recos(request, period):
     owner_id = owner.id
     assert period.owner_id == owner_id
 
-    # reco_filter finds the recos that might need to be pulled.
-    reco_filter = and_(
-        Reco.owner_id == owner_id,
-        Reco.period_id != period.id,
+    open_period_ids = select(Period.id).where(
+        Period.owner_id == owner_id,
         Period.file_id == period.file_id,
         ~Period.closed,
+        Period.id != period.id,
     )
 
-    entry_date_c = (
-        dbsession.query(func.min(AccountEntry.entry_date))
-        .filter(AccountEntry.reco_id == Reco.id)
-        .correlate(Reco)
-        .as_scalar()
-    )
-
-    movement_date_c = (
-        dbsession.query(
-            func.date(
-                func.timezone(
-                    get_tzname(owner), func.timezone("UTC", func.min(FileMovement.ts))
-                )
-            )
-        )
-        .filter(FileMovement.reco_id == Reco.id)
-        .correlate(Reco)
-        .as_scalar()
-    )
+    entry_date_c, movement_date_c = get_reco_date_cols(dbsession)
 
     # reco_date_c provides the date of each reco. Note that
     # some recos have no account entries or movements; they have a date
     # of None. We don't want to move those recos into this period.
     reco_date_c = func.coalesce(entry_date_c, movement_date_c)
 
-    # List the dates of all recos in other open periods
-    # for the same peer loop.
-    day_rows = (
-        dbsession.query(reco_date_c)
-        .select_from(Reco)
-        .join(Period, Period.id == Reco.period_id)
-        .filter(reco_filter)
-        .distinct()
-        .all()
-    )
+    # Reassign the recos in other open periods whose date falls
+    # in the range of this period.
+    rows = dbsession.execute(
+        update(Reco)
+        .where(
+            Reco.owner_id == owner_id,
+            Reco.period_id.in_(open_period_ids),
+            get_date_range_c(period).contains(reco_date_c),
+        )
+        .values(period_id=period.id)
+        .returning(Reco.id, reco_date_c)
+        .execution_options(synchronize_session=False)
+    ).all()
 
-    if not day_rows:
+    if not rows:
         # There are no recos to pull in.
         return 0
 
-    # List the dates of the recos to pull in.
-    reassign_days = []
-    period_list = [period]
-    for (day,) in day_rows:
-        if (
-            day is not None
-            and get_period_for_day(period_list, day, default_endless=False) is period
-        ):
-            reassign_days.append(day)
-
-    if not reassign_days:
-        # None of the recos found should be pulled in to this period.
-        return 0
-
-    # Map the reassignable recos to this period.
-    # (Recos for other periods will not be listed in day_period_cte.)
-    day_periods, day_period_cte, missing_period = make_day_period_cte(
-        days=sorted(reassign_days), period_list=period_list, default_endless=False
-    )
-
-    # List the recos to reassign.
-    reco_id_rows = (
-        dbsession.query(Reco.id)
-        .join(Period, Period.id == Reco.period_id)
-        .join(day_period_cte, day_period_cte.c.day == reco_date_c)
-        .filter(reco_filter)
-        .all()
-    )
-
-    reco_ids = [reco_id for (reco_id,) in reco_id_rows]
-
-    # Reassign recos.
-    (
-        dbsession.query(Reco)
-        .filter(Reco.id.in_(reco_ids))
-        .update({"period_id": period.id}, synchronize_session="fetch")
-    )
+    reco_ids = sorted(reco_id for (reco_id, day) in rows)
+    day_periods = [(day, period.id) for day in sorted(set(day for (_, day) in rows))]
+    expire_period_ids(dbsession, Reco, Reco.id, reco_ids)
 
     # Reassign the period_id of affected movements.
     (
@@ -417,26 +345,7 @@ def push_recos(request, period):
     owner_id = owner.id
     assert period.owner_id == owner_id
 
-    entry_date_c = (
-        dbsession.query(func.min(AccountEntry.entry_date))
-        .filter(AccountEntry.reco_id == Reco.id)
-        .correlate(Reco)
-        .as_scalar()
-    )
-
-    movement_date_c = (
-        dbsession.query(
-            func.date(
-                func.timezone(
-                    get_tzname(owner), func.timezone("UTC", func.min(FileMovement.ts))
-                )
-            )
-        )
-        .select_from(FileMovement)
-        .filter(FileMovement.reco_id == Reco.id)
-        .correlate(Reco)
-        .as_scalar()
-    )
+    entry_date_c, movement_date_c = get_reco_date_cols(dbsession)
 
     future = datetime.date.today() + datetime.timedelta(days=366 * 100)
 
@@ -447,70 +356,47 @@ def push_recos(request, period):
     # a period for 100+ years in the future.)
     reco_date_c = func.coalesce(entry_date_c, movement_date_c, future)
 
-    # List the dates of all recos in this period.
-    reco_rows = (
-        dbsession.query(reco_date_c, Reco.id)
-        .select_from(Reco)
-        .filter(Reco.period_id == period.id)
-        .all()
-    )
-
-    if not reco_rows:
-        # There are no reconciliations in the period.
-        return 0
-
-    # List the other open periods for the peer.
-    period_list = (
-        dbsession.query(Period)
-        .filter(
-            Period.owner_id == owner_id,
-            Period.file_id == period.file_id,
-            ~Period.closed,
-            Period.id != period.id,
+    def make_target_c():
+        return get_open_period_id_c(
+            owner_id=owner_id,
+            file_id=period.file_id,
+            exclude_period_id=period.id,
+            day_c=reco_date_c,
         )
-        .all()
-    )
 
-    # List the recos to reassign.
-    days = set()
-    reco_ids = []
-    for day, reco_id in reco_rows:
-        days.add(day)
-        if reco_id is not None:
-            reco_ids.append(reco_id)
-
-    # Map the days to periods.
-    day_periods, day_period_cte, missing_period = make_day_period_cte(
-        days=sorted(days), period_list=period_list
-    )
+    # Find out whether any reco has no open period to go to.
+    missing_period = dbsession.query(
+        exists().where(Reco.period_id == period.id, make_target_c() == null)
+    ).scalar()
 
     # If no period is available for some of the recos,
-    # create a new period.
+    # create a new period with no end date to receive them.
     if missing_period:
         new_period = add_open_period(
             request=request,
             file_id=period.file_id,
             event_type="add_period_for_push_reco",
-            has_vault=period.has_vault,
         )
         new_period_id = new_period.id
     else:
         new_period_id = None
 
     # Reassign the recos.
-    subq = (
-        dbsession.query(day_period_cte.c.period_id)
-        .filter(day_period_cte.c.day == reco_date_c)
-        .as_scalar()
-    )
-    (
-        dbsession.query(Reco)
-        .filter(Reco.id.in_(reco_ids))
-        .update(
-            {"period_id": func.coalesce(subq, new_period_id)},
-            synchronize_session="fetch",
-        )
-    )
+    rows = dbsession.execute(
+        update(Reco)
+        .where(Reco.period_id == period.id)
+        .values(period_id=make_target_c())
+        .returning(Reco.id, reco_date_c, Reco.period_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+    if not rows:
+        # There are no reconciliations in the period.
+        return 0
+
+    reco_ids = sorted(reco_id for (reco_id, day, period_id) in rows)
+    day_periods = sorted(set((day, period_id) for (reco_id, day, period_id) in rows))
+    expire_period_ids(dbsession, Reco, Reco.id, reco_ids)
 
     # Reassign the period_id of affected movements.
     subq = (
@@ -0,0 +1,199 @@
+"""Compare the auto_reco_statement matching strategies on a synthetic backlog.
+
+Generates unreconciled movements and a statement inside a transaction
+that is rolled back, then times list_statement_matches() with the date
+window applied in SQL and in Python. Use a scratch database.
+"""
+
+import argparse
+import datetime
+import sys
+import time
+
+from dotenv import load_dotenv
+from opnreco.autorecostmt import list_statement_matches
+from opnreco.models.db import Base, File, Owner, Period, Statement
+from opnreco.models.dbmeta import get_engine
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+
+start_date = datetime.date(2020, 1, 1)
+
+
+def add_backlog(dbsession, movement_count, entry_count, amount_count, day_count):
+    """Add an open period with a backlog of movements and a statement."""
+    owner = Owner(id="bench", title="Benchmark", username="bench", tzname="UTC")
+    dbsession.add(owner)
+    dbsession.flush()
+    file = File(
+        owner_id=owner.id,
+        file_type="open_circ",
+        title="Benchmark",
+        currency="USD",
+        has_vault=True,
+    )
+    dbsession.add(file)
+    dbsession.flush()
+    period = Period(owner_id=owner.id, file_id=file.id, start_date=start_date)
+    dbsession.add(period)
+    dbsession.flush()
+    statement = Statement(
+        owner_id=owner.id, file_id=file.id, period_id=period.id, source="Benchmark"
+    )
+    dbsession.add(statement)
+    dbsession.flush()
+
+    dbsession.query(
+        func.set_config("opnreco.personal_id", owner.id, True),
+        func.set_config("opnreco.movement.event_type", "benchmark", True),
+        func.set_config("opnreco.account_entry.event_type", "benchmark", True),
+    ).one()
+
+    # Spread the amounts and dates with multiplicative hashing so the
+    # backlog is the same on every run.
+    params = {
+        "owner_id": owner.id,
+        "file_id": file.id,
+        "period_id": period.id,
+        "statement_id": statement.id,
+        "start_date": start_date,
+        "movement_count": movement_count,
+        "entry_count": entry_count,
+        "amount_count": amount_count,
+        "day_count": day_count,
+    }
+    dbsession.execute(
+        text("""
+            insert into transfer_record (
+                owner_id, transfer_id, workflow_type, start, currency, amount,
+                timestamp, next_activity, completed, canceled)
+            select
+                :owner_id,
+                'b' || n,
+                'redeem',
+                :start_date + ((n * 104729) % :day_count) * interval '1 day',
+                'USD',
+                (n * 7919) % :amount_count + 1,
+                :start_date + ((n * 104729) % :day_count) * interval '1 day',
+                'completed',
+                true,
+                false
+            from generate_series(1, :movement_count) n
+            """),
+        params,
+    )
+    dbsession.execute(
+        text("""
+            insert into movement (
+                owner_id, transfer_record_id, number, amount_index, loop_id,
+                currency, issuer_id, from_id, to_id, amount, action, ts)
+            select
+                owner_id, id, 1, 0, '0',
+                currency, '19', '19', '211', amount, 'deposit', start
+            from transfer_record
+            where owner_id = :owner_id
+            """),
+        params,
+    )
+    dbsession.execute(
+        text("""
+            insert into file_movement (
+                owner_id, file_id, movement_id, peer_id, loop_id, currency,
+                issuer_id, transfer_record_id, ts, wallet_delta, vault_delta,
+                period_id, surplus_delta)
+            select
+                owner_id, :file_id, id, '211', loop_id, currency,
+                issuer_id, transfer_record_id, ts, 0, amount,
+                :period_id, 0
+            from movement
+            where owner_id = :owner_id
+            """),
+        params,
+    )
+    dbsession.execute(
+        text("""
+            insert into account_entry (
+                owner_id, file_id, period_id, statement_id, entry_date,
+                currency, loop_id, delta, description)
+            select
+                :owner_id, :file_id, :period_id, :statement_id,
+                :start_date + (n * 104729) % :day_count + n % 5,
+                'USD', '0', -((n * 7919) % :amount_count + 1), 'Entry ' || n
+            from generate_series(1, :entry_count) n
+            """),
+        params,
+    )
+    dbsession.flush()
+    return owner, period, statement
+
+
+def summarize(by_delta):
+    return sorted(
+        (m.account_entry_id, tuple(sorted(m.movement_ids)))
+        for matches in by_delta.values()
+        for m in matches
+    )
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--movements", type=int, default=20000)
+    parser.add_argument("--entries", type=int, default=2000)
+    parser.add_argument("--amounts", type=int, default=50, help="distinct amounts")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv[1:])
+
+    load_dotenv()
+    engine = get_engine()
+    connection = engine.connect()
+    trans = connection.begin()
+    try:
+        Base.metadata.create_all(connection)
+        dbsession = Session(connection)
+        owner, period, statement = add_backlog(
+            dbsession,
+            movement_count=args.movements,
+            entry_count=args.entries,
+            amount_count=args.amounts,
+            day_count=args.days,
+        )
+        connection.execute(text("analyze"))
+        print(
+            "%d movements, %d account entries, %d distinct amounts over %d days"
+            % (args.movements, args.entries, args.amounts, args.days)
+        )
+
+        results = {}
+        for label, sql_date_window in (
+            ("date window in Python", False),
+            ("date window in SQL", True),
+        ):
+            times = []
+            for _ in range(args.repeat):
+                t = time.perf_counter()
+                by_delta = list_statement_matches(
+                    dbsession=dbsession,
+                    owner=owner,
+                    period=period,
+                    statement=statement,
+                    sql_date_window=sql_date_window,
+                )
+                times.append(time.perf_counter() - t)
+            results[label] = summarize(by_delta)
+            print(
+                "%-22s best %.3fs of %d, %d matches"
+                % (label, min(times), args.repeat, len(results[label]))
+            )
+
+        if len(set(map(tuple, results.values()))) != 1:
+            print("Error: the strategies found different matches")
+            return 1
+    finally:
+        trans.rollback()
+        connection.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+"""Compare get_period_for_day() with PeriodIndex on synthetic periods.
+
+Resolves many dates against a file with many consecutive weekly periods
+and an endless period at the end. Needs no database.
+"""
+
+import argparse
+import datetime
+import random
+import sys
+import time
+
+from opnreco.viewcommon import PeriodIndex, get_period_for_day
+
+start_date = datetime.date(2000, 1, 3)
+
+
+class BenchPeriod:
+    def __init__(self, id, start_date, end_date):
+        self.id = id
+        self.start_date = start_date
+        self.end_date = end_date
+
+
+def make_periods(period_count):
+    """Make consecutive weekly periods. The last period is endless."""
+    res = []
+    for n in range(period_count):
+        period_start = start_date + datetime.timedelta(days=7 * n)
+        if n == period_count - 1:
+            period_end = None
+        else:
+            period_end = period_start + datetime.timedelta(days=6)
+        res.append(BenchPeriod(n + 1, period_start, period_end))
+    return res
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--periods", type=int, default=1000)
+    parser.add_argument("--dates", type=int, default=100000)
+    args = parser.parse_args(argv[1:])
+
+    period_list = make_periods(args.periods)
+    rand = random.Random(1)
+    span = 7 * args.periods + 30
+    days = [
+        start_date + datetime.timedelta(days=rand.randint(-30, span))
+        for _ in range(args.dates)
+    ]
+
+    print("%d dates, %d periods" % (args.dates, args.periods))
+
+    t = time.perf_counter()
+    linear = [get_period_for_day(period_list, day) for day in days]
+    print("get_period_for_day  %8.1f ms" % ((time.perf_counter() - t) * 1000))
+
+    t = time.perf_counter()
+    period_index = PeriodIndex(period_list)
+    indexed = [period_index.get(day) for day in days]
+    print("PeriodIndex         %8.1f ms" % ((time.perf_counter() - t) * 1000))
+
+    if any(a is not b for a, b in zip(linear, indexed)):
+        print("Error: PeriodIndex chose different periods")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""Compare the JSON renderer modes on a synthetic transactions_api payload.
+
+Times the compact (default) and pretty renderer output against the
+renderer's previous behavior, which always indented and sorted keys.
+Also times a separate Python pass that converts Decimal and datetime
+values before encoding, which the compact mode does not use because
+the C encoder converts them through get_json_default. Needs no database.
+"""
+
+import argparse
+import datetime
+import json
+import sys
+import time
+from decimal import Decimal
+
+import pyramid.testing
+from opnreco.render import CustomJSONRenderer, compact_encoder, get_json_default
+
+start_ts = datetime.datetime(2020, 1, 1, 12, 0, 0)
+
+
+def make_record(n):
+    """Make a transactions_api record with one entry and one movement."""
+    delta = Decimal(n % 997 + 1) / 100
+    return {
+        "reco_id": str(n) if n % 2 else None,
+        "account_entry_id": None,
+        "movement_id": None,
+        "account_entries": [
+            {
+                "id": str(100000 + n),
+                "entry_date": (start_ts + datetime.timedelta(hours=n)).date(),
+                "account_delta": delta,
+            }
+        ],
+        "movements": [
+            {
+                "id": str(200000 + n),
+                "ts": start_ts + datetime.timedelta(hours=n, seconds=n % 60),
+                "movement_delta": delta,
+                "reco_movement_delta": delta,
+                "workflow_type": "redeem",
+                "transfer_id": "%010d" % (n * 7919),
+            }
+        ],
+    }
+
+
+def make_payload(row_count):
+    """Make a payload shaped like the transactions_api response."""
+    inc_records = [make_record(n) for n in range(0, row_count, 2)]
+    dec_records = [make_record(n) for n in range(1, row_count, 2)]
+    totals = {"account_delta": Decimal("1234.56"), "reco_movement_delta": Decimal(0)}
+    return {
+        "now": start_ts,
+        "rowcount": row_count,
+        "all_shown": True,
+        "next_after": None,
+        "inc_records": inc_records,
+        "inc_totals": {"page": totals, "all": totals},
+        "dec_records": dec_records,
+        "dec_totals": {"page": totals, "all": totals},
+    }
+
+
+def render_previous(value):
+    """Render the way CustomJSONRenderer did before compact output."""
+    return json.dumps(
+        value,
+        separators=(", ", ": "),
+        indent="  ",
+        sort_keys=True,
+        default=get_json_default,
+    )
+
+
+def preconvert(value):
+    """Convert Decimal, datetime, etc. in a separate Python pass."""
+    if isinstance(value, dict):
+        return {k: preconvert(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [preconvert(v) for v in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return get_json_default(value)
+
+
+def render_preconverted(value):
+    """Render compact JSON after converting the special values first."""
+    return compact_encoder.encode(preconvert(value))
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv[1:])
+
+    payload = make_payload(args.rows)
+    renderer = CustomJSONRenderer(None)
+
+    def render(**params):
+        request = pyramid.testing.DummyRequest(params=params)
+        return renderer(payload, {"request": request})
+
+    print("%d records" % args.rows)
+    for label, func in (
+        ("previous", lambda: render_previous(payload)),
+        ("pretty=true", lambda: render(pretty="true")),
+        ("compact", lambda: render()),
+        ("pre-pass", lambda: render_preconverted(payload)),
+    ):
+        times = []
+        for _ in range(args.repeat):
+            t = time.perf_counter()
+            res = func()
+            times.append(time.perf_counter() - t)
+        print(
+            "%-12s best %.1f ms of %d, %d bytes"
+            % (label, min(times) * 1000, args.repeat, len(res.encode("utf-8")))
+        )
+
+    if json.loads(render()) != json.loads(render_previous(payload)):
+        print("Error: the compact output has different content")
+        return 1
+    if render_preconverted(payload) != render():
+        print("Error: the pre-pass output differs from the compact output")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
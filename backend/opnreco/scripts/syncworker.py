@@ -0,0 +1,35 @@
+import os
+import sys
+
+from dotenv import load_dotenv
+from opnreco.models.dbmeta import get_dbsession_factory, get_engine
+from opnreco.syncworker import SyncWorker
+from pyramid.paster import setup_logging
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print(
+        "usage: %s <config_uri> [--once]\n"
+        '(example: "%s development.ini")\n'
+        "Runs queued sync jobs. With --once, exits when the queue is empty."
+        % (cmd, cmd)
+    )
+    sys.exit(1)
+
+
+def main(argv=sys.argv):
+    if len(argv) < 2 or argv[1].startswith("-"):
+        usage(argv)
+
+    options = argv[2:]
+    if set(options) - {"--once"}:
+        usage(argv)
+
+    load_dotenv()
+
+    config_uri = argv[1]
+    setup_logging(config_uri)
+    engine = get_engine()
+    worker = SyncWorker(get_dbsession_factory(engine))
+    worker.run(once="--once" in options)
@@ -4,7 +4,6 @@ import os
 from decimal import Decimal
 from typing import Sequence
 
-import requests
 from opnreco.models.db import (
     File,
     Movement,
@@ -16,6 +15,7 @@ from opnreco.models.db import (
     now_func,
 )
 from opnreco.mvinterp import MovementInterpreter
+from opnreco.opnclient import get_opn_client
 from opnreco.reify import reify
 from opnreco.util import check_requests_response, to_datetime
 
@@ -66,17 +66,28 @@ class SyncBase:
         if self.batch_limit:
             postdata["limit"] = self.batch_limit
 
-        r = requests.post(
+        r = get_opn_client().post(
             url,
+            self.request.access_token,
+            endpoint="/wallet/history_sync",
             data=postdata,
-            headers={"Authorization": "Bearer %s" % self.request.access_token},
         )
         check_requests_response(r)
 
         return r.json()
 
     def import_transfer_records(self, transfers_download: dict):
-        """Add and update TransferRecord rows."""
+        """Add and update TransferRecord rows.
+
+        New TransferRecord, TransferDownloadRecord, and Movement rows are
+        accumulated for the whole batch and written in a single flush, which
+        lets SQLAlchemy emit one multi-row INSERT ... RETURNING per table
+        rather than one round trip per transfer. The File interpreters run
+        once all the rows have IDs; their change_log entries for each record
+        are placed right after the record's own entries. The flush also
+        updates bundle_member (by trigger) for the records whose
+        bundled_transfers changed.
+        """
         dbsession = self.request.dbsession
         owner_id = self.owner_id
         write_enabled = self.write_enabled
@@ -132,6 +143,11 @@ class SyncBase:
         if write_enabled:
             self.import_peer(self.owner_id, None)
 
+        # to_interpret: [(record, [Movement], is_new_record)]
+        to_interpret = []
+        # log_ends: [len(change_log) after each to_interpret record's entries]
+        log_ends = []
+
         for tsum in transfers_download["results"]:
             if tsum.get("sender_is_dfi_account"):
                 sender_info = {}
@@ -197,7 +213,6 @@ class SyncBase:
                     )
                     changed.append(kw)
                     dbsession.add(record)
-                    dbsession.flush()  # Assign record.id
                     record_map[transfer_id] = record
                 change_log.append(
                     {
@@ -247,22 +262,50 @@ class SyncBase:
                 dbsession.add(
                     TransferDownloadRecord(
                         opn_download_id=self.opn_download_id,
-                        transfer_record_id=record.id,
+                        transfer_record=record,
                         transfer_id=transfer_id,
                         changed=changed,
                     )
                 )
 
             if record is not None:
-                self.import_movements(
+                if is_new_record:
+                    existing_movements = []
+                else:
+                    existing_movements = existing_movements_map[record.id]
+                movements = self.import_movements(
                     record,
                     tsum,
                     is_new_record=is_new_record,
-                    existing_movements=existing_movements_map[record.id],
+                    existing_movements=existing_movements,
                 )
+                to_interpret.append((record, movements, is_new_record))
+                log_ends.append(len(change_log))
 
+        # Write the new rows for the whole batch, assign the IDs,
+        # and log the movements.
         dbsession.flush()
 
+        if write_enabled and to_interpret:
+            # file_logs: [[[change_log entry] for each record] for each File]
+            file_logs = [
+                interpreter.sync_file_movement_batch(to_interpret)
+                for interpreter in self.interpreters
+            ]
+            dbsession.flush()
+
+            # Merge the interpreters' entries into the change_log
+            # after the entries of the record they belong to.
+            merged = []
+            start = 0
+            for index, end in enumerate(log_ends):
+                merged.extend(change_log[start:end])
+                for record_logs in file_logs:
+                    merged.extend(record_logs[index])
+                start = end
+            merged.extend(change_log[start:])
+            change_log[:] = merged
+
     def get_existing_movements_map(self, transfer_ids):
         """List all movements recorded for the given transfer IDs.
 
@@ -419,6 +462,11 @@ class SyncBase:
                     )
 
     def import_movements(self, record, item, is_new_record, existing_movements):
+        """Verify the known movements of a transfer and add the new ones.
+
+        The new Movements are added to the session but not flushed.
+        Return the list of all Movements in the transfer.
+        """
         transfer_id = item["id"]
         dbsession = self.request.dbsession
         write_enabled = self.write_enabled
@@ -488,7 +536,7 @@ class SyncBase:
                     if write_enabled:
                         # Record the new movement.
                         movement = Movement(
-                            transfer_record_id=record.id,
+                            transfer_record=record,
                             owner_id=self.owner_id,
                             number=number,
                             amount_index=amount_index,
@@ -529,14 +577,7 @@ class SyncBase:
             log.error(msg)
             raise VerificationFailure(msg, transfer_id=transfer_id)
 
-        if write_enabled:
-            dbsession.flush()  # Assign the movement IDs and log the movements
-            for interpreter in self.interpreters:
-                interpreter.sync_file_movements(
-                    record=record,
-                    movements=list(movement_dict.values()),
-                    is_new_record=is_new_record,
-                )
+        return list(movement_dict.values())
 
     def summarize_movement(self, movement, transfer_id, ts):
         """Summarize a movement.
@@ -0,0 +1,113 @@
+import os
+
+import sqlalchemy.dialects.postgresql
+from opnreco.models.db import OwnerLog, SyncJob
+from opnreco.render import datetime_to_json
+from pyramid.httpexceptions import HTTPBadRequest
+
+active_states = ("queued", "running")
+
+
+def background_sync_enabled() -> bool:
+    """Return true if the sync API should delegate to the sync worker.
+
+    Enable with the background_sync environment variable. Don't enable it
+    unless an opnreco_sync_worker process is running.
+    """
+    value = os.environ.get("background_sync", "")
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def enqueue_sync_job(request) -> SyncJob:
+    """Get the owner's active SyncJob or add a new one."""
+    dbsession = request.dbsession
+    owner_id = request.owner.id
+
+    # Insert without creating a conflict with concurrent requests.
+    # ix_sync_job_single_active allows only one active job per owner.
+    stmt = (
+        sqlalchemy.dialects.postgresql.insert(SyncJob.__table__)
+        .values(
+            owner_id=owner_id,
+            state="queued",
+            personal_id=request.personal_id,
+            access_token=request.access_token,
+            remote_addr=request.remote_addr,
+            user_agent=request.user_agent,
+            progress_percent=0,
+            change_count=0,
+            download_count=0,
+        )
+        .on_conflict_do_nothing(
+            index_elements=["owner_id"],
+            index_where=SyncJob.state.in_(active_states),
+        )
+        .returning(SyncJob.id)
+    )
+    added_id = dbsession.execute(stmt).scalar()
+
+    if added_id is not None:
+        dbsession.add(
+            OwnerLog(
+                owner_id=owner_id,
+                personal_id=request.personal_id,
+                event_type="sync_job_add",
+                remote_addr=request.remote_addr,
+                user_agent=request.user_agent,
+                content={"sync_job_id": added_id},
+            )
+        )
+
+    return (
+        dbsession.query(SyncJob)
+        .filter(
+            SyncJob.owner_id == owner_id,
+            SyncJob.state.in_(active_states),
+        )
+        .one()
+    )
+
+
+def get_sync_job(request, job_id) -> SyncJob:
+    """Get one of the owner's SyncJobs by ID."""
+    try:
+        job_id = int(job_id)
+    except (TypeError, ValueError):
+        job_id = None
+
+    job = None
+    if job_id is not None:
+        job = (
+            request.dbsession.query(SyncJob)
+            .filter(
+                SyncJob.owner_id == request.owner.id,
+                SyncJob.id == job_id,
+            )
+            .first()
+        )
+
+    if job is None:
+        raise HTTPBadRequest(
+            json_body={
+                "error": "invalid_job_id",
+                "error_description": "Sync job not found",
+            }
+        )
+
+    return job
+
+
+def get_sync_job_status(job: SyncJob) -> dict:
+    """Report the progress of a SyncJob in the format of the sync API."""
+    return {
+        "job_id": job.id,
+        "job_state": job.state,
+        "progress_percent": job.progress_percent,
+        "change_count": job.change_count,
+        "download_count": job.download_count,
+        "more": job.state in active_states,
+        "first_sync_ts": datetime_to_json(job.first_sync_ts),
+        "last_sync_ts": datetime_to_json(job.last_sync_ts),
+        "error": job.error_type,
+        "error_description": job.error_description,
+    }
@@ -0,0 +1,132 @@
+import logging
+import queue
+import threading
+from typing import Callable, NamedTuple
+
+from opnreco.util import to_datetime
+
+log = logging.getLogger(__name__)
+
+
+class SyncCursor(NamedTuple):
+    """The parameters of a /wallet/history_sync request."""
+
+    sync_ts_iso: str
+    sync_transfer_id: str | None
+    count_remain: bool
+
+
+class PrefetchedBatch(NamedTuple):
+    """A history_sync batch and the cursor that requested it."""
+
+    cursor: SyncCursor
+    transfers_download: dict
+
+
+class StalePrefetch(Exception):
+    """A prefetched batch no longer matches the owner's sync cursor."""
+
+
+def get_next_cursor(transfers_download: dict) -> SyncCursor | None:
+    """Get the cursor for the batch after the given batch.
+
+    Return None if there are no more batches. This follows the same
+    rules as SyncAPI, which stores the cursor in Owner.last_sync_ts and
+    Owner.last_sync_transfer_id.
+    """
+    if not transfers_download["more"]:
+        return None
+    last_sync_ts = to_datetime(transfers_download["last_sync_ts"])
+    return SyncCursor(
+        sync_ts_iso=last_sync_ts.isoformat() + "Z",
+        sync_transfer_id=transfers_download["results"][-1]["id"],
+        count_remain=False,
+    )
+
+
+class HistoryPrefetcher:
+    """Download history_sync batches on a thread ahead of the importer.
+
+    The thread downloads the batch after the one being imported, so
+    network I/O overlaps the database work. At most `depth` downloaded
+    batches wait in the queue; the thread blocks until the importer
+    catches up.
+
+    download is called as download(sync_ts_iso, sync_transfer_id,
+    count_remain) and must not use the database session.
+    """
+
+    # How often the download thread checks whether it should stop.
+    poll_timeout = 0.5
+
+    def __init__(
+        self, download: Callable[..., dict], cursor: SyncCursor, depth: int = 1
+    ):
+        if depth < 1:
+            raise ValueError("depth must be at least 1")
+        self.download = download
+        self.cursor = cursor
+        self.queue: queue.Queue = queue.Queue(maxsize=depth)
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(
+            target=self._run, name="opnreco-history-prefetch", daemon=True
+        )
+
+    def start(self):
+        self.thread.start()
+
+    def close(self):
+        """Stop the download thread and discard any unused batches."""
+        self.stopping.set()
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        self.thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+        """Yield PrefetchedBatch items in order.
+
+        Re-raise any exception raised by the download function.
+        """
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    def _put(self, item) -> bool:
+        """Put an item in the queue unless stopping. Return True if put."""
+        while not self.stopping.is_set():
+            try:
+                self.queue.put(item, timeout=self.poll_timeout)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self):
+        cursor = self.cursor
+        while cursor is not None and not self.stopping.is_set():
+            try:
+                transfers_download = self.download(*cursor)
+                next_cursor = get_next_cursor(transfers_download)
+            except Exception as e:
+                log.warning("history_sync prefetch failed: %s", e)
+                self._put(e)
+                return
+            if not self._put(PrefetchedBatch(cursor, transfers_download)):
+                return
+            cursor = next_cursor
+        # Signal the end of the batches.
+        self._put(None)
@@ -0,0 +1,206 @@
+import logging
+import os
+import time
+
+import transaction
+from opnreco.api.syncapi import SyncAPI
+from opnreco.main import wallet_info
+from opnreco.models.db import Owner, SyncJob, now_func
+from opnreco.models.dbmeta import get_tm_dbsession
+from opnreco.syncbase import VerificationFailure
+from opnreco.syncjob import active_states
+from opnreco.syncprefetch import HistoryPrefetcher, PrefetchedBatch, StalePrefetch
+from opnreco.util import to_datetime
+from pyramid.decorator import reify
+
+log = logging.getLogger(__name__)
+
+
+class SyncJobRequest:
+    """Provide the request attributes SyncBase needs while running a SyncJob."""
+
+    def __init__(self, dbsession, job: SyncJob, owner: Owner):
+        self.dbsession = dbsession
+        self.owner = owner
+        self.personal_id = job.personal_id
+        self.access_token = job.access_token
+        self.remote_addr = job.remote_addr
+        self.user_agent = job.user_agent
+
+    @reify
+    def wallet_info(self):
+        return wallet_info(self)
+
+
+class SyncWorker:
+    """Run queued SyncJobs outside of HTTP requests.
+
+    Each batch runs in its own transaction. The job row stays locked
+    (FOR UPDATE SKIP LOCKED) while a batch runs, so several workers can
+    share the queue. If a worker stops in the middle of a batch, the batch
+    rolls back and the next worker resumes from the owner's sync cursor.
+
+    If prefetch_depth is positive (the default), the worker downloads
+    up to prefetch_depth batches ahead of the batch it is importing.
+    """
+
+    def __init__(
+        self,
+        dbsession_factory,
+        transaction_manager=None,
+        poll_interval=None,
+        prefetch_depth=None,
+    ):
+        self.dbsession_factory = dbsession_factory
+        self.transaction_manager = transaction_manager or transaction.manager
+        if poll_interval is None:
+            poll_interval = float(os.environ.get("sync_worker_poll_interval", "2"))
+        self.poll_interval = poll_interval
+        if prefetch_depth is None:
+            prefetch_depth = int(os.environ.get("sync_worker_prefetch", "1"))
+        self.prefetch_depth = prefetch_depth
+
+    def run(self, once=False):
+        """Run jobs until there are none left (if once is true) or forever."""
+        if self.prefetch_depth > 0:
+            step = self.run_pipelined
+        else:
+            step = self.run_batch
+        while True:
+            if not step():
+                if once:
+                    break
+                time.sleep(self.poll_interval)
+
+    def run_batch(self) -> bool:
+        """Run one batch of the oldest available job.
+
+        Return False if no job is available.
+        """
+        tm = self.transaction_manager
+        job_id = None
+        try:
+            with tm:
+                dbsession = get_tm_dbsession(self.dbsession_factory, tm)
+                job = self.claim_job(dbsession)
+                if job is None:
+                    return False
+                job_id = job.id
+                self.run_job_batch(dbsession, job)
+        except Exception as e:
+            if job_id is None:
+                raise
+            log.exception("Sync job %s failed", job_id)
+            with tm:
+                dbsession = get_tm_dbsession(self.dbsession_factory, tm)
+                self.fail_job(dbsession, job_id, e)
+        return True
+
+    def run_pipelined(self) -> bool:
+        """Run the oldest available job while prefetching its batches.
+
+        Each batch is still imported in its own transaction. Between
+        transactions, another worker may claim the job; if the job's owner
+        no longer has the cursor a prefetched batch was requested with,
+        stop and leave the job for the next claim.
+
+        Return False if no job is available.
+        """
+        tm = self.transaction_manager
+        job_id = None
+        prefetcher = None
+        try:
+            with tm:
+                dbsession = get_tm_dbsession(self.dbsession_factory, tm)
+                job = self.claim_job(dbsession)
+                if job is None:
+                    return False
+                job_id = job.id
+                owner = dbsession.query(Owner).filter(Owner.id == job.owner_id).one()
+                api = SyncAPI(SyncJobRequest(dbsession=dbsession, job=job, owner=owner))
+                cursor = api.get_sync_cursor()
+
+            # api.download_batch uses only the job's credentials, not the
+            # database session, so it can run on the prefetch thread.
+            prefetcher = HistoryPrefetcher(
+                download=api.download_batch, cursor=cursor, depth=self.prefetch_depth
+            )
+            prefetcher.start()
+
+            for prefetched in prefetcher:
+                with tm:
+                    dbsession = get_tm_dbsession(self.dbsession_factory, tm)
+                    job = self.lock_job(dbsession, job_id)
+                    if job is None:
+                        # Another worker has the job or it is finished.
+                        break
+                    status = self.run_job_batch(dbsession, job, prefetched=prefetched)
+                if not status["more"]:
+                    break
+
+        except StalePrefetch as e:
+            log.info("Sync job %s: %s", job_id, e)
+        except Exception as e:
+            if job_id is None:
+                raise
+            log.exception("Sync job %s failed", job_id)
+            with tm:
+                dbsession = get_tm_dbsession(self.dbsession_factory, tm)
+                self.fail_job(dbsession, job_id, e)
+        finally:
+            if prefetcher is not None:
+                prefetcher.close()
+        return True
+
+    def lock_job(self, dbsession, job_id: int) -> SyncJob | None:
+        """Lock a specific active job unless another worker is running it."""
+        return (
+            dbsession.query(SyncJob)
+            .filter(SyncJob.id == job_id, SyncJob.state.in_(active_states))
+            .with_for_update(skip_locked=True)
+            .first()
+        )
+
+    def claim_job(self, dbsession) -> SyncJob | None:
+        """Lock the oldest active job that no other worker is running."""
+        return (
+            dbsession.query(SyncJob)
+            .filter(SyncJob.state.in_(active_states))
+            .order_by(SyncJob.id)
+            .with_for_update(skip_locked=True)
+            .first()
+        )
+
+    def run_job_batch(
+        self, dbsession, job: SyncJob, prefetched: PrefetchedBatch | None = None
+    ):
+        """Import the next batch of a job, downloading it if not prefetched."""
+        owner = dbsession.query(Owner).filter(Owner.id == job.owner_id).one()
+        request = SyncJobRequest(dbsession=dbsession, job=job, owner=owner)
+        status = SyncAPI(request).sync_batch(prefetched=prefetched)
+
+        more = status["more"]
+        job.state = "running" if more else "done"
+        job.updated = now_func
+        job.progress_percent = status["progress_percent"]
+        job.change_count += status["change_count"]
+        job.download_count += status["download_count"]
+        job.first_sync_ts = to_datetime(status["first_sync_ts"], allow_none=True)
+        job.last_sync_ts = to_datetime(status["last_sync_ts"], allow_none=True)
+        if not more:
+            job.access_token = None
+        dbsession.flush()
+        return status
+
+    def fail_job(self, dbsession, job_id: int, e: Exception):
+        """Record the failure of a job."""
+        job = dbsession.query(SyncJob).filter(SyncJob.id == job_id).one()
+        job.state = "failed"
+        job.updated = now_func
+        job.access_token = None
+        if isinstance(e, VerificationFailure):
+            job.error_type = "verification_failure"
+        else:
+            job.error_type = "error"
+        job.error_description = str(e) or e.__class__.__name__
+        dbsession.flush()
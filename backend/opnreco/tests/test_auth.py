@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import pyramid.testing
+
+
+class TestOPNTokenAuthenticationPolicy(unittest.TestCase):
+    def setUp(self):
+        os.environ["opn_api_url"] = "https://opn.example.com:9999"
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "tokens.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _make(self):
+        from ..auth import OPNTokenAuthenticationPolicy
+        from ..tokencache import SQLiteTokenCache
+
+        cache = SQLiteTokenCache(path=self.path, max_size=10, ttl=60)
+        self.addCleanup(cache.close)
+        return OPNTokenAuthenticationPolicy(token_cache=cache)
+
+    def make_request(self):
+        request = pyramid.testing.DummyRequest(
+            access_token="abc",
+            personal_id="12",
+            remote_addr="127.0.0.1",
+            user_agent="Test UA",
+            owner=None,
+            dbsession=mock.Mock(),
+        )
+        return request
+
+    def test_processes_share_validated_tokens(self):
+        wallet_info = {"profile": {"id": "11", "title": "Tester"}}
+        # Simulate two worker processes that share the cache file.
+        worker1 = self._make()
+        worker2 = self._make()
+
+        with mock.patch.object(
+            type(worker1), "_request_wallet_info", return_value=wallet_info
+        ) as request_wallet_info:
+            request1 = self.make_request()
+            self.assertEqual("11", worker1.authenticated_userid(request1))
+            request2 = self.make_request()
+            self.assertEqual("11", worker2.authenticated_userid(request2))
+
+        self.assertEqual(1, request_wallet_info.call_count)
+        self.assertEqual(wallet_info, request2.wallet_info)
+        # Only the request that validated the token logs the access.
+        self.assertEqual(1, request1.dbsession.add.call_count)
+        self.assertEqual(0, request2.dbsession.add.call_count)
+        self.assertEqual(1, worker2.token_cache.get_stats()["hits"])
+
+    def test_revalidation_is_not_logged_again(self):
+        wallet_info = {"profile": {"id": "11", "title": "Tester"}}
+        worker1 = self._make()
+        worker2 = self._make()
+
+        with mock.patch.object(
+            type(worker1), "_request_wallet_info", return_value=wallet_info
+        ) as request_wallet_info:
+            with mock.patch("time.time", return_value=1000.0):
+                request1 = self.make_request()
+                self.assertEqual("11", worker1.authenticated_userid(request1))
+            # The entry has expired, so the other worker revalidates it.
+            with mock.patch("time.time", return_value=1061.0):
+                request2 = self.make_request()
+                self.assertEqual("11", worker2.authenticated_userid(request2))
+
+        self.assertEqual(2, request_wallet_info.call_count)
+        # Only the first validation logs the access.
+        self.assertEqual(1, request1.dbsession.add.call_count)
+        self.assertEqual(0, request2.dbsession.add.call_count)
+
+    def test_invalid_token_is_not_cached(self):
+        policy = self._make()
+        with mock.patch.object(
+            type(policy), "_request_wallet_info", return_value=None
+        ) as request_wallet_info:
+            self.assertIsNone(policy.authenticated_userid(self.make_request()))
+            self.assertIsNone(policy.authenticated_userid(self.make_request()))
+
+        self.assertEqual(2, request_wallet_info.call_count)
+        self.assertEqual(0, len(policy.token_cache))
+
+    def test_logs_cache_stats(self):
+        policy = self._make()
+        policy.stats_log.interval = 60
+        policy.stats_log._next_log = 0
+        with mock.patch.object(type(policy), "_request_wallet_info", return_value=None):
+            with self.assertLogs("opnreco.auth", level="INFO") as cm:
+                policy.authenticated_userid(self.make_request())
+                policy.authenticated_userid(self.make_request())
+        self.assertEqual(1, len(cm.output))
+        self.assertIn("Token cache stats: {'hits': 0, 'misses': 1", cm.output[0])
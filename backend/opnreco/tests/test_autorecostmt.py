@@ -700,3 +700,138 @@ class Test_auto_reco_statement(unittest.TestCase):
             statement=self.statement,
         )
         self.assert_recos(expect_recos=2, expect_movements=4, expect_account_entries=2)
+
+    def test_bundle_query_rows(self):
+        from ..autorecostmt import build_bundle_query
+
+        self.add_peer()
+        self.add_period()
+        _, _, fm1 = self.add_transfer_6502(amount="-2.00", bundle_transfer_id="6512")
+        _, _, fm2 = self.add_transfer_6510(amount="-10.00", bundle_transfer_id="6512")
+        self.add_transfer_6512()
+        query = build_bundle_query(
+            dbsession=self.dbsession, owner=self.owner, period=self.period
+        )
+        rows = self.dbsession.execute(query).fetchall()
+        self.assertEqual(
+            [
+                (
+                    "6512",
+                    datetime.date(2018, 1, 15),
+                    Decimal("12.00"),
+                    sorted([fm1.movement_id, fm2.movement_id]),
+                )
+            ],
+            [tuple(row) for row in rows],
+        )
+
+    def test_bundle_members_follow_bundled_transfers(self):
+        from opnreco.models import db
+
+        self.add_peer()
+        self.add_period()
+        r = self.add_transfer_6512(
+            bundled_transfer_ids=("6502", "6502"), bundled_amounts=("2.00", "10.00")
+        )
+
+        def list_members():
+            return [
+                (m.transfer_id, m.issuer_id, m.amount)
+                for m in self.dbsession.query(db.BundleMember).filter(
+                    db.BundleMember.bundle_record_id == r.id
+                )
+            ]
+
+        # Repeated bundled transfers are summed.
+        self.assertEqual([("6502", "19", Decimal("12.00"))], list_members())
+
+        r.bundled_transfers = []
+        self.dbsession.flush()
+        self.assertEqual([], list_members())
+
+    def test_malformed_bundle_has_no_members(self):
+        from opnreco.models import db
+
+        self.add_peer()
+        self.add_period()
+        r = self.add_transfer_6512()
+        good = {"transfer_id": "6502", "issuer_id": "19", "amount": "2.00"}
+
+        def list_members():
+            return [
+                (m.transfer_id, m.issuer_id, m.amount)
+                for m in self.dbsession.query(db.BundleMember).filter(
+                    db.BundleMember.bundle_record_id == r.id
+                )
+            ]
+
+        for bad in (
+            {"transfer_id": "6510", "amount": "10.00"},
+            {"issuer_id": "19", "amount": "10.00"},
+            {"transfer_id": "6510", "issuer_id": "19"},
+            {"transfer_id": "6510", "issuer_id": "19", "amount": "ten"},
+            "6510",
+        ):
+            r.bundled_transfers = [good, bad]
+            self.dbsession.flush()
+            self.assertEqual([], list_members(), bad)
+
+            r.bundled_transfers = [good]
+            self.dbsession.flush()
+            self.assertEqual([("6502", "19", Decimal("2.00"))], list_members())
+
+    def test_malformed_bundle_does_not_qualify(self):
+        from ..autorecostmt import build_bundle_query
+
+        self.add_peer()
+        self.add_period()
+        self.add_transfer_6502(amount="-2.00", bundle_transfer_id="6512")
+        self.add_transfer_6510(amount="-10.00", bundle_transfer_id="6512")
+        r = self.add_transfer_6512()
+
+        def list_rows():
+            query = build_bundle_query(
+                dbsession=self.dbsession, owner=self.owner, period=self.period
+            )
+            return self.dbsession.execute(query).fetchall()
+
+        self.assertEqual(1, len(list_rows()))
+
+        # A third member without an issuer ID makes the bundle unqualified
+        # even though the other members match.
+        r.bundled_transfers = r.bundled_transfers + [
+            {"transfer_id": "6520", "amount": "1.00"}
+        ]
+        self.dbsession.flush()
+        self.assertEqual([], list_rows())
+
+    def test_sql_date_window_matches_python_date_window(self):
+        from ..autorecostmt import list_statement_matches
+
+        self.add_peer()
+        self.add_period()
+        self.add_transfer_6502()
+        self.add_transfer_6510()
+        self.add_statement(e1date=datetime.date(2018, 3, 1))
+
+        results = []
+        for sql_date_window in (True, False):
+            by_delta = list_statement_matches(
+                dbsession=self.dbsession,
+                owner=self.owner,
+                period=self.period,
+                statement=self.statement,
+                sql_date_window=sql_date_window,
+            )
+            results.append(
+                [
+                    (delta, m.transfer_id, m.movement_date)
+                    for delta, matches in sorted(by_delta.items())
+                    for m in matches
+                ]
+            )
+
+        self.assertEqual(
+            [(Decimal("-10.00"), "6510", datetime.date(2018, 1, 15))], results[0]
+        )
+        self.assertEqual(results[0], results[1])
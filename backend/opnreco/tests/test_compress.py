@@ -0,0 +1,109 @@
+import gzip
+import os
+import unittest
+from unittest import mock
+
+from pyramid.request import Request
+from pyramid.response import Response
+
+
+class Test_tween_factory(unittest.TestCase):
+    def setUp(self):
+        from ..compress import reset_compression_stats
+
+        reset_compression_stats()
+
+    def _make(self, response, **environ):
+        from ..compress import tween_factory
+
+        with mock.patch.dict(os.environ, environ):
+            return tween_factory(lambda request: response, None)
+
+    def make_response(self, body=b'{"rows":[' + b'{"delta":"1.00"},' * 200 + b"{}]}"):
+        return Response(body=body, content_type="application/json")
+
+    def make_request(self, path="/api/period/5/transactions", accept="gzip"):
+        request = Request.blank(path)
+        if accept is not None:
+            request.headers["Accept-Encoding"] = accept
+        return request
+
+    def test_compresses_api_json(self):
+        from ..compress import get_compression_stats
+
+        response = self.make_response()
+        body = response.body
+        tween = self._make(response)
+        res = tween(self.make_request())
+        self.assertEqual("gzip", res.content_encoding)
+        self.assertEqual(body, gzip.decompress(res.body))
+        self.assertIn("Accept-Encoding", res.vary)
+
+        stats = get_compression_stats()["gzip"]
+        self.assertEqual(1, stats["count"])
+        self.assertEqual(len(body), stats["bytes_in"])
+        self.assertEqual(len(res.body), stats["bytes_out"])
+        self.assertGreater(stats["ratio"], 10)
+
+    def test_logs_stats(self):
+        response = self.make_response()
+        tween = self._make(response, stats_log_interval="60")
+        with mock.patch("time.monotonic", return_value=1e9):
+            with self.assertLogs("opnreco.compress", level="INFO") as cm:
+                tween(self.make_request())
+                tween(self.make_request())
+        self.assertEqual(1, len(cm.output))
+        self.assertIn("API compression stats by encoding: {'gzip'", cm.output[0])
+
+    def test_without_accept_encoding(self):
+        response = self.make_response()
+        body = response.body
+        res = self._make(response)(self.make_request(accept=None))
+        self.assertIsNone(res.content_encoding)
+        self.assertEqual(body, res.body)
+        self.assertIn("Accept-Encoding", res.vary)
+
+    def test_refused_encoding(self):
+        response = self.make_response()
+        res = self._make(response)(self.make_request(accept="gzip;q=0, identity"))
+        self.assertIsNone(res.content_encoding)
+
+    def test_below_min_size(self):
+        response = self.make_response(body=b'{"a":1}')
+        res = self._make(response, api_compress_min_size="100")(self.make_request())
+        self.assertIsNone(res.content_encoding)
+        self.assertEqual(b'{"a":1}', res.body)
+
+    def test_compression_level(self):
+        response = self.make_response()
+        body = response.body
+        res = self._make(response, api_compress_level="1")(self.make_request())
+        self.assertEqual(body, gzip.decompress(res.body))
+        # The level is stored in the gzip header flags (4 = fastest).
+        self.assertEqual(4, res.body[8])
+
+    def test_not_api_path(self):
+        response = self.make_response()
+        res = self._make(response)(self.make_request(path="/static/data.json"))
+        self.assertIsNone(res.content_encoding)
+        self.assertIsNone(res.vary)
+
+    def test_error_response(self):
+        response = self.make_response()
+        response.status = 400
+        res = self._make(response)(self.make_request())
+        self.assertIsNone(res.content_encoding)
+
+    def test_brotli_preferred_when_available(self):
+        from .. import compress
+
+        fake_brotli = mock.Mock()
+        fake_brotli.compress.return_value = b"brotli!"
+        with mock.patch.object(compress, "brotli", fake_brotli):
+            response = self.make_response()
+            res = self._make(response, api_brotli_quality="3")(
+                self.make_request(accept="gzip, br")
+            )
+        self.assertEqual("br", res.content_encoding)
+        self.assertEqual(b"brotli!", res.body)
+        self.assertEqual(3, fake_brotli.compress.call_args[1]["quality"])
@@ -0,0 +1,72 @@
+import unittest
+
+import responses
+
+
+class TestOPNClient(unittest.TestCase):
+    def _make(self, **kw):
+        from ..opnclient import OPNClient
+
+        kw.setdefault("retry_backoff", 0)
+        return OPNClient(**kw)
+
+    @responses.activate
+    def test_get_sends_access_token_and_records_latency(self):
+        responses.add(
+            responses.GET,
+            "https://opn.example.com/wallet/info",
+            json={"profile": {"id": "11"}},
+        )
+        obj = self._make()
+        r = obj.get(
+            "https://opn.example.com/wallet/info", "abc", endpoint="/wallet/info"
+        )
+        self.assertEqual({"profile": {"id": "11"}}, r.json())
+        self.assertEqual(
+            "Bearer abc", responses.calls[0].request.headers["Authorization"]
+        )
+
+        stats = obj.get_stats()
+        self.assertEqual(["/wallet/info"], list(stats))
+        self.assertEqual(1, stats["/wallet/info"]["count"])
+        self.assertEqual(0, stats["/wallet/info"]["error_count"])
+        self.assertGreaterEqual(stats["/wallet/info"]["total_seconds"], 0)
+
+    @responses.activate
+    def test_get_retries_unavailable_response(self):
+        url = "https://opn.example.com/p/19"
+        responses.add(responses.GET, url, status=503)
+        responses.add(responses.GET, url, json={"title": "Issuer"})
+        obj = self._make(get_retries=2)
+        r = obj.get(url, "abc", endpoint="/p/{id}")
+        self.assertEqual(200, r.status_code)
+        self.assertEqual(2, len(responses.calls))
+        self.assertEqual(0, obj.get_stats()["/p/{id}"]["error_count"])
+
+    @responses.activate
+    def test_get_returns_last_response_when_retries_run_out(self):
+        url = "https://opn.example.com/p/19"
+        responses.add(responses.GET, url, status=503)
+        obj = self._make(get_retries=1)
+        r = obj.get(url, "abc", endpoint="/p/{id}")
+        self.assertEqual(503, r.status_code)
+        self.assertEqual(2, len(responses.calls))
+        self.assertEqual(1, obj.get_stats()["/p/{id}"]["error_count"])
+
+    @responses.activate
+    def test_post_is_not_retried(self):
+        url = "https://opn.example.com/wallet/history_sync"
+        responses.add(responses.POST, url, status=503)
+        responses.add(responses.POST, url, json={"results": []})
+        obj = self._make(get_retries=2)
+        r = obj.post(url, "abc", endpoint="/wallet/history_sync", data={"sync_ts": "x"})
+        self.assertEqual(503, r.status_code)
+        self.assertEqual(1, len(responses.calls))
+
+    def test_get_opn_client_is_shared(self):
+        from ..opnclient import get_opn_client, reset_opn_client
+
+        client = get_opn_client()
+        self.assertIs(client, get_opn_client())
+        reset_opn_client()
+        self.assertIsNot(client, get_opn_client())
@@ -0,0 +1,311 @@
+import unittest
+
+import pyramid.testing
+from opnreco.testing import DBSessionFixture
+from sqlalchemy import event, func, text
+
+
+def setup_module():
+    global dbsession_fixture
+    dbsession_fixture = DBSessionFixture()
+
+
+def teardown_module():
+    dbsession_fixture.close()
+
+
+index_node_types = frozenset(
+    ["Index Scan", "Index Only Scan", "Bitmap Heap Scan", "Bitmap Index Scan"]
+)
+
+seed_sql = """
+insert into period (owner_id, file_id, start_date, end_date, start_circ,
+    start_surplus, end_circ, end_surplus, closed)
+select '102', 1239,
+    date '2018-01-01' + (n * interval '1 month'),
+    date '2018-01-01' + ((n + 1) * interval '1 month') - interval '1 day',
+    0, 0, case when n < 18 then 0 end, case when n < 18 then 0 end, n < 18
+from generate_series(0, 19) as n;
+
+insert into statement (owner_id, file_id, period_id, source)
+select '102', 1239, id, 'test' from period where file_id = 1239;
+
+insert into reco (owner_id, period_id, reco_type, internal)
+select '102', period.id, 'standard', false
+from period, generate_series(1, 20)
+where period.file_id = 1239;
+
+insert into transfer_record (owner_id, transfer_id, workflow_type, start,
+    currency, amount, timestamp, next_activity, completed, canceled)
+select '102', lpad(n::text, 16, '0'), 'redeem',
+    timestamp '2018-01-01' + n * interval '1 hour',
+    'USD', 1, timestamp '2018-01-01' + n * interval '1 hour',
+    'completed', true, false
+from generate_series(1, :row_count) as n;
+
+insert into movement (owner_id, transfer_record_id, number, amount_index,
+    loop_id, currency, issuer_id, from_id, to_id, amount, action, ts)
+select '102', id, 1, 0, '0', 'USD', '19', '19', '102', 1, 'test', start
+from transfer_record where owner_id = '102';
+
+create temporary table seed_period on commit drop as
+select id, row_number() over (order by id) - 1 as pos
+from period where file_id = 1239;
+
+insert into file_movement (owner_id, movement_id, file_id, peer_id, loop_id,
+    currency, issuer_id, transfer_record_id, ts, wallet_delta, vault_delta,
+    surplus_delta, period_id, reco_id)
+select m.owner_id, m.id, 1239, '19', m.loop_id, m.currency, m.issuer_id,
+    m.transfer_record_id, m.ts, 0, -1, 0, sp.id,
+    case when m.id % 50 <> 0 then (
+        select min(reco.id) from reco where reco.period_id = sp.id) end
+from movement m
+join seed_period sp on sp.pos = m.id % 20
+where m.owner_id = '102';
+
+insert into account_entry (owner_id, file_id, period_id, statement_id,
+    entry_date, loop_id, currency, delta, description, reco_id)
+select '102', 1239, sp.id,
+    (select statement.id from statement where statement.period_id = sp.id),
+    date '2018-01-01' + n, '0', 'USD', 1, 'Entry ' || n,
+    case when n % 50 <> 0 then (
+        select min(reco.id) from reco where reco.period_id = sp.id) end
+from generate_series(1, :row_count) as n
+join seed_period sp on sp.pos = n % 20;
+
+analyze period, reco, transfer_record, movement, file_movement, account_entry;
+"""
+
+
+class TestQueryPlans(unittest.TestCase):
+    """Check that the queries of unreconciled rows read through indexes.
+
+    The database is seeded with mostly reconciled rows, as in a file
+    that has been reconciled for a while.
+    """
+
+    row_count = 5000
+
+    def setUp(self):
+        self.config = pyramid.testing.setUp()
+        self.dbsession, self.close_session = dbsession_fixture.begin_session()
+        self.seed()
+
+    def tearDown(self):
+        self.close_session()
+        pyramid.testing.tearDown()
+
+    def seed(self):
+        from opnreco.models import db
+
+        dbsession = self.dbsession
+        self.owner = db.Owner(
+            id="102", title="Testy Owner", username="testowner", tzname="UTC"
+        )
+        dbsession.add(self.owner)
+        dbsession.flush()
+        dbsession.add(
+            db.File(
+                id=1239,
+                owner_id="102",
+                file_type="open_circ",
+                title="Test File",
+                currency="USD",
+                has_vault=True,
+            )
+        )
+        dbsession.flush()
+        dbsession.query(
+            func.set_config("opnreco.personal_id", "102", True),
+            func.set_config("opnreco.movement.event_type", "test", True),
+            func.set_config("opnreco.account_entry.event_type", "test", True),
+        ).one()
+
+        conn = dbsession.connection()
+        for statement in seed_sql.split(";"):
+            if statement.strip():
+                conn.execute(text(statement), {"row_count": self.row_count})
+
+        self.period = (
+            dbsession.query(db.Period)
+            .filter(db.Period.file_id == 1239, ~db.Period.closed)
+            .order_by(db.Period.id)
+            .first()
+        )
+
+    def get_plan_scans(self, run):
+        """Call run() and explain each SELECT and UPDATE statement it executes.
+
+        Return the set of (node type, relation name, index name) of the
+        scan nodes in the plans.
+        """
+        statements = []
+
+        def before_cursor_execute(
+            conn, cursor, statement, parameters, context, executemany
+        ):
+            if statement.lstrip().lower().startswith(("select", "with", "update")):
+                statements.append((statement, parameters))
+
+        conn = self.dbsession.connection()
+        event.listen(conn, "before_cursor_execute", before_cursor_execute)
+        try:
+            run()
+        finally:
+            event.remove(conn, "before_cursor_execute", before_cursor_execute)
+
+        res = set()
+
+        def walk(node, relation_name=None):
+            relation_name = node.get("Relation Name", relation_name)
+            if "Relation Name" in node or "Index Name" in node:
+                res.add((node["Node Type"], relation_name, node.get("Index Name")))
+            for child in node.get("Plans", ()):
+                # Bitmap index scans belong to the parent bitmap heap scan.
+                walk(
+                    child,
+                    relation_name if node["Node Type"] == "Bitmap Heap Scan" else None,
+                )
+
+        for statement, parameters in statements:
+            plan = conn.exec_driver_sql(
+                "explain (format json) " + statement, parameters
+            ).scalar()
+            walk(plan[0]["Plan"])
+        return res
+
+    def assertIndexScan(self, relation_name, scans):
+        """Assert that every scan of a table uses an index."""
+        node_types = set(
+            node_type
+            for (node_type, name, index_name) in scans
+            if name == relation_name
+        )
+        self.assertTrue(node_types, scans)
+        self.assertLessEqual(node_types, index_node_types, scans)
+
+    def assertUsesIndex(self, index_name, scans):
+        index_names = set(index_name for (node_type, name, index_name) in scans)
+        self.assertIn(index_name, index_names, scans)
+
+    def make_context(self):
+        from opnreco.models.site import PeriodResource
+
+        return PeriodResource(
+            parent=None,
+            name=str(self.period.id),
+            period=self.period,
+            file_archived=False,
+        )
+
+    def make_request(self, **kw):
+        return pyramid.testing.DummyRequest(
+            dbsession=self.dbsession, owner=self.owner, **kw
+        )
+
+    def test_transactions_api(self):
+        from opnreco.api.transactionsapi import transactions_api
+
+        scans = self.get_plan_scans(
+            lambda: transactions_api(
+                self.make_context(),
+                self.make_request(params={"offset": "0", "limit": "100"}),
+            )
+        )
+        self.assertIndexScan("file_movement", scans)
+        self.assertIndexScan("account_entry", scans)
+        self.assertUsesIndex("ix_file_movement_unreco_period", scans)
+        self.assertUsesIndex("ix_account_entry_unreco_period", scans)
+
+    def test_build_single_movement_query(self):
+        from opnreco.autorecostmt import build_single_movement_query
+
+        scans = self.get_plan_scans(
+            lambda: build_single_movement_query(
+                self.dbsession, self.owner, self.period
+            ).all()
+        )
+        self.assertIndexScan("file_movement", scans)
+
+    def test_build_bundle_query(self):
+        from opnreco.autorecostmt import build_bundle_query
+
+        scans = self.get_plan_scans(
+            lambda: self.dbsession.execute(
+                build_bundle_query(self.dbsession, self.owner, self.period)
+            ).all()
+        )
+        self.assertIndexScan("file_movement", scans)
+
+    def test_reco_search_movement(self):
+        from opnreco.api.recoapi import reco_search_movement
+
+        request = self.make_request(json={"amount": "1"})
+        scans = self.get_plan_scans(
+            lambda: reco_search_movement(self.make_context(), request)
+        )
+        self.assertIndexScan("file_movement", scans)
+
+    def test_reco_search_account_entries(self):
+        from opnreco.api.recoapi import reco_search_account_entries
+
+        request = self.make_request(json={"delta": "1"})
+        scans = self.get_plan_scans(
+            lambda: reco_search_account_entries(self.make_context(), request)
+        )
+        self.assertIndexScan("account_entry", scans)
+
+    def test_recompute_period_totals(self):
+        from opnreco.viewcommon import recompute_period_totals
+
+        scans = self.get_plan_scans(
+            lambda: recompute_period_totals(
+                dbsession=self.dbsession, owner_id="102", period_ids=[self.period.id]
+            )
+        )
+        self.assertIndexScan("file_movement", scans)
+        self.assertIndexScan("account_entry", scans)
+        self.assertUsesIndex("ix_file_movement_unreco_period", scans)
+        self.assertUsesIndex("ix_account_entry_unreco_period", scans)
+
+    def test_reco_search_movement_transfer_trgm(self):
+        from opnreco.api.recoapi import reco_search_movement
+        from opnreco.textsearch import trgm_enabled
+
+        if not trgm_enabled(self.dbsession):
+            self.skipTest("pg_trgm is not available")
+        request = self.make_request(json={"transfer": "00001234"})
+        scans = self.get_plan_scans(
+            lambda: reco_search_movement(self.make_context(), request)
+        )
+        self.assertUsesIndex("ix_transfer_record_transfer_id_trgm", scans)
+
+    def test_reco_search_movement_amount(self):
+        from opnreco.api.recoapi import reco_search_movement
+
+        request = self.make_request(json={"amount": "25"})
+        scans = self.get_plan_scans(
+            lambda: reco_search_movement(self.make_context(), request)
+        )
+        self.assertIndexScan("file_movement", scans)
+        self.assertUsesIndex("ix_file_movement_abs_vault_delta", scans)
+        self.assertUsesIndex("ix_file_movement_abs_wallet_delta", scans)
+
+    def test_reco_search_account_entries_amount(self):
+        from opnreco.api.recoapi import reco_search_account_entries
+
+        request = self.make_request(json={"delta": "25.00"})
+        scans = self.get_plan_scans(
+            lambda: reco_search_account_entries(self.make_context(), request)
+        )
+        self.assertIndexScan("account_entry", scans)
+        self.assertUsesIndex("ix_account_entry_abs_delta", scans)
+
+    def test_pull_unreco_movements(self):
+        from opnreco.reassign import MovementReassignOp, pull_unreco
+
+        request = self.make_request(personal_id="102")
+        scans = self.get_plan_scans(
+            lambda: pull_unreco(request, self.period, MovementReassignOp())
+        )
+        self.assertUsesIndex("ix_file_movement_local_date", scans)
@@ -0,0 +1,490 @@
+import datetime
+import unittest
+from decimal import Decimal
+
+import pyramid.testing
+from opnreco.testing import DBSessionFixture
+
+
+def setup_module():
+    global dbsession_fixture
+    dbsession_fixture = DBSessionFixture()
+
+
+def teardown_module():
+    dbsession_fixture.close()
+
+
+class ReassignTestBase:
+    def setUp(self):
+        self.config = pyramid.testing.setUp()
+        self.dbsession, self.close_session = dbsession_fixture.begin_session()
+
+    def tearDown(self):
+        self.close_session()
+        pyramid.testing.tearDown()
+
+    def add_file(self, periods):
+        """Add a file and its periods.
+
+        periods is [(start_date, end_date, closed)].
+        """
+        from opnreco.models import db
+        from sqlalchemy import func
+
+        dbsession = self.dbsession
+        self.owner = db.Owner(
+            id="102", title="Testy Owner", username="testowner", tzname="UTC"
+        )
+        dbsession.add(self.owner)
+        dbsession.flush()
+        dbsession.add(
+            db.File(
+                id=1239,
+                owner_id="102",
+                file_type="open_circ",
+                title="Test File",
+                currency="USD",
+                has_vault=True,
+            )
+        )
+        dbsession.flush()
+
+        dbsession.query(
+            func.set_config("opnreco.personal_id", "102", True),
+            func.set_config("opnreco.movement.event_type", "test", True),
+            func.set_config("opnreco.account_entry.event_type", "test", True),
+        ).one()
+
+        self.periods = []
+        for start_date, end_date, closed in periods:
+            p = db.Period(
+                owner_id="102",
+                file_id=1239,
+                start_date=start_date,
+                end_date=end_date,
+                closed=closed,
+                end_circ=0 if closed else None,
+                end_surplus=0 if closed else None,
+            )
+            dbsession.add(p)
+            dbsession.flush()
+            self.periods.append(p)
+
+        self.statement = db.Statement(
+            owner_id="102", file_id=1239, period_id=self.periods[0].id, source="test"
+        )
+        dbsession.add(self.statement)
+        dbsession.flush()
+
+    def add_account_entry(self, period, entry_date, reco=None):
+        from opnreco.models import db
+
+        e = db.AccountEntry(
+            owner_id="102",
+            file_id=1239,
+            period_id=period.id,
+            statement_id=self.statement.id,
+            entry_date=entry_date,
+            loop_id="0",
+            currency="USD",
+            delta=Decimal("1.00"),
+            description="Test entry",
+            reco_id=reco.id if reco is not None else None,
+        )
+        self.dbsession.add(e)
+        self.dbsession.flush()
+        return e
+
+    def add_file_movement(self, period, ts):
+        from opnreco.models import db
+
+        dbsession = self.dbsession
+        record = db.TransferRecord(
+            owner_id="102",
+            transfer_id=ts.strftime("%Y%m%d%H%M%S"),
+            workflow_type="redeem",
+            start=ts,
+            currency="USD",
+            amount=Decimal("1.00"),
+            timestamp=ts,
+            next_activity="completed",
+            completed=True,
+            canceled=False,
+        )
+        dbsession.add(record)
+        dbsession.flush()
+        m = db.Movement(
+            owner_id="102",
+            transfer_record_id=record.id,
+            number=1,
+            amount_index=0,
+            loop_id="0",
+            currency="USD",
+            issuer_id="19",
+            from_id="19",
+            to_id="102",
+            amount=Decimal("1.00"),
+            action="test",
+            ts=ts,
+        )
+        dbsession.add(m)
+        dbsession.flush()
+        fm = db.FileMovement(
+            owner_id="102",
+            movement_id=m.id,
+            file_id=1239,
+            peer_id="19",
+            loop_id=m.loop_id,
+            currency=m.currency,
+            issuer_id=m.issuer_id,
+            transfer_record_id=m.transfer_record_id,
+            ts=m.ts,
+            wallet_delta=0,
+            vault_delta=Decimal("-1.00"),
+            surplus_delta=0,
+            period_id=period.id,
+        )
+        dbsession.add(fm)
+        dbsession.flush()
+        return fm
+
+    def add_reco(self, period):
+        from opnreco.models import db
+
+        reco = db.Reco(
+            owner_id="102", period_id=period.id, reco_type="standard", internal=False
+        )
+        self.dbsession.add(reco)
+        self.dbsession.flush()
+        return reco
+
+    def make_request(self):
+        request = pyramid.testing.DummyRequest()
+        request.dbsession = self.dbsession
+        request.owner = self.owner
+        request.personal_id = "102"
+        return request
+
+    def get_logs(self, event_type):
+        from opnreco.models import db
+
+        return [
+            row.content
+            for row in self.dbsession.query(db.OwnerLog)
+            .filter(db.OwnerLog.event_type == event_type)
+            .order_by(db.OwnerLog.id)
+        ]
+
+
+class Test_push_unreco(ReassignTestBase, unittest.TestCase):
+    def _call(self, period, op):
+        from ..reassign import push_unreco
+
+        return push_unreco(request=self.make_request(), period=period, op=op)
+
+    def test_push_account_entries(self):
+        from opnreco.models import db
+        from sqlalchemy import event
+
+        from ..reassign import AccountEntryReassignOp
+
+        self.add_file(
+            [
+                (datetime.date(2018, 1, 1), datetime.date(2018, 1, 31), False),
+                (None, datetime.date(2017, 12, 31), False),
+                (datetime.date(2018, 2, 1), None, False),
+            ]
+        )
+        period, prev_period, next_period = self.periods
+        reco = db.Reco(
+            owner_id="102", period_id=period.id, reco_type="standard", internal=False
+        )
+        self.dbsession.add(reco)
+        self.dbsession.flush()
+
+        e_dec = self.add_account_entry(period, datetime.date(2017, 12, 15))
+        e_jan = self.add_account_entry(period, datetime.date(2018, 1, 10))
+        e_feb = self.add_account_entry(period, datetime.date(2018, 2, 3))
+        e_reco = self.add_account_entry(period, datetime.date(2018, 1, 11), reco=reco)
+
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        conn = self.dbsession.connection()
+        event.listen(conn, "before_cursor_execute", before_cursor_execute)
+        try:
+            count = self._call(period, AccountEntryReassignOp())
+        finally:
+            event.remove(conn, "before_cursor_execute", before_cursor_execute)
+
+        self.assertEqual(3, count)
+        # One statement checks for missing periods and one reassigns.
+        self.assertEqual(2, len(statements))
+        self.assertEqual(prev_period.id, e_dec.period_id)
+        # January now has no open period, so it goes to the endless period.
+        self.assertEqual(next_period.id, e_jan.period_id)
+        self.assertEqual(next_period.id, e_feb.period_id)
+        self.assertEqual(period.id, e_reco.period_id)
+
+        (log,) = self.get_logs("push_unreco_account_entries")
+        self.assertEqual(
+            sorted(str(e.id) for e in (e_dec, e_jan, e_feb)),
+            sorted(str(item_id) for item_id in log["item_ids"]),
+        )
+        self.assertEqual(
+            [
+                ["2017-12-15", prev_period.id],
+                ["2018-01-10", next_period.id],
+                ["2018-02-03", next_period.id],
+            ],
+            log["day_periods"],
+        )
+        self.assertIsNone(log["new_period_id"])
+
+    def test_push_movements_to_new_period(self):
+        from opnreco.models import db
+
+        from ..reassign import MovementReassignOp
+
+        self.add_file(
+            [
+                (datetime.date(2018, 1, 1), datetime.date(2018, 1, 31), False),
+                (None, datetime.date(2017, 12, 31), False),
+            ]
+        )
+        period, prev_period = self.periods
+        fm_dec = self.add_file_movement(period, datetime.datetime(2017, 12, 15, 6))
+        fm_jan = self.add_file_movement(period, datetime.datetime(2018, 1, 10, 6))
+
+        count = self._call(period, MovementReassignOp())
+
+        self.assertEqual(2, count)
+        self.assertEqual(prev_period.id, fm_dec.period_id)
+        new_period = (
+            self.dbsession.query(db.Period)
+            .filter(db.Period.id.notin_([p.id for p in self.periods]))
+            .one()
+        )
+        self.assertEqual(datetime.date(2018, 2, 1), new_period.start_date)
+        self.assertIsNone(new_period.end_date)
+        self.assertEqual(new_period.id, fm_jan.period_id)
+
+        (log,) = self.get_logs("push_unreco_movements")
+        self.assertEqual(new_period.id, log["new_period_id"])
+
+    def test_nothing_to_push(self):
+        from ..reassign import AccountEntryReassignOp
+
+        self.add_file([(datetime.date(2018, 1, 1), datetime.date(2018, 1, 31), False)])
+        self.assertEqual(0, self._call(self.periods[0], AccountEntryReassignOp()))
+        self.assertEqual([], self.get_logs("push_unreco_account_entries"))
+        self.assertEqual(
+            [], self.get_logs("add_period_for_push_unreco_account_entries")
+        )
+
+
+class Test_pull_unreco(ReassignTestBase, unittest.TestCase):
+    def _call(self, period, op):
+        from ..reassign import pull_unreco
+
+        return pull_unreco(request=self.make_request(), period=period, op=op)
+
+    def test_pull_account_entries(self):
+        from ..reassign import AccountEntryReassignOp
+
+        self.add_file(
+            [
+                (datetime.date(2018, 1, 1), datetime.date(2018, 1, 31), False),
+                (datetime.date(2018, 2, 1), None, False),
+                (datetime.date(2017, 1, 1), datetime.date(2017, 12, 31), True),
+            ]
+        )
+        period, open_period, closed_period = self.periods
+        e_in = self.add_account_entry(open_period, datetime.date(2018, 1, 10))
+        e_first = self.add_account_entry(open_period, datetime.date(2018, 1, 1))
+        e_after = self.add_account_entry(open_period, datetime.date(2018, 2, 1))
+        e_closed = self.add_account_entry(closed_period, datetime.date(2018, 1, 12))
+
+        count = self._call(period, AccountEntryReassignOp())
+
+        self.assertEqual(2, count)
+        self.assertEqual(period.id, e_in.period_id)
+        self.assertEqual(period.id, e_first.period_id)
+        self.assertEqual(open_period.id, e_after.period_id)
+        self.assertEqual(closed_period.id, e_closed.period_id)
+
+        (log,) = self.get_logs("pull_unreco_account_entries")
+        self.assertEqual(
+            [["2018-01-01", period.id], ["2018-01-10", period.id]],
+            log["day_periods"],
+        )
+
+    def test_pull_movements_into_endless_period(self):
+        from ..reassign import MovementReassignOp
+
+        self.add_file(
+            [
+                (datetime.date(2018, 1, 1), None, False),
+                (None, datetime.date(2017, 12, 31), False),
+            ]
+        )
+        period, prev_period = self.periods
+        fm_dec = self.add_file_movement(prev_period, datetime.datetime(2017, 12, 15, 6))
+        fm_jan = self.add_file_movement(prev_period, datetime.datetime(2018, 1, 10, 6))
+
+        count = self._call(period, MovementReassignOp())
+
+        self.assertEqual(1, count)
+        self.assertEqual(prev_period.id, fm_dec.period_id)
+        self.assertEqual(period.id, fm_jan.period_id)
+
+
+class Test_pull_recos(ReassignTestBase, unittest.TestCase):
+    def _call(self, period):
+        from ..reassign import pull_recos
+
+        return pull_recos(request=self.make_request(), period=period)
+
+    def test_pull_recos_by_date(self):
+        self.add_file(
+            [
+                (datetime.date(2018, 1, 1), datetime.date(2018, 1, 31), False),
+                (datetime.date(2018, 2, 1), None, False),
+            ]
+        )
+        period, next_period = self.periods
+        reco_in = self.add_reco(next_period)
+        e_in = self.add_account_entry(
+            next_period, datetime.date(2018, 1, 20), reco=reco_in
+        )
+        reco_out = self.add_reco(next_period)
+        self.add_account_entry(next_period, datetime.date(2018, 2, 20), reco=reco_out)
+        # A reco with no entries or movements has no date, so it stays.
+        reco_empty = self.add_reco(next_period)
+
+        self.assertEqual(1, self._call(period))
+        self.assertEqual(period.id, reco_in.period_id)
+        self.assertEqual(period.id, e_in.period_id)
+        self.assertEqual(next_period.id, reco_out.period_id)
+        self.assertEqual(next_period.id, reco_empty.period_id)
+
+        (log,) = self.get_logs("pull_recos")
+        self.assertEqual([["2018-01-20", period.id]], log["day_periods"])
+
+
+class Test_push_recos(ReassignTestBase, unittest.TestCase):
+    def _call(self, period):
+        from ..reassign import push_recos
+
+        return push_recos(request=self.make_request(), period=period)
+
+    def test_push_recos_to_other_periods(self):
+        from opnreco.models import db
+
+        self.add_file(
+            [
+                (datetime.date(2018, 1, 1), datetime.date(2018, 1, 31), False),
+                (None, datetime.date(2017, 12, 31), False),
+            ]
+        )
+        period, prev_period = self.periods
+        reco_dec = self.add_reco(period)
+        e_dec = self.add_account_entry(
+            period, datetime.date(2017, 12, 20), reco=reco_dec
+        )
+        reco_jan = self.add_reco(period)
+        fm_jan = self.add_file_movement(period, datetime.datetime(2018, 1, 10, 6))
+        fm_jan.reco_id = reco_jan.id
+        reco_empty = self.add_reco(period)
+        self.dbsession.flush()
+
+        self.assertEqual(3, self._call(period))
+
+        new_period = (
+            self.dbsession.query(db.Period)
+            .filter(db.Period.id.notin_([p.id for p in self.periods]))
+            .one()
+        )
+        self.assertEqual(prev_period.id, reco_dec.period_id)
+        self.assertEqual(prev_period.id, e_dec.period_id)
+        self.assertEqual(new_period.id, reco_jan.period_id)
+        self.assertEqual(new_period.id, fm_jan.period_id)
+        self.assertEqual(new_period.id, reco_empty.period_id)
+
+        (log,) = self.get_logs("push_recos")
+        self.assertEqual(new_period.id, log["new_period_id"])
+
+
+class TestPeriodDateRange(ReassignTestBase, unittest.TestCase):
+    def test_date_range_follows_dates(self):
+        from psycopg2.extras import DateRange
+
+        self.add_file([(datetime.date(2018, 1, 1), datetime.date(2018, 1, 31), False)])
+        (period,) = self.periods
+        self.dbsession.refresh(period)
+        self.assertEqual(
+            DateRange(datetime.date(2018, 1, 1), datetime.date(2018, 2, 1), "[)"),
+            period.date_range,
+        )
+
+        period.end_date = None
+        self.dbsession.flush()
+        self.dbsession.refresh(period)
+        self.assertEqual(
+            DateRange(datetime.date(2018, 1, 1), None, "[)"), period.date_range
+        )
+
+    def test_exclusion_constraint_rejects_overlap(self):
+        from opnreco.models import db
+        from sqlalchemy.exc import IntegrityError
+
+        self.add_file([(datetime.date(2018, 1, 1), datetime.date(2018, 1, 31), False)])
+        savepoint = self.dbsession.begin_nested()
+        self.dbsession.add(
+            db.Period(
+                owner_id="102",
+                file_id=1239,
+                start_date=datetime.date(2018, 1, 31),
+                end_date=datetime.date(2018, 2, 28),
+            )
+        )
+        with self.assertRaises(IntegrityError) as cm:
+            self.dbsession.flush()
+        savepoint.rollback()
+        self.assertEqual("23P01", cm.exception.orig.pgcode)
+
+    def test_exclusion_constraint_allows_adjacent_periods_and_other_files(self):
+        from opnreco.models import db
+
+        self.add_file([(datetime.date(2018, 1, 1), datetime.date(2018, 1, 31), False)])
+        self.dbsession.add(
+            db.File(
+                id=1240,
+                owner_id="102",
+                file_type="open_circ",
+                title="Other File",
+                currency="USD",
+                has_vault=True,
+            )
+        )
+        self.dbsession.flush()
+        self.dbsession.add_all(
+            [
+                db.Period(
+                    owner_id="102",
+                    file_id=1239,
+                    start_date=datetime.date(2018, 2, 1),
+                    end_date=None,
+                ),
+                db.Period(
+                    owner_id="102",
+                    file_id=1240,
+                    start_date=datetime.date(2018, 1, 1),
+                    end_date=datetime.date(2018, 1, 31),
+                ),
+            ]
+        )
+        self.dbsession.flush()
@@ -0,0 +1,48 @@
+import collections
+import datetime
+import unittest
+from decimal import Decimal
+
+import pyramid.testing
+
+
+class TestCustomJSONRenderer(unittest.TestCase):
+    def _call(self, value, **params):
+        from ..render import CustomJSONRenderer
+
+        request = pyramid.testing.DummyRequest(params=params)
+        res = CustomJSONRenderer(None)(value, {"request": request})
+        return res, request
+
+    def test_compact_by_default(self):
+        from colander import null
+
+        counts = collections.defaultdict(int)
+        counts["x"] += 1
+        res, request = self._call(
+            {
+                "b": Decimal("1.50"),
+                "a": datetime.datetime(2018, 8, 1, 4, 5, 6),
+                "d": datetime.date(2018, 8, 2),
+                "n": null,
+                "c": counts,
+            }
+        )
+        self.assertEqual(
+            '{"b":"1.50","a":"2018-08-01T04:05:06Z","d":"2018-08-02",'
+            '"n":null,"c":{"x":1}}',
+            res,
+        )
+        self.assertEqual("application/json", request.response.content_type)
+
+    def test_pretty(self):
+        res, request = self._call({"b": Decimal("1.50"), "a": [1]}, pretty="true")
+        self.assertEqual('{\n  "a": [\n    1\n  ], \n  "b": "1.50"\n}', res)
+
+    def test_pretty_false(self):
+        res, request = self._call({"a": 1}, pretty="false")
+        self.assertEqual('{"a":1}', res)
+
+    def test_unsupported_type(self):
+        with self.assertRaises(TypeError):
+            self._call({"a": object()})
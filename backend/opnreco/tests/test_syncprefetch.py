@@ -0,0 +1,304 @@
+import http.server
+import json
+import os
+import threading
+import time
+import unittest
+import urllib.parse
+
+import pyramid.testing
+from opnreco.testing import DBSessionFixture
+
+
+def setup_module():
+    global dbsession_fixture
+    dbsession_fixture = DBSessionFixture()
+
+
+def teardown_module():
+    dbsession_fixture.close()
+
+
+def make_transfer_result(transfer_id):
+    return {
+        "id": transfer_id,
+        "workflow_type": "grant",
+        "start": "2018-08-01T04:05:06Z",
+        "currency": "USD",
+        "amount": "1.00",
+        "timestamp": "2018-08-01T04:05:08Z",
+        "next_activity": "completed",
+        "completed": True,
+        "canceled": False,
+        "sender_id": "19",
+        "sender_uid": "wingcash:19",
+        "sender_info": {"title": "Issuer"},
+        "recipient_id": "11",
+        "recipient_uid": "wingcash:11",
+        "recipient_info": {"title": "Tester"},
+        "movements": [
+            {
+                "number": 1,
+                "timestamp": "2018-08-02T05:06:06Z",
+                "action": "grant",
+                "from_id": "19",
+                "to_id": "11",
+                "loops": [
+                    {
+                        "currency": "USD",
+                        "loop_id": "0",
+                        "amount": "1.00",
+                        "issuer_id": "19",
+                    }
+                ],
+            },
+        ],
+    }
+
+
+class StubOPNServer:
+    """Serve /wallet/history_sync pages from a local HTTP server.
+
+    pages maps the transfer_id parameter of a request ("" for the first
+    request) to the response body.
+    """
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.posts = []
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/wallet/info":
+                    self.send_json({"profile": {"accounts": []}})
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                length = int(self.headers["Content-Length"] or 0)
+                params = urllib.parse.parse_qs(self.rfile.read(length).decode("utf-8"))
+                params = {k: v[0] for k, v in params.items()}
+                stub.posts.append(params)
+                page = stub.pages.get(params.get("transfer_id", ""))
+                if self.path != "/wallet/history_sync" or page is None:
+                    self.send_error(404)
+                else:
+                    self.send_json(page)
+
+            def send_json(self, data):
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:%d" % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
+two_pages = {
+    "": {
+        "results": [make_transfer_result("501")],
+        "more": True,
+        "first_sync_ts": "2018-08-01T04:05:10Z",
+        "last_sync_ts": "2018-08-01T04:05:11Z",
+        "remain": 1,
+    },
+    "501": {
+        "results": [make_transfer_result("502")],
+        "more": False,
+        "first_sync_ts": "2018-08-01T04:05:10Z",
+        "last_sync_ts": "2018-08-01T04:05:12Z",
+    },
+}
+
+
+class TestHistoryPrefetcher(unittest.TestCase):
+    def _class(self):
+        from ..syncprefetch import HistoryPrefetcher
+
+        return HistoryPrefetcher
+
+    def _make_cursor(self, sync_transfer_id=None, count_remain=True):
+        from ..syncprefetch import SyncCursor
+
+        return SyncCursor(
+            sync_ts_iso="1970-01-01T00:00:00Z",
+            sync_transfer_id=sync_transfer_id,
+            count_remain=count_remain,
+        )
+
+    def test_follows_cursor_until_done(self):
+        from ..syncprefetch import SyncCursor
+
+        calls = []
+
+        def download(*cursor):
+            calls.append(cursor)
+            return two_pages[cursor[1] or ""]
+
+        with self._class()(download, self._make_cursor()) as prefetcher:
+            batches = list(prefetcher)
+
+        self.assertEqual(2, len(batches))
+        self.assertEqual(self._make_cursor(), batches[0].cursor)
+        self.assertEqual(
+            SyncCursor("2018-08-01T04:05:11Z", "501", False), batches[1].cursor
+        )
+        self.assertEqual(
+            ["502"], [r["id"] for r in batches[1].transfers_download["results"]]
+        )
+        self.assertEqual(list(calls), [tuple(b.cursor) for b in batches])
+
+    def test_queue_depth_is_bounded(self):
+        calls = []
+        started = threading.Event()
+
+        def download(*cursor):
+            calls.append(cursor)
+            if len(calls) >= 2:
+                started.set()
+            n = len(calls)
+            return {
+                "results": [{"id": str(n)}],
+                "more": True,
+                "last_sync_ts": "2018-08-01T04:05:11Z",
+            }
+
+        prefetcher = self._class()(download, self._make_cursor(), depth=1)
+        prefetcher.poll_timeout = 0.01
+        with prefetcher:
+            self.assertTrue(started.wait(5))
+            time.sleep(0.1)
+            # One batch waits in the queue and one waits to be queued.
+            self.assertEqual(2, len(calls))
+            next(iter(prefetcher))
+            deadline = time.time() + 5
+            while len(calls) < 3 and time.time() < deadline:
+                time.sleep(0.01)
+            time.sleep(0.1)
+            self.assertEqual(3, len(calls))
+
+        self.assertFalse(prefetcher.thread.is_alive())
+
+    def test_download_error_propagates(self):
+        def download(*cursor):
+            raise ValueError("OPN is down")
+
+        with self._class()(download, self._make_cursor()) as prefetcher:
+            with self.assertRaisesRegex(ValueError, "OPN is down"):
+                list(prefetcher)
+
+    def test_invalid_depth(self):
+        with self.assertRaises(ValueError):
+            self._class()(lambda *cursor: {}, self._make_cursor(), depth=0)
+
+
+class TestSyncWorkerWithPrefetch(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubOPNServer(two_pages)
+        os.environ["opn_api_url"] = self.stub.url
+        self.config = pyramid.testing.setUp()
+        self.dbsession, self.close_session = dbsession_fixture.begin_session()
+
+    def tearDown(self):
+        self.close_session()
+        pyramid.testing.tearDown()
+        self.stub.close()
+
+    def _make(self):
+        from ..syncworker import SyncWorker
+
+        return SyncWorker(dbsession_factory=None, poll_interval=0)
+
+    def add_job(self):
+        from opnreco.models.db import File, Owner, SyncJob
+
+        dbsession = self.dbsession
+        dbsession.add(Owner(id="11", title="Test Profile", username="testy"))
+        dbsession.flush()
+        dbsession.add(
+            File(
+                id=1239,
+                owner_id="11",
+                file_type="open_circ",
+                title="Test File",
+                currency="USD",
+                has_vault=True,
+                auto_enable_loops=False,
+            )
+        )
+        job = SyncJob(
+            owner_id="11",
+            state="queued",
+            personal_id="12",
+            access_token="example-token",
+        )
+        dbsession.add(job)
+        dbsession.flush()
+        return job
+
+    def make_prefetcher(self, job):
+        from opnreco.api.syncapi import SyncAPI
+        from opnreco.models.db import Owner
+
+        from ..syncprefetch import HistoryPrefetcher
+        from ..syncworker import SyncJobRequest
+
+        owner = self.dbsession.query(Owner).filter(Owner.id == job.owner_id).one()
+        api = SyncAPI(SyncJobRequest(self.dbsession, job, owner))
+        return HistoryPrefetcher(api.download_batch, api.get_sync_cursor())
+
+    def test_import_prefetched_batches(self):
+        from opnreco.models import db
+
+        job = self.add_job()
+        obj = self._make()
+
+        with self.make_prefetcher(job) as prefetcher:
+            for prefetched in prefetcher:
+                obj.run_job_batch(self.dbsession, job, prefetched=prefetched)
+
+        self.assertEqual("done", job.state)
+        self.assertEqual(2, job.download_count)
+        self.assertEqual(
+            ["", "501"], [params.get("transfer_id", "") for params in self.stub.posts]
+        )
+        self.assertEqual("true", self.stub.posts[0]["count_remain"])
+        self.assertNotIn("count_remain", self.stub.posts[1])
+        self.assertEqual("2018-08-01T04:05:11Z", self.stub.posts[1]["sync_ts"])
+
+        records = self.dbsession.query(db.TransferRecord).all()
+        self.assertEqual({"501", "502"}, {r.transfer_id for r in records})
+
+    def test_stale_prefetch_is_rejected(self):
+        from opnreco.models import db
+
+        from ..syncprefetch import StalePrefetch
+
+        job = self.add_job()
+        obj = self._make()
+
+        with self.make_prefetcher(job) as prefetcher:
+            batches = list(prefetcher)
+
+        # Import the first batch, then offer it again.
+        obj.run_job_batch(self.dbsession, job, prefetched=batches[0])
+        with self.assertRaises(StalePrefetch):
+            obj.run_job_batch(self.dbsession, job, prefetched=batches[0])
+
+        self.assertEqual(1, job.download_count)
+        records = self.dbsession.query(db.TransferRecord).all()
+        self.assertEqual({"501"}, {r.transfer_id for r in records})
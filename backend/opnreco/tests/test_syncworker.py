@@ -0,0 +1,191 @@
+import os
+import unittest
+
+import pyramid.testing
+import responses
+from opnreco.testing import DBSessionFixture
+
+
+def setup_module():
+    global dbsession_fixture
+    dbsession_fixture = DBSessionFixture()
+
+
+def teardown_module():
+    dbsession_fixture.close()
+
+
+def make_transfer_result(transfer_id):
+    return {
+        "id": transfer_id,
+        "workflow_type": "grant",
+        "start": "2018-08-01T04:05:06Z",
+        "currency": "USD",
+        "amount": "1.00",
+        "timestamp": "2018-08-01T04:05:08Z",
+        "next_activity": "completed",
+        "completed": True,
+        "canceled": False,
+        "sender_id": "19",
+        "sender_uid": "wingcash:19",
+        "sender_info": {"title": "Issuer"},
+        "recipient_id": "11",
+        "recipient_uid": "wingcash:11",
+        "recipient_info": {"title": "Tester"},
+        "movements": [
+            {
+                "number": 1,
+                "timestamp": "2018-08-02T05:06:06Z",
+                "action": "grant",
+                "from_id": "19",
+                "to_id": "11",
+                "loops": [
+                    {
+                        "currency": "USD",
+                        "loop_id": "0",
+                        "amount": "1.00",
+                        "issuer_id": "19",
+                    }
+                ],
+            },
+        ],
+    }
+
+
+class TestSyncWorker(unittest.TestCase):
+    def setUp(self):
+        os.environ["opn_api_url"] = "https://opn.example.com:9999"
+        self.config = pyramid.testing.setUp()
+        self.dbsession, self.close_session = dbsession_fixture.begin_session()
+
+    def tearDown(self):
+        self.close_session()
+        pyramid.testing.tearDown()
+
+    def _make(self):
+        from ..syncworker import SyncWorker
+
+        return SyncWorker(dbsession_factory=None, poll_interval=0)
+
+    def add_job(self):
+        from opnreco.models.db import File, Owner, SyncJob
+
+        dbsession = self.dbsession
+        dbsession.add(Owner(id="11", title="Test Profile", username="testy"))
+        dbsession.flush()
+        dbsession.add(
+            File(
+                id=1239,
+                owner_id="11",
+                file_type="open_circ",
+                title="Test File",
+                currency="USD",
+                has_vault=True,
+                auto_enable_loops=False,
+            )
+        )
+        job = SyncJob(
+            owner_id="11",
+            state="queued",
+            personal_id="12",
+            access_token="example-token",
+        )
+        dbsession.add(job)
+        dbsession.flush()
+        return job
+
+    def add_wallet_info_response(self, rsps):
+        rsps.add(
+            responses.GET,
+            "https://opn.example.com:9999/wallet/info",
+            json={"profile": {"accounts": []}},
+        )
+
+    def test_claim_job_with_empty_queue(self):
+        obj = self._make()
+        self.assertIsNone(obj.claim_job(self.dbsession))
+
+    def test_run_job_in_batches(self):
+        from opnreco.models import db
+
+        self.add_job()
+        obj = self._make()
+
+        with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+            self.add_wallet_info_response(rsps)
+            rsps.add(
+                responses.POST,
+                "https://opn.example.com:9999/wallet/history_sync",
+                json={
+                    "results": [make_transfer_result("501")],
+                    "more": True,
+                    "first_sync_ts": "2018-08-01T04:05:10Z",
+                    "last_sync_ts": "2018-08-01T04:05:11Z",
+                    "remain": 1,
+                },
+            )
+            job = obj.claim_job(self.dbsession)
+            obj.run_job_batch(self.dbsession, job)
+
+        self.assertEqual("running", job.state)
+        self.assertEqual(50, job.progress_percent)
+        self.assertEqual(1, job.download_count)
+        self.assertEqual("example-token", job.access_token)
+
+        owner = self.dbsession.query(db.Owner).one()
+        self.assertEqual("501", owner.last_sync_transfer_id)
+
+        # The next batch resumes from the owner's sync cursor.
+        with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+            self.add_wallet_info_response(rsps)
+            rsps.add(
+                responses.POST,
+                "https://opn.example.com:9999/wallet/history_sync",
+                json={
+                    "results": [make_transfer_result("502")],
+                    "more": False,
+                    "first_sync_ts": "2018-08-01T04:05:10Z",
+                    "last_sync_ts": "2018-08-01T04:05:12Z",
+                },
+            )
+            job = obj.claim_job(self.dbsession)
+            obj.run_job_batch(self.dbsession, job)
+            bodies = [
+                call.request.body
+                for call in rsps.calls
+                if call.request.method == "POST"
+            ]
+
+        self.assertEqual(1, len(bodies))
+        self.assertIn("transfer_id=501", bodies[0])
+        self.assertEqual("done", job.state)
+        self.assertEqual(100, job.progress_percent)
+        self.assertEqual(2, job.download_count)
+        self.assertIsNone(job.access_token)
+        self.assertIsNone(obj.claim_job(self.dbsession))
+
+        records = self.dbsession.query(db.TransferRecord).all()
+        self.assertEqual({"501", "502"}, {r.transfer_id for r in records})
+
+    def test_fail_job(self):
+        from opnreco.syncbase import VerificationFailure
+
+        job = self.add_job()
+        obj = self._make()
+        obj.fail_job(
+            self.dbsession, job.id, VerificationFailure("Changed", transfer_id="501")
+        )
+        self.assertEqual("failed", job.state)
+        self.assertEqual("verification_failure", job.error_type)
+        self.assertEqual("Changed", job.error_description)
+        self.assertIsNone(job.access_token)
+        self.assertIsNone(obj.claim_job(self.dbsession))
+
+    def test_finished_job_cannot_keep_token(self):
+        from sqlalchemy.exc import IntegrityError
+
+        job = self.add_job()
+        job.state = "done"
+        with self.assertRaises(IntegrityError) as cm:
+            self.dbsession.flush()
+        self.assertIn("ck_sync_job_finished_without_token", str(cm.exception))
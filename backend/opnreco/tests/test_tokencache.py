@@ -0,0 +1,204 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+
+class TokenCacheTests:
+    def _make(self, max_size=3, ttl=60):
+        raise NotImplementedError
+
+    def test_get_and_set(self):
+        obj = self._make()
+        self.assertIsNone(obj.get("abc"))
+        obj.set("abc", {"id": "11", "wallet_info": {"profile": {"id": "11"}}})
+        self.assertEqual(
+            {"id": "11", "wallet_info": {"profile": {"id": "11"}}}, obj.get("abc")
+        )
+        self.assertEqual(
+            {"hits": 1, "misses": 1, "evictions": 0, "size": 1}, obj.get_stats()
+        )
+
+    def test_evicts_least_recently_used(self):
+        obj = self._make(max_size=2)
+        with mock.patch("time.time", return_value=1000.0):
+            obj.set("a", {"id": "1"})
+        with mock.patch("time.time", return_value=1001.0):
+            obj.set("b", {"id": "2"})
+        with mock.patch("time.time", return_value=1002.0):
+            # Use "a" so "b" becomes the least recently used.
+            self.assertEqual({"id": "1"}, obj.get("a"))
+        with mock.patch("time.time", return_value=1003.0):
+            obj.set("c", {"id": "3"})
+            self.assertIsNone(obj.get("b"))
+            self.assertEqual({"id": "1"}, obj.get("a"))
+            self.assertEqual({"id": "3"}, obj.get("c"))
+        self.assertEqual(1, obj.get_stats()["evictions"])
+        self.assertEqual(2, len(obj))
+
+    def test_entries_expire(self):
+        obj = self._make(ttl=60)
+        with mock.patch("time.time", return_value=1000.0):
+            obj.set("a", {"id": "1"})
+        with mock.patch("time.time", return_value=1059.0):
+            self.assertEqual({"id": "1"}, obj.get("a"))
+        with mock.patch("time.time", return_value=1060.0):
+            self.assertIsNone(obj.get("a"))
+
+    def test_add_seen(self):
+        obj = self._make(max_size=2, ttl=60)
+        with mock.patch("time.time", return_value=1000.0):
+            self.assertTrue(obj.add_seen("a"))
+        with mock.patch("time.time", return_value=1001.0):
+            self.assertTrue(obj.add_seen("b"))
+        # Seen tokens don't expire with the entries.
+        with mock.patch("time.time", return_value=2000.0):
+            self.assertFalse(obj.add_seen("a"))
+        # "b" is now the least recently seen.
+        with mock.patch("time.time", return_value=2001.0):
+            self.assertTrue(obj.add_seen("c"))
+        with mock.patch("time.time", return_value=2002.0):
+            self.assertFalse(obj.add_seen("a"))
+            self.assertTrue(obj.add_seen("b"))
+
+    def test_delete(self):
+        obj = self._make()
+        obj.set("a", {"id": "1"})
+        obj.delete("a")
+        obj.delete("a")
+        self.assertIsNone(obj.get("a"))
+
+
+class TestMemoryTokenCache(TokenCacheTests, unittest.TestCase):
+    def _make(self, max_size=3, ttl=60):
+        from ..tokencache import MemoryTokenCache
+
+        return MemoryTokenCache(max_size=max_size, ttl=ttl)
+
+    def test_invalid_max_size(self):
+        with self.assertRaises(ValueError):
+            self._make(max_size=0)
+
+
+class TestSQLiteTokenCache(TokenCacheTests, unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "tokens.sqlite")
+        self.caches = []
+
+    def tearDown(self):
+        for cache in self.caches:
+            cache.close()
+        shutil.rmtree(self.tempdir)
+
+    def _make(self, max_size=3, ttl=60):
+        from ..tokencache import SQLiteTokenCache
+
+        cache = SQLiteTokenCache(path=self.path, max_size=max_size, ttl=ttl)
+        self.caches.append(cache)
+        return cache
+
+    def test_shared_between_instances(self):
+        obj1 = self._make()
+        obj2 = self._make()
+        obj1.set("abc", {"id": "11"})
+        self.assertEqual({"id": "11"}, obj2.get("abc"))
+        # The counters belong to each instance.
+        self.assertEqual(0, obj1.get_stats()["hits"])
+        self.assertEqual(1, obj2.get_stats()["hits"])
+
+    def test_file_is_private(self):
+        import stat
+
+        self._make()
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(self.path).st_mode))
+
+    def test_existing_file_made_private(self):
+        import stat
+
+        with open(self.path, "w"):
+            pass
+        os.chmod(self.path, 0o666)
+        self._make()
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(self.path).st_mode))
+
+    def test_refuse_file_owned_by_another_user(self):
+        with mock.patch("os.getuid", return_value=os.getuid() + 1):
+            with self.assertRaises(ValueError):
+                self._make()
+
+    def test_refuse_symlink(self):
+        target = os.path.join(self.tempdir, "target.sqlite")
+        os.symlink(target, self.path)
+        with self.assertRaises(OSError):
+            self._make()
+        self.assertFalse(os.path.exists(target))
+
+    def test_tokens_are_hashed(self):
+        import sqlite3
+
+        obj = self._make()
+        obj.set("secret-token", {"id": "11"})
+        conn = sqlite3.connect(self.path)
+        try:
+            rows = conn.execute("select token_hash from token_cache").fetchall()
+        finally:
+            conn.close()
+        self.assertEqual(1, len(rows))
+        self.assertNotIn("secret-token", rows[0][0])
+
+
+class TestTokenCache(unittest.TestCase):
+    def test_abstract(self):
+        from ..tokencache import TokenCache
+
+        with self.assertRaises(TypeError):
+            TokenCache(max_size=1, ttl=60)
+
+
+class Test_make_token_cache(unittest.TestCase):
+    def _call(self, **environ):
+        from ..tokencache import make_token_cache
+
+        with mock.patch.dict(os.environ, environ):
+            return make_token_cache()
+
+    def test_default(self):
+        from ..tokencache import MemoryTokenCache
+
+        with mock.patch.dict(os.environ):
+            for name in ("token_cache", "token_cache_size", "token_cache_ttl"):
+                os.environ.pop(name, None)
+            obj = self._call()
+        self.assertIsInstance(obj, MemoryTokenCache)
+        self.assertEqual(10000, obj.max_size)
+        self.assertEqual(60, obj.ttl)
+
+    def test_sqlite(self):
+        from ..tokencache import SQLiteTokenCache
+
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        path = os.path.join(tempdir, "tokens.sqlite")
+        obj = self._call(
+            token_cache="sqlite",
+            token_cache_path=path,
+            token_cache_size="5",
+            token_cache_ttl="30",
+        )
+        self.addCleanup(obj.close)
+        self.assertIsInstance(obj, SQLiteTokenCache)
+        self.assertEqual(path, obj.path)
+        self.assertEqual(5, obj.max_size)
+        self.assertEqual(30, obj.ttl)
+
+    def test_sqlite_requires_path(self):
+        with mock.patch.dict(os.environ):
+            os.environ.pop("token_cache_path", None)
+            with self.assertRaises(ValueError):
+                self._call(token_cache="sqlite")
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            self._call(token_cache="memcached")
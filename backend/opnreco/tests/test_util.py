@@ -0,0 +1,44 @@
+import logging
+import unittest
+from unittest import mock
+
+
+class TestPeriodicStatsLog(unittest.TestCase):
+    def _make(self, interval):
+        from ..util import PeriodicStatsLog
+
+        self.get_stats = mock.Mock(return_value={"hits": 1})
+        with mock.patch("time.monotonic", return_value=1000.0):
+            return PeriodicStatsLog(
+                logging.getLogger("opnreco.tests"),
+                "Stats: %s",
+                self.get_stats,
+                interval=interval,
+            )
+
+    def test_logs_once_per_interval(self):
+        obj = self._make(60)
+        with self.assertLogs("opnreco.tests", level="INFO") as cm:
+            for now in (1059.0, 1060.0, 1061.0, 1120.0):
+                with mock.patch("time.monotonic", return_value=now):
+                    obj.maybe_log()
+        self.assertEqual(
+            ["INFO:opnreco.tests:Stats: {'hits': 1}"] * 2,
+            cm.output,
+        )
+        self.assertEqual(2, self.get_stats.call_count)
+
+    def test_disabled(self):
+        obj = self._make(0)
+        with mock.patch("time.monotonic", return_value=5000.0):
+            obj.maybe_log()
+        self.get_stats.assert_not_called()
+
+    def test_interval_from_environ(self):
+        import os
+
+        from ..util import PeriodicStatsLog
+
+        with mock.patch.dict(os.environ, {"stats_log_interval": "12"}):
+            obj = PeriodicStatsLog(logging.getLogger("opnreco.tests"), "", dict)
+        self.assertEqual(12, obj.interval)
@@ -0,0 +1,614 @@
+import datetime
+import json
+import os
+import re
+import threading
+import unittest
+from decimal import Decimal
+
+import pyramid.testing
+import responses
+from opnreco.testing import DBSessionFixture
+from sqlalchemy import func
+
+zero = Decimal()
+
+
+def setup_module():
+    global dbsession_fixture
+    dbsession_fixture = DBSessionFixture()
+
+
+def teardown_module():
+    dbsession_fixture.close()
+
+
+class Test_compute_period_totals(unittest.TestCase):
+    def setUp(self):
+        self.config = pyramid.testing.setUp()
+        self.dbsession, self.close_session = dbsession_fixture.begin_session()
+
+    def tearDown(self):
+        self.close_session()
+        pyramid.testing.tearDown()
+
+    def _call(self, period_ids, verify=True):
+        from ..viewcommon import compute_period_totals
+
+        return compute_period_totals(
+            dbsession=self.dbsession,
+            owner_id="102",
+            period_ids=period_ids,
+            verify=verify,
+        )
+
+    def _recompute(self, period_ids):
+        from ..viewcommon import recompute_period_totals
+
+        return recompute_period_totals(
+            dbsession=self.dbsession, owner_id="102", period_ids=period_ids
+        )
+
+    def add_file(self):
+        from opnreco.models import db
+
+        dbsession = self.dbsession
+
+        owner = db.Owner(id="102", title="Testy Owner", username="testowner")
+        dbsession.add(owner)
+        dbsession.flush()
+
+        dbsession.add(
+            db.File(
+                id=1239,
+                owner_id="102",
+                file_type="open_circ",
+                title="Test File",
+                currency="USD",
+                has_vault=True,
+            )
+        )
+        dbsession.flush()
+
+        dbsession.query(
+            func.set_config("opnreco.personal_id", "102", True),
+            func.set_config("opnreco.movement.event_type", "test", True),
+            func.set_config("opnreco.account_entry.event_type", "test", True),
+        ).one()
+
+        self.period1 = db.Period(
+            owner_id="102",
+            file_id=1239,
+            start_date=None,
+            end_date=datetime.date(2018, 1, 31),
+            start_circ=Decimal("100.00"),
+            start_surplus=Decimal("5.00"),
+        )
+        dbsession.add(self.period1)
+        dbsession.flush()
+
+        self.period2 = db.Period(
+            owner_id="102",
+            file_id=1239,
+            start_date=datetime.date(2018, 2, 1),
+            end_date=None,
+        )
+        dbsession.add(self.period2)
+
+        self.record = db.TransferRecord(
+            owner_id="102",
+            transfer_id="6502",
+            workflow_type="redeem",
+            start=datetime.datetime(2018, 1, 15, 6, 0, 0),
+            currency="USD",
+            amount=Decimal("1.00"),
+            timestamp=datetime.datetime(2018, 1, 15, 6, 0, 1),
+            next_activity="completed",
+            completed=True,
+            canceled=False,
+        )
+        dbsession.add(self.record)
+
+        self.statement = db.Statement(
+            owner_id="102", file_id=1239, period_id=self.period1.id, source="test"
+        )
+        dbsession.add(self.statement)
+        dbsession.flush()
+
+    def add_file_movement(
+        self, number, vault_delta="0", wallet_delta="0", period=None, reco=None
+    ):
+        from opnreco.models import db
+
+        dbsession = self.dbsession
+        m = db.Movement(
+            owner_id="102",
+            transfer_record_id=self.record.id,
+            number=number,
+            amount_index=0,
+            loop_id="0",
+            currency="USD",
+            issuer_id="19",
+            from_id="19",
+            to_id="102",
+            amount=abs(Decimal(vault_delta) + Decimal(wallet_delta)),
+            action="test",
+            ts=datetime.datetime(2018, 1, 15, 6, 0, number),
+        )
+        dbsession.add(m)
+        dbsession.flush()
+
+        fm = db.FileMovement(
+            owner_id="102",
+            movement_id=m.id,
+            file_id=1239,
+            peer_id="19",
+            loop_id=m.loop_id,
+            currency=m.currency,
+            issuer_id=m.issuer_id,
+            transfer_record_id=m.transfer_record_id,
+            ts=m.ts,
+            wallet_delta=Decimal(wallet_delta),
+            vault_delta=Decimal(vault_delta),
+            surplus_delta=-Decimal(wallet_delta),
+            period_id=(period or self.period1).id,
+            reco_id=reco.id if reco is not None else None,
+        )
+        dbsession.add(fm)
+        dbsession.flush()
+        return fm
+
+    def add_account_entry(self, delta, reco=None):
+        from opnreco.models import db
+
+        e = db.AccountEntry(
+            owner_id="102",
+            file_id=1239,
+            period_id=self.period1.id,
+            statement_id=self.statement.id,
+            entry_date=datetime.date(2018, 1, 16),
+            loop_id="0",
+            currency="USD",
+            delta=Decimal(delta),
+            description="Test entry",
+            reco_id=reco.id if reco is not None else None,
+        )
+        self.dbsession.add(e)
+        self.dbsession.flush()
+        return e
+
+    def add_reco(self, internal):
+        from opnreco.models import db
+
+        reco = db.Reco(
+            owner_id="102",
+            period_id=self.period1.id,
+            reco_type="standard",
+            internal=internal,
+        )
+        self.dbsession.add(reco)
+        self.dbsession.flush()
+        return reco
+
+    def test_empty_periods(self):
+        self.add_file()
+        period_ids = [self.period1.id, self.period2.id]
+        res = self._call(period_ids)
+        self.assertEqual(self._recompute(period_ids), res)
+        self.assertEqual(
+            {
+                "circ": Decimal("100.00"),
+                "surplus": Decimal("5.00"),
+                "combined": Decimal("105.00"),
+            },
+            res[self.period1.id]["end"],
+        )
+        self.assertEqual(
+            {"circ": zero, "surplus": zero, "combined": zero},
+            res[self.period2.id]["end"],
+        )
+
+    def test_sums_follow_changes(self):
+        self.add_file()
+        period_ids = [self.period1.id, self.period2.id]
+
+        internal_reco = self.add_reco(internal=True)
+        external_reco = self.add_reco(internal=False)
+        self.add_file_movement(1, vault_delta="-3.00", reco=internal_reco)
+        self.add_file_movement(2, wallet_delta="3.00", reco=internal_reco)
+        self.add_file_movement(3, vault_delta="-7.00", reco=external_reco)
+        self.add_account_entry("7.00", reco=external_reco)
+        fm4 = self.add_file_movement(4, wallet_delta="-2.50")
+        entry = self.add_account_entry("1.25")
+
+        res = self._call(period_ids)
+        totals = res[self.period1.id]
+        self.assertEqual(
+            {
+                "circ": Decimal("3.00"),
+                "surplus": Decimal("-3.00"),
+                "combined": zero,
+            },
+            totals["internal_reconciled_delta"],
+        )
+        self.assertEqual(
+            {
+                "circ": Decimal("7.00"),
+                "surplus": zero,
+                "combined": Decimal("7.00"),
+            },
+            totals["external_reconciled_delta"],
+        )
+        self.assertEqual(
+            {
+                "circ": zero,
+                "surplus": Decimal("2.50"),
+                "combined": Decimal("2.50"),
+            },
+            totals["unreco_movements_delta"],
+        )
+        self.assertEqual(Decimal("1.25"), totals["unreco_entries_delta"]["surplus"])
+
+        # Change the movements, entries, and recos. The stored sums should
+        # still match a full recomputation.
+        external_reco.internal = True
+        fm4.period_id = self.period2.id
+        self.dbsession.delete(entry)
+        self.dbsession.flush()
+
+        res = self._call(period_ids)
+        self.assertEqual(
+            Decimal("2.50"), res[self.period2.id]["unreco_movements_delta"]["surplus"]
+        )
+        self.assertEqual(zero, res[self.period1.id]["unreco_entries_delta"]["surplus"])
+        self.assertEqual(
+            Decimal("10.00"), res[self.period1.id]["internal_reconciled_delta"]["circ"]
+        )
+
+    def test_verify_detects_mismatch(self):
+        from opnreco.models import db
+
+        from ..viewcommon import PeriodSumMismatch
+
+        self.add_file()
+        self.add_file_movement(1, wallet_delta="-2.50")
+        (
+            self.dbsession.query(db.PeriodSum)
+            .filter(db.PeriodSum.period_id == self.period1.id)
+            .update({"unreco_movements_surplus": Decimal("9.99")})
+        )
+
+        self._call([self.period1.id], verify=False)
+        with self.assertRaises(PeriodSumMismatch) as cm:
+            self._call([self.period1.id])
+        self.assertEqual([self.period1.id], cm.exception.period_ids)
+
+
+class Test_fetch_peers_and_loops(unittest.TestCase):
+    def setUp(self):
+        os.environ["opn_api_url"] = "https://opn.example.com:9999"
+        self.config = pyramid.testing.setUp()
+        self.dbsession, self.close_session = dbsession_fixture.begin_session()
+
+    def tearDown(self):
+        self.close_session()
+        pyramid.testing.tearDown()
+
+    def make_request(self):
+        from opnreco.models import db
+
+        owner = db.Owner(id="102", title="Testy Owner", username="testowner")
+        self.dbsession.add(owner)
+        self.dbsession.flush()
+        return pyramid.testing.DummyRequest(
+            dbsession=self.dbsession, owner=owner, access_token="example-token"
+        )
+
+    def add_stale_rows(self):
+        from opnreco.models import db
+
+        old = datetime.datetime(2018, 1, 1)
+        self.dbsession.add(
+            db.Peer(owner_id="102", peer_id="19", title="Old 19", last_update=old)
+        )
+        self.dbsession.add(
+            db.Peer(owner_id="102", peer_id="20", title="Old 20", last_update=old)
+        )
+        self.dbsession.add(
+            db.Loop(owner_id="102", loop_id="41", title="Old 41", last_update=old)
+        )
+        self.dbsession.flush()
+
+    def add_responses(self, rsps, path, objects, barrier):
+        def callback(request):
+            # Wait until every request is in flight at once.
+            barrier.wait()
+            body = objects[request.url.rsplit("/", 1)[1]]
+            if body is None:
+                return (404, {}, json.dumps({"error": "not_found"}))
+            return (200, {}, json.dumps(body))
+
+        rsps.add_callback(
+            responses.GET,
+            re.compile("https://opn.example.com:9999/%s/.*" % path),
+            callback=callback,
+            content_type="application/json",
+        )
+
+    def test_peers_fetched_concurrently_and_upserted(self):
+        from opnreco.models import db
+
+        from ..viewcommon import _fetch_peers
+
+        request = self.make_request()
+        self.add_stale_rows()
+        objects = {
+            "19": {"title": "New 19", "username": "new19"},
+            "20": None,
+            "21": {"title": "New 21", "username": None},
+        }
+        with responses.RequestsMock() as rsps:
+            self.add_responses(rsps, "p", objects, threading.Barrier(3, timeout=5))
+            res = _fetch_peers(request, ["19", "20", "21"])
+
+        self.assertEqual(
+            {
+                "19": {"title": "New 19", "username": "new19", "is_dfi_account": False},
+                "20": {
+                    "title": "[Missing Profile 20]",
+                    "username": None,
+                    "is_dfi_account": False,
+                },
+                "21": {"title": "New 21", "username": None, "is_dfi_account": False},
+            },
+            res,
+        )
+
+        rows = self.dbsession.query(db.Peer).order_by(db.Peer.peer_id).all()
+        self.assertEqual(
+            [("19", "New 19"), ("20", "Old 20"), ("21", "New 21")],
+            [(row.peer_id, row.title) for row in rows],
+        )
+        for row in rows:
+            self.assertGreater(row.last_update, datetime.datetime(2018, 1, 1))
+
+        # The peers are fresh now, so there's nothing more to fetch.
+        self.assertEqual({}, _fetch_peers(request, ["19", "20", "21"]))
+
+    def test_loops_fetched_concurrently_and_upserted(self):
+        from opnreco.models import db
+
+        from ..viewcommon import _fetch_loops
+
+        request = self.make_request()
+        self.add_stale_rows()
+        objects = {"41": {"title": "New 41"}, "42": None}
+        with responses.RequestsMock() as rsps:
+            self.add_responses(rsps, "design", objects, threading.Barrier(2, timeout=5))
+            res = _fetch_loops(request, ["41", "42"])
+
+        self.assertEqual(
+            {
+                "41": {"title": "New 41"},
+                "42": {"title": "[Missing note design 42]"},
+            },
+            res,
+        )
+        rows = self.dbsession.query(db.Loop).order_by(db.Loop.loop_id).all()
+        self.assertEqual(
+            [("41", "New 41"), ("42", "[Missing note design 42]")],
+            [(row.loop_id, row.title) for row in rows],
+        )
+
+
+class Test_update_local_dates(unittest.TestCase):
+    def setUp(self):
+        self.config = pyramid.testing.setUp()
+        self.dbsession, self.close_session = dbsession_fixture.begin_session()
+
+    def tearDown(self):
+        self.close_session()
+        pyramid.testing.tearDown()
+
+    def _call(self):
+        from ..viewcommon import update_local_dates
+
+        request = pyramid.testing.DummyRequest(
+            dbsession=self.dbsession, personal_id="102"
+        )
+        return update_local_dates(request, self.owner, event_type="tzname_change")
+
+    def add_file_movement(self, reco=None):
+        from opnreco.models import db
+
+        dbsession = self.dbsession
+        self.owner = db.Owner(
+            id="102", title="Testy Owner", username="testowner", tzname="UTC"
+        )
+        dbsession.add(self.owner)
+        dbsession.flush()
+        dbsession.add(
+            db.File(
+                id=1239,
+                owner_id="102",
+                file_type="open_circ",
+                title="Test File",
+                currency="USD",
+                has_vault=True,
+            )
+        )
+        dbsession.flush()
+        dbsession.query(
+            func.set_config("opnreco.personal_id", "102", True),
+            func.set_config("opnreco.movement.event_type", "test", True),
+        ).one()
+
+        period = db.Period(owner_id="102", file_id=1239)
+        dbsession.add(period)
+        dbsession.flush()
+        self.reco = db.Reco(
+            owner_id="102",
+            period_id=period.id,
+            reco_type="standard",
+            internal=True,
+        )
+        dbsession.add(self.reco)
+
+        ts = datetime.datetime(2018, 1, 15, 3, 0, 0)
+        record = db.TransferRecord(
+            owner_id="102",
+            transfer_id="6502",
+            workflow_type="redeem",
+            start=ts,
+            currency="USD",
+            amount=Decimal("1.00"),
+            timestamp=ts,
+            next_activity="completed",
+            completed=True,
+            canceled=False,
+        )
+        dbsession.add(record)
+        dbsession.flush()
+        m = db.Movement(
+            owner_id="102",
+            transfer_record_id=record.id,
+            number=1,
+            amount_index=0,
+            loop_id="0",
+            currency="USD",
+            issuer_id="19",
+            from_id="19",
+            to_id="102",
+            amount=Decimal("1.00"),
+            action="test",
+            ts=ts,
+        )
+        dbsession.add(m)
+        dbsession.flush()
+        fm = db.FileMovement(
+            owner_id="102",
+            movement_id=m.id,
+            file_id=1239,
+            peer_id="19",
+            loop_id=m.loop_id,
+            currency=m.currency,
+            issuer_id=m.issuer_id,
+            transfer_record_id=m.transfer_record_id,
+            ts=m.ts,
+            wallet_delta=0,
+            vault_delta=Decimal("1.00"),
+            surplus_delta=0,
+            period_id=period.id,
+            reco_id=self.reco.id,
+        )
+        dbsession.add(fm)
+        dbsession.flush()
+        return fm
+
+    def get_summary_date(self):
+        from opnreco.models import db
+
+        return (
+            self.dbsession.query(db.RecoSummary.min_local_date)
+            .filter(db.RecoSummary.reco_id == self.reco.id)
+            .scalar()
+        )
+
+    def test_trigger_fills_local_date(self):
+        fm = self.add_file_movement()
+        self.dbsession.refresh(fm)
+        self.assertEqual(datetime.date(2018, 1, 15), fm.local_date)
+        self.assertEqual(datetime.date(2018, 1, 15), self.get_summary_date())
+
+    def test_time_zone_change(self):
+        fm = self.add_file_movement()
+        self.owner.tzname = "America/New_York"
+        self.assertEqual(1, self._call())
+        self.assertEqual(datetime.date(2018, 1, 14), fm.local_date)
+        self.assertEqual(datetime.date(2018, 1, 14), self.get_summary_date())
+
+    def test_no_change(self):
+        self.add_file_movement()
+        self.owner.tzname = "Europe/London"
+        self.assertEqual(0, self._call())
+
+
+class DummyPeriod:
+    def __init__(self, id, start_date, end_date):
+        self.id = id
+        self.start_date = start_date
+        self.end_date = end_date
+
+
+class TestPeriodIndex(unittest.TestCase):
+    def _make(self, period_list):
+        from ..viewcommon import PeriodIndex
+
+        return PeriodIndex(period_list)
+
+    def test_bounded_periods(self):
+        p1 = DummyPeriod(1, datetime.date(2020, 1, 1), datetime.date(2020, 1, 31))
+        p2 = DummyPeriod(2, datetime.date(2020, 2, 1), datetime.date(2020, 2, 29))
+        obj = self._make([p2, p1])
+        self.assertFalse(obj.overlapping)
+        self.assertIs(p1, obj.get(datetime.date(2020, 1, 1)))
+        self.assertIs(p1, obj.get(datetime.date(2020, 1, 31)))
+        self.assertIs(p2, obj.get(datetime.date(2020, 2, 1)))
+        self.assertIsNone(obj.get(datetime.date(2019, 12, 31)))
+        self.assertIsNone(obj.get(datetime.date(2020, 3, 1)))
+        self.assertIsNone(obj.get(None))
+
+    def test_endless_fallback(self):
+        p1 = DummyPeriod(1, None, datetime.date(2019, 12, 31))
+        p2 = DummyPeriod(2, datetime.date(2020, 2, 1), None)
+        obj = self._make([p1, p2])
+        self.assertFalse(obj.overlapping)
+        self.assertIs(p1, obj.get(datetime.date(2010, 1, 1)))
+        self.assertIs(p2, obj.get(datetime.date(2030, 1, 1)))
+        # The gap in January 2020 falls back to the endless period.
+        self.assertIs(p2, obj.get(datetime.date(2020, 1, 15)))
+        self.assertIsNone(obj.get(datetime.date(2020, 1, 15), default_endless=False))
+        self.assertIs(p2, obj.get(None))
+        self.assertIsNone(obj.get(None, default_endless=False))
+
+    def test_overlapping_periods_match_list_order(self):
+        p1 = DummyPeriod(1, datetime.date(2020, 1, 10), datetime.date(2020, 1, 31))
+        p2 = DummyPeriod(2, datetime.date(2020, 1, 1), datetime.date(2020, 1, 20))
+        obj = self._make([p1, p2])
+        self.assertTrue(obj.overlapping)
+        self.assertIs(p1, obj.get(datetime.date(2020, 1, 15)))
+        self.assertIs(p2, obj.get(datetime.date(2020, 1, 5)))
+
+    def test_matches_get_period_for_day(self):
+        import random
+
+        from ..viewcommon import get_period_for_day
+
+        rand = random.Random(42)
+        base = datetime.date(2020, 1, 1)
+        for _ in range(200):
+            period_list = []
+            start = rand.randint(-5, 5)
+            for period_id in range(rand.randint(0, 6)):
+                length = rand.randint(0, 10)
+                start_date = base + datetime.timedelta(days=start)
+                end_date = start_date + datetime.timedelta(days=length)
+                if rand.random() < 0.15:
+                    start_date = None
+                if rand.random() < 0.15:
+                    end_date = None
+                period_list.append(DummyPeriod(period_id, start_date, end_date))
+                # Usually leave a gap; sometimes overlap.
+                start += length + rand.randint(-3, 3)
+            rand.shuffle(period_list)
+            obj = self._make(period_list)
+
+            days = [None] + [base + datetime.timedelta(days=n) for n in range(-10, 80)]
+            for day in days:
+                for default_endless in (True, False):
+                    self.assertIs(
+                        get_period_for_day(
+                            period_list, day, default_endless=default_endless
+                        ),
+                        obj.get(day, default_endless=default_endless),
+                    )
@@ -0,0 +1,58 @@
+"""Substring matching for the reco dialog searches.
+
+When the pg_trgm extension is installed, GIN trigram indexes on
+transfer_record.transfer_id and account_entry.description serve the
+substring matches, and the account entry search ranks descriptions by
+trigram similarity. Without pg_trgm, the same filters run unindexed and
+the results keep their default order.
+"""
+
+import threading
+import weakref
+
+from sqlalchemy import func, text
+
+trgm_installed_query = text(
+    "select exists(select 1 from pg_extension where extname = 'pg_trgm')"
+)
+
+# {engine: bool}
+_trgm_enabled: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+_trgm_lock = threading.Lock()
+
+
+def trgm_enabled(dbsession) -> bool:
+    """Return true if the database has the pg_trgm extension.
+
+    The answer is cached for each engine.
+    """
+    engine = dbsession.get_bind().engine
+    with _trgm_lock:
+        enabled = _trgm_enabled.get(engine)
+    if enabled is None:
+        enabled = bool(dbsession.execute(trgm_installed_query).scalar())
+        with _trgm_lock:
+            _trgm_enabled[engine] = enabled
+    return enabled
+
+
+def contains(column, value: str, case_sensitive: bool = True):
+    """Make a filter that matches a substring anywhere in a column.
+
+    The pattern is a single bind parameter so the planner can see it and
+    choose a trigram index.
+    """
+    pattern = "%" + value + "%"
+    if case_sensitive:
+        return column.like(pattern)
+    return column.ilike(pattern)
+
+
+def similarity_order(dbsession, column, value: str) -> list:
+    """List the ORDER BY terms that rank the closest matches first.
+
+    The list is empty when pg_trgm is not installed.
+    """
+    if not value or not trgm_enabled(dbsession):
+        return []
+    return [func.similarity(column, value).desc()]
@@ -0,0 +1,334 @@
+"""Caches of validated OPN access tokens.
+
+The authentication policy stores the wallet info of each valid access
+token so it does not need to ask OPN about every request. Choose the
+cache backend with these environment variables:
+
+- token_cache: "memory" (the default) for a cache in each process or
+  "sqlite" for a cache shared by all processes on the host
+- token_cache_path: the SQLite database file, required with
+  token_cache=sqlite. Put it in a directory only the app user can write.
+  The file is created with mode 0600; a file owned by another user is
+  refused.
+- token_cache_size: the maximum number of tokens to keep (default 10000)
+- token_cache_ttl: the number of seconds to trust a validated token
+  (default 60)
+
+The authentication policy logs the hit, miss, and eviction counters
+every stats_log_interval seconds (default 300).
+"""
+
+import abc
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def _hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class TokenCache(abc.ABC):
+    """Base class of the access token caches.
+
+    Entries are JSON-compatible dicts. Entries expire ttl seconds after
+    they are stored. Once the cache holds max_size entries, storing
+    another entry evicts the least recently used entry.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._stats_lock = threading.Lock()
+
+    def get(self, token: str) -> dict | None:
+        """Get the unexpired entry for a token and count the hit or miss."""
+        entry = self._get(token, time.time())
+        with self._stats_lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def set(self, token: str, entry: dict):
+        """Store the entry for a token."""
+        evicted = self._set(token, entry, time.time())
+        if evicted:
+            with self._stats_lock:
+                self.evictions += evicted
+
+    @abc.abstractmethod
+    def delete(self, token: str):
+        """Remove the entry for a token, if any."""
+
+    def add_seen(self, token: str) -> bool:
+        """Remember that a token was validated. Return True if it is new.
+
+        Seen tokens are kept apart from the entries and don't expire, so
+        revalidating an expired entry doesn't count as a new token. The
+        max_size most recently seen tokens are kept.
+        """
+        return self._add_seen(_hash_token(token), time.time())
+
+    def get_stats(self) -> dict:
+        """Get the hit, miss, and eviction counters of this process."""
+        with self._stats_lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self),
+            }
+
+    @abc.abstractmethod
+    def __len__(self) -> int:
+        """Count the entries, including expired entries not yet removed."""
+
+    @abc.abstractmethod
+    def _get(self, token: str, now: float) -> dict | None:
+        """Get the unexpired entry for a token."""
+
+    @abc.abstractmethod
+    def _set(self, token: str, entry: dict, now: float) -> int:
+        """Store an entry and return the number of entries evicted."""
+
+    @abc.abstractmethod
+    def _add_seen(self, token_hash: str, now: float) -> bool:
+        """Remember a token hash. Return True if it was not known."""
+
+
+class MemoryTokenCache(TokenCache):
+    """LRU token cache in the memory of this process."""
+
+    def __init__(self, max_size: int, ttl: float):
+        super().__init__(max_size, ttl)
+        # {token: (expires, entry)}, least recently used first
+        self._entries: collections.OrderedDict[str, tuple[float, dict]] = (
+            collections.OrderedDict()
+        )
+        # {token_hash: None}, least recently seen first
+        self._seen: collections.OrderedDict[str, None] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, token, now):
+        with self._lock:
+            item = self._entries.get(token)
+            if item is None:
+                return None
+            expires, entry = item
+            if now >= expires:
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return entry
+
+    def _set(self, token, entry, now):
+        evicted = 0
+        with self._lock:
+            entries = self._entries
+            entries[token] = (now + self.ttl, entry)
+            entries.move_to_end(token)
+            while len(entries) > self.max_size:
+                entries.popitem(last=False)
+                evicted += 1
+        return evicted
+
+    def _add_seen(self, token_hash, now):
+        with self._lock:
+            seen = self._seen
+            if token_hash in seen:
+                seen.move_to_end(token_hash)
+                return False
+            seen[token_hash] = None
+            while len(seen) > self.max_size:
+                seen.popitem(last=False)
+            return True
+
+    def delete(self, token):
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+def _open_private_file(path: str):
+    """Create a file readable only by this user or check an existing one.
+
+    Raise ValueError if the file is owned by another user. Anyone who can
+    write to the token cache can add a token for any profile, and the
+    entries hold personal wallet info.
+    """
+    flags = os.O_RDWR | os.O_CREAT | getattr(os, "O_NOFOLLOW", 0)
+    fd = os.open(path, flags, 0o600)
+    try:
+        st = os.fstat(fd)
+        if st.st_uid != os.getuid():
+            raise ValueError("%s is owned by another user" % path)
+        if st.st_mode & 0o077:
+            os.fchmod(fd, 0o600)
+    finally:
+        os.close(fd)
+
+
+class SQLiteTokenCache(TokenCache):
+    """LRU token cache in a SQLite file shared by processes on the host.
+
+    The tokens are stored as SHA-256 hashes, not in the clear. The file
+    and its WAL files must belong to this user.
+    """
+
+    def __init__(self, path: str, max_size: int, ttl: float):
+        super().__init__(max_size, ttl)
+        self.path = path
+        self._lock = threading.Lock()
+        _open_private_file(path)
+        for suffix in ("-wal", "-shm"):
+            # SQLite creates these with the permissions of the database,
+            # but refuse ones placed there by another user.
+            if os.path.lexists(path + suffix):
+                _open_private_file(path + suffix)
+        conn = sqlite3.connect(
+            path, timeout=10, isolation_level=None, check_same_thread=False
+        )
+        conn.execute("pragma journal_mode=wal")
+        conn.execute("pragma synchronous=normal")
+        conn.execute("""
+            create table if not exists token_cache (
+                token_hash text primary key,
+                entry text not null,
+                expires real not null,
+                last_used real not null
+            )
+            """)
+        conn.execute(
+            "create index if not exists ix_token_cache_last_used "
+            "on token_cache (last_used)"
+        )
+        conn.execute("""
+            create table if not exists token_seen (
+                token_hash text primary key,
+                last_used real not null
+            )
+            """)
+        conn.execute(
+            "create index if not exists ix_token_seen_last_used "
+            "on token_seen (last_used)"
+        )
+        self._conn = conn
+
+    def _get(self, token, now):
+        token_hash = _hash_token(token)
+        with self._lock:
+            row = self._conn.execute(
+                "select entry from token_cache where token_hash = ? and expires > ?",
+                (token_hash, now),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "update token_cache set last_used = ? where token_hash = ?",
+                (now, token_hash),
+            )
+        return json.loads(row[0])
+
+    def _set(self, token, entry, now):
+        conn = self._conn
+        with self._lock:
+            conn.execute("begin immediate")
+            try:
+                conn.execute(
+                    "insert or replace into token_cache "
+                    "(token_hash, entry, expires, last_used) values (?, ?, ?, ?)",
+                    (_hash_token(token), json.dumps(entry), now + self.ttl, now),
+                )
+                conn.execute("delete from token_cache where expires <= ?", (now,))
+                evicted = conn.execute(
+                    """
+                    delete from token_cache where token_hash in (
+                        select token_hash from token_cache
+                        order by last_used desc
+                        limit -1 offset ?)
+                    """,
+                    (self.max_size,),
+                ).rowcount
+                conn.execute("commit")
+            except BaseException:
+                conn.execute("rollback")
+                raise
+        return evicted
+
+    def _add_seen(self, token_hash, now):
+        conn = self._conn
+        with self._lock:
+            conn.execute("begin immediate")
+            try:
+                added = (
+                    conn.execute(
+                        "insert or ignore into token_seen (token_hash, last_used) "
+                        "values (?, ?)",
+                        (token_hash, now),
+                    ).rowcount
+                    == 1
+                )
+                if added:
+                    conn.execute(
+                        """
+                        delete from token_seen where token_hash in (
+                            select token_hash from token_seen
+                            order by last_used desc
+                            limit -1 offset ?)
+                        """,
+                        (self.max_size,),
+                    )
+                else:
+                    conn.execute(
+                        "update token_seen set last_used = ? where token_hash = ?",
+                        (now, token_hash),
+                    )
+                conn.execute("commit")
+            except BaseException:
+                conn.execute("rollback")
+                raise
+        return added
+
+    def delete(self, token):
+        with self._lock:
+            self._conn.execute(
+                "delete from token_cache where token_hash = ?", (_hash_token(token),)
+            )
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("select count(1) from token_cache").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def make_token_cache() -> TokenCache:
+    """Create the token cache configured by the environment."""
+    environ = os.environ
+    kind = environ.get("token_cache", "memory")
+    max_size = int(environ.get("token_cache_size", "10000"))
+    ttl = float(environ.get("token_cache_ttl", "60"))
+    if kind == "memory":
+        return MemoryTokenCache(max_size=max_size, ttl=ttl)
+    if kind == "sqlite":
+        path = environ.get("token_cache_path")
+        if not path:
+            raise ValueError("token_cache=sqlite requires token_cache_path")
+        return SQLiteTokenCache(path=path, max_size=max_size, ttl=ttl)
+    raise ValueError("Unknown token_cache: %r" % kind)
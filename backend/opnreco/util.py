@@ -1,6 +1,9 @@
 import datetime
 import logging
+import os
 import re
+import threading
+import time
 
 from pyramid.httpexceptions import HTTPUnauthorized
 
@@ -82,3 +85,32 @@ def dashed(n):
         res.append(s[pos : pos + 4])
         pos += 4
     return "-".join(res)
+
+
+class PeriodicStatsLog:
+    """Log a snapshot of some counters at most once per interval.
+
+    The interval is the stats_log_interval environment variable in seconds
+    (default 300). Set it to 0 to disable the log.
+    """
+
+    def __init__(self, logger, message: str, get_stats, interval=None):
+        if interval is None:
+            interval = float(os.environ.get("stats_log_interval", "300"))
+        self.logger = logger
+        self.message = message
+        self.get_stats = get_stats
+        self.interval = interval
+        self._next_log = time.monotonic() + interval
+        self._lock = threading.Lock()
+
+    def maybe_log(self):
+        """Log the stats if the interval has passed since the last log."""
+        if self.interval <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_log:
+                return
+            self._next_log = now + self.interval
+        self.logger.info(self.message, self.get_stats())
@@ -1,9 +1,10 @@
+import bisect
+import concurrent.futures
 import datetime
 import os
 from decimal import Decimal
 from typing import Sequence, TypedDict
 
-import requests
 import sqlalchemy.dialects.postgresql
 from colander import Invalid
 from opnreco.models.db import (
@@ -14,12 +15,14 @@ from opnreco.models.db import (
     OwnerLog,
     Peer,
     Period,
+    PeriodSum,
     Reco,
     now_func,
 )
+from opnreco.opnclient import get_opn_client
 from opnreco.util import check_requests_response
 from pyramid.httpexceptions import HTTPBadRequest
-from sqlalchemy import func, literal
+from sqlalchemy import func, literal, update
 
 null = None
 
@@ -31,12 +34,65 @@ def get_tzname(owner):
     return owner.tzname or "America/New_York"
 
 
+def update_local_dates(request, owner, event_type: str) -> int:
+    """Recompute file_movement.local_date for the owner's time zone.
+
+    Call this after changing owner.tzname. Return the number of file
+    movements whose local date changed.
+    """
+    configure_dblog(request, movement_event_type=event_type)
+    local_date_c = func.date(
+        func.timezone(get_tzname(owner), func.timezone("UTC", FileMovement.ts))
+    )
+    result = request.dbsession.execute(
+        update(FileMovement)
+        .where(
+            FileMovement.owner_id == owner.id,
+            FileMovement.local_date != local_date_c,
+        )
+        .values(local_date=local_date_c)
+        .execution_options(synchronize_session="fetch")
+    )
+    return result.rowcount
+
+
 class PeerInfo(TypedDict):
     title: str
     username: str | None
     is_dfi_account: bool
 
 
+def _fetch_opn_objects(
+    request, urls: dict[str, str], endpoint: str
+) -> dict[str, dict | None]:
+    """Get JSON objects from OPN concurrently.
+
+    urls is {key: url}. Return {key: JSON object or None if the request
+    failed}. At most opn_fetch_concurrency (default 8) requests run at
+    once, so the time taken is about the time of the slowest request.
+    """
+    if not urls:
+        return {}
+
+    opn_client = get_opn_client()
+    access_token = request.access_token
+
+    def fetch(url: str) -> dict | None:
+        r = opn_client.get(url, access_token, endpoint=endpoint)
+        if check_requests_response(r, raise_exc=False):
+            return r.json()
+        return None
+
+    if len(urls) == 1:
+        ((key, url),) = urls.items()
+        return {key: fetch(url)}
+
+    max_workers = min(len(urls), int(os.environ.get("opn_fetch_concurrency", "8")))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {key: executor.submit(fetch, url) for key, url in urls.items()}
+        return {key: future.result() for key, future in futures.items()}
+
+
 def _fetch_peers(request, input_peer_ids: Sequence[str]) -> dict[str, PeerInfo]:
     """Fetch updates as necessary for all peers relevant to a request.
 
@@ -58,8 +114,8 @@ def _fetch_peers(request, input_peer_ids: Sequence[str]) -> dict[str, PeerInfo]:
 
     now = dbsession.query(now_func).scalar()
     stale_time = now - stale_delta
-    res: dict[str, PeerInfo] = {}  # {peer_id: peer_info}
 
+    stale_peer_ids: list[str] = []
     for peer_id in sorted(input_peer_ids):
         peer_row = peer_row_map.get(peer_id)
         if peer_row is not None:
@@ -69,18 +125,36 @@ def _fetch_peers(request, input_peer_ids: Sequence[str]) -> dict[str, PeerInfo]:
             if peer_row.last_update >= stale_time:
                 # No update needed.
                 continue
+        stale_peer_ids.append(peer_id)
+
+    if not stale_peer_ids:
+        return {}
+
+    fetched_map = _fetch_opn_objects(
+        request,
+        {
+            peer_id: "%s/p/%s" % (api_url, peer_id)
+            for peer_id in stale_peer_ids
+            if peer_id != "c"
+        },
+        endpoint="/p/{id}",
+    )
 
+    res: dict[str, PeerInfo] = {}  # {peer_id: peer_info}
+    # Rows that got new info from OPN.
+    fetched_values: list[dict] = []
+    # Rows that OPN could not provide. Keep the existing titles.
+    missing_values: list[dict] = []
+
+    for peer_id in stale_peer_ids:
         if peer_id == "c":
             fetched = True
             title = request.owner.title
             username = request.owner.username
         else:
-            url = "%s/p/%s" % (api_url, peer_id)
-            headers = {"Authorization": "Bearer %s" % request.access_token}
-            r = requests.get(url, headers=headers)
-            if check_requests_response(r, raise_exc=False):
+            r_json = fetched_map[peer_id]
+            if r_json is not None:
                 fetched = True
-                r_json = r.json()
                 title = r_json["title"]
                 username = r_json["username"]
             else:
@@ -94,32 +168,38 @@ def _fetch_peers(request, input_peer_ids: Sequence[str]) -> dict[str, PeerInfo]:
             "is_dfi_account": False,
         }
 
-        if peer_row is None:
-            # Insert the new Peer, ignoring conflicts.
-            values = {
-                "owner_id": owner_id,
-                "peer_id": peer_id,
-                "title": title,
-                "username": username,
-                "is_dfi_account": False,
-                "removed": False,
-                "last_update": now_func,
-            }
-            stmt = (
-                sqlalchemy.dialects.postgresql.insert(Peer.__table__, bind=dbsession)
-                .values(**values)
-                .on_conflict_do_nothing()
+        values = {
+            "owner_id": owner_id,
+            "peer_id": peer_id,
+            "title": title,
+            "username": username,
+            "is_dfi_account": False,
+            "removed": False,
+            "last_update": now_func,
+        }
+        if fetched:
+            fetched_values.append(values)
+        else:
+            missing_values.append(values)
+
+    # Insert the new Peers and update the existing Peers.
+    for values_list, update_columns in (
+        (fetched_values, ("title", "username", "last_update")),
+        (missing_values, ("last_update",)),
+    ):
+        if values_list:
+            stmt = sqlalchemy.dialects.postgresql.insert(Peer.__table__).values(
+                values_list
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["owner_id", "peer_id"],
+                set_={name: stmt.excluded[name] for name in update_columns},
             )
             dbsession.execute(stmt)
 
-        else:
-            # Update the Peer.
-            if fetched:
-                if peer_row.title != title:
-                    peer_row.title = title  # type: ignore
-                if peer_row.username != username:
-                    peer_row.username = username  # type: ignore
-            peer_row.last_update = now_func
+    # The ORM rows loaded above are now out of date.
+    for peer_row in peer_rows:
+        dbsession.expire(peer_row)
 
     return res
 
@@ -221,52 +301,72 @@ def _fetch_loops(request, input_loop_ids: Sequence[str]) -> dict[str, LoopInfo]:
 
     now = dbsession.query(now_func).scalar()
     stale_time = now - stale_delta
-    res: dict[str, LoopInfo] = {}  # {loop_id: loop_info}
 
+    stale_loop_ids: list[str] = []
     for loop_id in sorted(input_loop_ids):
         loop_row = loop_row_map.get(loop_id)
         if loop_row is not None:
             if loop_row.last_update >= stale_time:
                 # No update needed.
                 continue
+        stale_loop_ids.append(loop_id)
 
-        url = "%s/design/%s" % (api_url, loop_id)
-        headers = {"Authorization": "Bearer %s" % request.access_token}
-        r = requests.get(url, headers=headers)
-        if check_requests_response(r, raise_exc=False):
-            fetched = True
-            r_json = r.json()
+    if not stale_loop_ids:
+        return {}
+
+    fetched_map = _fetch_opn_objects(
+        request,
+        {loop_id: "%s/design/%s" % (api_url, loop_id) for loop_id in stale_loop_ids},
+        endpoint="/design/{id}",
+    )
+
+    res: dict[str, LoopInfo] = {}  # {loop_id: loop_info}
+    # Rows that got new info from OPN.
+    fetched_values: list[dict] = []
+    # Rows that OPN could not provide. Keep the existing titles.
+    missing_values: list[dict] = []
+
+    for loop_id in stale_loop_ids:
+        r_json = fetched_map[loop_id]
+        if r_json is not None:
             title = r_json["title"]
         else:
-            fetched = False
             title = "[Missing note design %s]" % loop_id
 
         res[loop_id] = {
             "title": title,
         }
 
-        if loop_row is None:
-            # Insert the new Loop, ignoring conflicts.
-            values = {
-                "owner_id": owner_id,
-                "loop_id": loop_id,
-                "title": title,
-                "removed": False,
-                "last_update": now_func,
-            }
-            stmt = (
-                sqlalchemy.dialects.postgresql.insert(Loop.__table__, bind=dbsession)
-                .values(**values)
-                .on_conflict_do_nothing()
+        values = {
+            "owner_id": owner_id,
+            "loop_id": loop_id,
+            "title": title,
+            "removed": False,
+            "last_update": now_func,
+        }
+        if r_json is not None:
+            fetched_values.append(values)
+        else:
+            missing_values.append(values)
+
+    # Insert the new Loops and update the existing Loops.
+    for values_list, update_columns in (
+        (fetched_values, ("title", "last_update")),
+        (missing_values, ("last_update",)),
+    ):
+        if values_list:
+            stmt = sqlalchemy.dialects.postgresql.insert(Loop.__table__).values(
+                values_list
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["owner_id", "loop_id"],
+                set_={name: stmt.excluded[name] for name in update_columns},
             )
             dbsession.execute(stmt)
 
-        else:
-            # Update the Loop.
-            if fetched:
-                if loop_row.title != title:
-                    loop_row.title = title  # type: ignore
-            loop_row.last_update = now_func
+    # The ORM rows loaded above are now out of date.
+    for loop_row in loop_rows:
+        dbsession.expire(loop_row)
 
     return res
 
@@ -334,12 +434,91 @@ class PeriodTotals(TypedDict):
     end: PhaseTotals
 
 
+def new_period_totals(start_circ: Decimal, start_surplus: Decimal) -> PeriodTotals:
+    """Create a PeriodTotals with the given start balances and no deltas."""
+    zero = Decimal("0")
+    return {
+        # phase: {circ, surplus, combined}
+        "start": {
+            "circ": start_circ,
+            "surplus": start_surplus,
+            "combined": start_circ + start_surplus,
+        },
+        "internal_reconciled_delta": {
+            "circ": zero,
+            "surplus": zero,
+            "combined": zero,
+        },
+        "external_reconciled_delta": {
+            "circ": zero,
+            "surplus": zero,
+            "combined": zero,
+        },
+        "reconciled_delta": {  # sum of the internal and external
+            "circ": zero,
+            "surplus": zero,
+            "combined": zero,
+        },
+        "reconciled_total": {
+            "circ": zero,
+            "surplus": zero,
+            "combined": zero,
+        },
+        "unreco_movements_delta": {
+            "circ": zero,
+            "surplus": zero,
+            "combined": zero,
+        },
+        "unreco_entries_delta": {
+            "circ": zero,
+            "surplus": zero,
+            "combined": zero,
+        },
+        "end": {
+            "circ": zero,
+            "surplus": zero,
+            "combined": zero,
+        },
+    }
+
+
+def finish_period_totals(m: PeriodTotals):
+    """Compute the reconciled and end totals of a PeriodTotals."""
+    # Note that this code does not include unreco_entries_delta
+    # in the end totals. That's because there are two kinds of
+    # unreconciled account entries, the majority of which are represented by
+    # unreconciled movements that have been included in the totals already.
+    # Unreconciled account entries from sources other than movements will
+    # nearly always throw off the account surplus balance, which should make
+    # them obvious to the people performing reconciliation.
+    for k in "circ", "surplus", "combined":
+        internal_reconciled = m["internal_reconciled_delta"][k]
+        external_reconciled = m["external_reconciled_delta"][k]
+        reconciled_delta = internal_reconciled + external_reconciled
+        m["reconciled_delta"][k] = reconciled_delta
+        reconciled_total = m["start"][k] + reconciled_delta
+        m["reconciled_total"][k] = reconciled_total
+        m["end"][k] = reconciled_total + m["unreco_movements_delta"][k]
+
+
+class PeriodSumMismatch(Exception):
+    """The period_sum table disagrees with a full recomputation."""
+
+    def __init__(self, msg: str, period_ids: Sequence[int]):
+        Exception.__init__(self, msg)
+        self.period_ids = period_ids
+
+
 def compute_period_totals(
-    dbsession, owner_id: str, period_ids: Sequence[int]
+    dbsession, owner_id: str, period_ids: Sequence[int], verify: bool = False
 ) -> dict[int, PeriodTotals]:
     """Compute the balances and deltas for a set of periods.
 
-    Gets the start balances (circ, surplus, and combined) and computes totals.
+    Reads the start balances from the period table and the deltas from
+    the period_sum table, which is kept current by triggers.
+
+    If verify is true, also recompute the totals from the file_movement
+    and account_entry tables and raise PeriodSumMismatch if they differ.
 
     Return:
     {period_id: {
@@ -354,6 +533,70 @@ def compute_period_totals(
     }
     """
     res: dict[int, PeriodTotals] = {}
+
+    rows: Sequence[tuple[Period, PeriodSum | None]] = (
+        dbsession.query(Period, PeriodSum)
+        .outerjoin(PeriodSum, PeriodSum.period_id == Period.id)
+        .filter(
+            Period.owner_id == owner_id,
+            Period.id.in_(period_ids),
+        )
+        .all()
+    )
+    for period, ps in rows:
+        m = new_period_totals(period.start_circ, period.start_surplus)
+        if ps is not None:
+            p = m["internal_reconciled_delta"]
+            p["circ"] = ps.internal_reco_circ
+            p["surplus"] = ps.internal_reco_surplus
+            p["combined"] = ps.internal_reco_circ + ps.internal_reco_surplus
+
+            # Reconciled external movements contribute only to the
+            # circulation amount. The reconciled account entries provide
+            # the combined value; the surplus is the difference.
+            p = m["external_reconciled_delta"]
+            p["circ"] = ps.external_reco_circ
+            p["surplus"] = ps.reco_entries_delta - ps.external_reco_circ
+            p["combined"] = ps.reco_entries_delta
+
+            p = m["unreco_movements_delta"]
+            p["circ"] = ps.unreco_movements_circ
+            p["surplus"] = ps.unreco_movements_surplus
+            p["combined"] = ps.unreco_movements_circ + ps.unreco_movements_surplus
+
+            p = m["unreco_entries_delta"]
+            p["surplus"] = ps.unreco_entries_delta
+            p["combined"] = ps.unreco_entries_delta
+
+        finish_period_totals(m)
+        res[period.id] = m
+
+    if verify:
+        expect = recompute_period_totals(
+            dbsession=dbsession, owner_id=owner_id, period_ids=period_ids
+        )
+        mismatched = sorted(
+            period_id for period_id, m in expect.items() if res.get(period_id) != m
+        )
+        if mismatched:
+            raise PeriodSumMismatch(
+                "The stored period sums do not match the movements and "
+                "account entries of period(s) %s" % mismatched,
+                period_ids=mismatched,
+            )
+
+    return res
+
+
+def recompute_period_totals(
+    dbsession, owner_id: str, period_ids: Sequence[int]
+) -> dict[int, PeriodTotals]:
+    """Compute the period totals by aggregating all the period's rows.
+
+    This is slower than compute_period_totals(), which reads the period_sum
+    table, but it does not depend on the period_sum triggers.
+    """
+    res: dict[int, PeriodTotals] = {}
     zero = Decimal("0")
 
     # Get the period start balances.
@@ -375,50 +618,7 @@ def compute_period_totals(
         .all()
     )
     for row in rows0:
-        period_totals: PeriodTotals = {
-            # phase: {circ, surplus, combined}
-            "start": {
-                "circ": row.circ,
-                "surplus": row.surplus,
-                "combined": row.circ + row.surplus,
-            },
-            "internal_reconciled_delta": {
-                "circ": zero,
-                "surplus": zero,
-                "combined": zero,
-            },
-            "external_reconciled_delta": {
-                "circ": zero,
-                "surplus": zero,
-                "combined": zero,
-            },
-            "reconciled_delta": {  # sum of the internal and external
-                "circ": zero,
-                "surplus": zero,
-                "combined": zero,
-            },
-            "reconciled_total": {
-                "circ": zero,
-                "surplus": zero,
-                "combined": zero,
-            },
-            "unreco_movements_delta": {
-                "circ": zero,
-                "surplus": zero,
-                "combined": zero,
-            },
-            "unreco_entries_delta": {
-                "circ": zero,
-                "surplus": zero,
-                "combined": zero,
-            },
-            "end": {
-                "circ": zero,
-                "surplus": zero,
-                "combined": zero,
-            },
-        }
-        res[row.id] = period_totals
+        res[row.id] = new_period_totals(row.circ, row.surplus)
     del rows0
 
     # Gather the circulation amounts from reconciled movements.
@@ -538,23 +738,8 @@ def compute_period_totals(
         m["combined"] = row.circ + row.surplus
     del rows4
 
-    # Note that this code does not include unreco_entries_delta
-    # in the end totals. That's because there are two kinds of
-    # unreconciled account entries, the majority of which are represented by
-    # unreconciled movements that have been included in the totals already.
-    # Unreconciled account entries from sources other than movements will
-    # nearly always throw off the account surplus balance, which should make
-    # them obvious to the people performing reconciliation.
-
     for m in res.values():
-        for k in "circ", "surplus", "combined":
-            internal_reconciled = m["internal_reconciled_delta"][k]
-            external_reconciled = m["external_reconciled_delta"][k]
-            reconciled_delta = internal_reconciled + external_reconciled
-            m["reconciled_delta"][k] = reconciled_delta
-            reconciled_total = m["start"][k] + reconciled_delta
-            m["reconciled_total"][k] = reconciled_total
-            m["end"][k] = reconciled_total + m["unreco_movements_delta"][k]
+        finish_period_totals(m)
 
     return res
 
@@ -605,6 +790,66 @@ def get_period_for_day(
     return default
 
 
+class PeriodIndex:
+    """Find the period for many days without scanning the period list.
+
+    Build once from a list of periods, then call get() for each day.
+    get() returns the same period as get_period_for_day(). When the
+    periods don't overlap (the normal case for open periods), get()
+    uses a binary search over the sorted start dates. Otherwise it falls
+    back to scanning the list.
+    """
+
+    def __init__(self, period_list: Sequence[Period]):
+        self.period_list = list(period_list)
+
+        # get_period_for_day() falls back to the last endless period.
+        self.endless_period = None
+        for p in self.period_list:
+            if p.end_date is None:
+                self.endless_period = p
+
+        ordered = sorted(
+            self.period_list,
+            key=lambda p: (
+                p.start_date if p.start_date is not None else datetime.date.min
+            ),
+        )
+        self.overlapping = False
+        for prev, p in zip(ordered, ordered[1:]):
+            if (
+                prev.end_date is None
+                or p.start_date is None
+                or prev.end_date >= p.start_date
+            ):
+                self.overlapping = True
+                break
+
+        self.periods = ordered
+        self.start_dates = [
+            p.start_date if p.start_date is not None else datetime.date.min
+            for p in ordered
+        ]
+
+    def get(self, day: datetime.date, default_endless=True) -> Period | None:
+        """Identify which period matches a day. day can be None."""
+        if self.overlapping:
+            return get_period_for_day(
+                self.period_list, day, default_endless=default_endless
+            )
+
+        if day is not None:
+            pos = bisect.bisect_right(self.start_dates, day) - 1
+            if pos >= 0:
+                p = self.periods[pos]
+                if p.end_date is None or day <= p.end_date:
+                    return p
+
+        if default_endless:
+            return self.endless_period
+        return None
+
+
 def open_end_period_exists(request, file_id: int) -> bool:
     """Return true if an open period exists with no end date."""
     dbsession = request.dbsession
@@ -161,14 +161,28 @@ class OPNDrawer extends React.Component {
     }
 
     let changeCount = 0;
+    // jobId is set when the server syncs in the background.
+    let jobId = null;
 
     const syncBatch = () => {
-      const action = fOPNReco.fetchPath('/sync', { data: { tzname } });
+      const data = jobId ? { tzname, job_id: jobId } : { tzname };
+      const action = fOPNReco.fetchPath('/sync', { data });
       dispatch(action).then(status => {
-        changeCount += (status.change_count || 0);
+        if (status.job_id) {
+          // change_count is the total for the job.
+          jobId = status.job_id;
+          changeCount = status.change_count || 0;
+        } else {
+          changeCount += (status.change_count || 0);
+        }
         if (status.more) {
           dispatch(setSyncProgress(status.progress_percent));
-          syncBatch();
+          if (jobId) {
+            // Poll the background sync job.
+            window.setTimeout(syncBatch, 1000);
+          } else {
+            syncBatch();
+          }
         } else {
           // Done.
           dispatch(setSyncProgress(null, new Date()));